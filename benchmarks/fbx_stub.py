@@ -0,0 +1,535 @@
+# Pure Python stand-in for the FBX SDK bindings.
+#
+# Implements the subset of the `fbx` module used by bodylabs_rigger, with
+# just enough behaviour (translation-only transforms, control points,
+# polygons, clusters) for the rigging code to run end to end. Every SDK method
+# call is counted in `CALL_COUNTS`, keyed by 'Class.Method', so the volume of
+# SDK calls made by each stage can be tracked without the real SDK.
+#
+# Install the stub in place of the real module before importing the rigger:
+#
+#     import fbx_stub
+#     fbx_stub.install()
+
+import collections
+import json
+
+CALL_COUNTS = collections.Counter()
+
+IOSROOT = 'IOSRoot'
+EXP_FBX_EMBEDDED = 'Export|AdvOptGrp|Fbx|Material|Embedded'
+
+
+def reset_call_counts():
+    CALL_COUNTS.clear()
+
+
+def install():
+    """Registers this module as `fbx` in `sys.modules`."""
+    import sys
+    sys.modules['fbx'] = sys.modules[__name__]
+
+
+def _counted(cls):
+    """Class decorator which counts calls to SDK-style (capitalized) methods."""
+    import functools
+
+    def wrap(key, method):
+        @functools.wraps(method)
+        def counted_method(*args, **kwargs):
+            CALL_COUNTS[key] += 1
+            return method(*args, **kwargs)
+        return counted_method
+
+    for name, value in list(vars(cls).items()):
+        if not name[:1].isupper():
+            continue
+        if isinstance(value, staticmethod):
+            setattr(cls, name, staticmethod(
+                wrap(cls.__name__ + '.' + name, value.__func__)))
+        elif isinstance(value, classmethod):
+            setattr(cls, name, classmethod(
+                wrap(cls.__name__ + '.' + name, value.__func__)))
+        elif callable(value):
+            setattr(cls, name, wrap(cls.__name__ + '.' + name, value))
+    return cls
+
+
+@_counted
+class FbxVector2(object):
+    def __init__(self, x=0., y=0.):
+        self.values = (float(x), float(y))
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+
+@_counted
+class FbxVector4(object):
+    def __init__(self, x=0., y=0., z=0., w=1.):
+        if isinstance(x, (FbxVector4, FbxDouble4)):
+            x, y, z, w = x.values
+        self.values = (float(x), float(y), float(z), float(w))
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __iter__(self):
+        return iter(self.values)
+
+
+@_counted
+class FbxDouble4(FbxVector4):
+    pass
+
+
+@_counted
+class FbxAMatrix(object):
+    def __init__(self, other=None):
+        import numpy as np
+        if other is None:
+            self.m = np.eye(4)
+        else:
+            self.m = np.array(other.m)
+
+    def SetIdentity(self):
+        import numpy as np
+        self.m = np.eye(4)
+
+    def SetT(self, t):
+        self.m[3, :3] = t.values[:3]
+
+    def GetT(self):
+        return FbxVector4(*self.m[3, :3])
+
+    def Inverse(self):
+        import numpy as np
+        result = FbxAMatrix()
+        result.m = np.linalg.inv(self.m)
+        return result
+
+    def __mul__(self, other):
+        import numpy as np
+        result = FbxAMatrix()
+        result.m = np.dot(other.m, self.m)
+        return result
+
+
+@_counted
+class FbxMatrix(FbxAMatrix):
+    pass
+
+
+class FbxLayerElement(object):
+    eByControlPoint = 1
+    eByPolygonVertex = 2
+    eDirect = 0
+    eIndexToDirect = 2
+
+
+@_counted
+class FbxLayerElementArray(object):
+    def __init__(self):
+        self.values = []
+
+    def SetCount(self, count):
+        self.values = [None] * count
+
+    def GetCount(self):
+        return len(self.values)
+
+    def SetAt(self, index, value):
+        self.values[index] = value
+
+    def GetAt(self, index):
+        return self.values[index]
+
+
+class _Object(object):
+    def __init__(self, container, name):
+        self.name = name
+        self.container = container
+        self.destroyed = False
+        manager = container.GetFbxManager() if container else None
+        if manager is not None:
+            manager.objects.append(self)
+
+    @classmethod
+    def Create(cls, container, name):
+        return cls(container, name)
+
+    def GetName(self):
+        return self.name
+
+    def GetFbxManager(self):
+        return self.container.GetFbxManager()
+
+    def Copy(self, other):
+        import copy
+        for key, value in vars(other).items():
+            if key not in ('name', 'container', 'destroyed'):
+                setattr(self, key, copy.deepcopy(value))
+        return self
+
+    def Destroy(self):
+        self.destroyed = True
+
+
+@_counted
+class FbxManager(object):
+    def __init__(self):
+        self.objects = []
+        self.io_settings = None
+
+    @staticmethod
+    def Create():
+        return FbxManager()
+
+    def GetFbxManager(self):
+        return self
+
+    def SetIOSettings(self, ios):
+        self.io_settings = ios
+
+    def GetIOSettings(self):
+        return self.io_settings
+
+    def GetIOPluginRegistry(self):
+        return FbxIOPluginRegistry()
+
+    def Destroy(self):
+        for obj in self.objects:
+            obj.destroyed = True
+        self.objects = []
+
+
+@_counted
+class FbxIOPluginRegistry(object):
+    _WRITERS = ['FBX binary (*.fbx)', 'FBX ascii (*.fbx)']
+
+    def GetWriterFormatCount(self):
+        return len(FbxIOPluginRegistry._WRITERS)
+
+    def GetWriterFormatDescription(self, format_id):
+        return FbxIOPluginRegistry._WRITERS[format_id]
+
+    def FindWriterIDByDescription(self, description):
+        try:
+            return FbxIOPluginRegistry._WRITERS.index(description)
+        except ValueError:
+            return -1
+
+    def GetNativeWriterFormat(self):
+        return 0
+
+
+@_counted
+class FbxIOSettings(_Object):
+    def __init__(self, container, name):
+        super(FbxIOSettings, self).__init__(container, name)
+        self.props = {}
+
+    def SetBoolProp(self, name, value):
+        self.props[name] = value
+
+    def GetBoolProp(self, name, default):
+        return self.props.get(name, default)
+
+
+class _Property(object):
+    def __init__(self, value):
+        self.value = value
+
+    def Get(self):
+        return FbxDouble4(*self.value.values)
+
+    def Set(self, value):
+        CALL_COUNTS['FbxPropertyT.Set'] += 1
+        self.value = FbxDouble4(*value.values)
+
+
+@_counted
+class FbxNode(_Object):
+    def __init__(self, container, name):
+        super(FbxNode, self).__init__(container, name)
+        self.children = []
+        self.parent = None
+        self.attribute = None
+        self.LclTranslation = _Property(FbxDouble4(0., 0., 0., 0.))
+
+    def AddChild(self, node):
+        node.parent = self
+        self.children.append(node)
+
+    def GetChildCount(self):
+        return len(self.children)
+
+    def GetChild(self, index):
+        return self.children[index]
+
+    def GetParent(self):
+        return self.parent
+
+    def SetNodeAttribute(self, attribute):
+        self.attribute = attribute
+
+    def GetNodeAttribute(self):
+        return self.attribute
+
+    def EvaluateGlobalTransform(self):
+        matrix = FbxAMatrix()
+        node = self
+        while node is not None:
+            matrix.m[3, :3] += node.LclTranslation.value.values[:3]
+            node = node.parent
+        return matrix
+
+
+@_counted
+class FbxSkeleton(_Object):
+    eLimbNode = 3
+
+    def SetSkeletonType(self, skeleton_type):
+        self.skeleton_type = skeleton_type
+
+
+@_counted
+class FbxLayerElementUV(_Object):
+    def __init__(self, container, name):
+        super(FbxLayerElementUV, self).__init__(container, name)
+        self.index_array = FbxLayerElementArray()
+        self.direct_array = FbxLayerElementArray()
+
+    def SetMappingMode(self, mode):
+        self.mapping_mode = mode
+
+    def SetReferenceMode(self, mode):
+        self.reference_mode = mode
+
+    def GetIndexArray(self):
+        return self.index_array
+
+    def GetDirectArray(self):
+        return self.direct_array
+
+
+@_counted
+class FbxLayerElementNormal(FbxLayerElementUV):
+    pass
+
+
+@_counted
+class FbxMesh(_Object):
+    def __init__(self, container, name):
+        super(FbxMesh, self).__init__(container, name)
+        self.control_points = []
+        self.polygons = []
+        self.uv = None
+        self.normals = None
+        self.deformers = []
+        self.has_edges = False
+
+    def Copy(self, other):
+        # The topology and UV layer aren't modified after the copy, so they
+        # can be shared. The normals are set per mesh.
+        self.control_points = list(other.control_points)
+        self.polygons = other.polygons
+        self.uv = other.uv
+        self.normals = None
+        if other.normals is not None:
+            self.normals = FbxLayerElementNormal(None, '')
+            self.normals.mapping_mode = other.normals.mapping_mode
+            self.normals.reference_mode = other.normals.reference_mode
+            self.normals.direct_array.values = list(
+                other.normals.direct_array.values)
+        self.has_edges = other.has_edges
+        return self
+
+    def InitControlPoints(self, count):
+        self.control_points = [None] * count
+
+    def GetControlPointsCount(self):
+        return len(self.control_points)
+
+    def SetControlPointAt(self, point, index):
+        self.control_points[index] = point
+
+    def GetControlPointAt(self, index):
+        return self.control_points[index]
+
+    def BeginPolygon(self, index):
+        self.polygons.append([])
+
+    def AddPolygon(self, index):
+        self.polygons[-1].append(index)
+
+    def EndPolygon(self):
+        pass
+
+    def GetPolygonCount(self):
+        return len(self.polygons)
+
+    def BuildMeshEdgeArray(self):
+        self.has_edges = True
+
+    def GenerateNormals(self, overwrite, by_control_point):
+        self.normals = FbxLayerElementNormal(None, '')
+        self.normals.direct_array.SetCount(len(self.control_points))
+        return True
+
+    def CreateElementUV(self, name):
+        self.uv = FbxLayerElementUV(None, name)
+        return self.uv
+
+    def CreateElementNormal(self):
+        self.normals = FbxLayerElementNormal(None, '')
+        return self.normals
+
+    def GetElementNormal(self, index=0):
+        return self.normals
+
+    def AddDeformer(self, deformer):
+        self.deformers.append(deformer)
+
+
+@_counted
+class FbxCluster(_Object):
+    eNormalize = 0
+
+    def __init__(self, container, name):
+        super(FbxCluster, self).__init__(container, name)
+        self.indices = []
+        self.weights = []
+        self.link = None
+        self.link_mode = None
+        self.transform_matrix = None
+        self.transform_link_matrix = None
+
+    def Copy(self, other):
+        self.indices = list(other.indices)
+        self.weights = list(other.weights)
+        self.link_mode = other.link_mode
+        return self
+
+    def SetLink(self, node):
+        self.link = node
+
+    def GetLink(self):
+        return self.link
+
+    def SetLinkMode(self, mode):
+        self.link_mode = mode
+
+    def AddControlPointIndex(self, index, weight):
+        self.indices.append(index)
+        self.weights.append(weight)
+
+    def GetControlPointIndicesCount(self):
+        return len(self.indices)
+
+    def SetTransformMatrix(self, matrix):
+        self.transform_matrix = matrix
+
+    def SetTransformLinkMatrix(self, matrix):
+        self.transform_link_matrix = matrix
+
+
+@_counted
+class FbxSkin(_Object):
+    def __init__(self, container, name):
+        super(FbxSkin, self).__init__(container, name)
+        self.clusters = []
+
+    def AddCluster(self, cluster):
+        self.clusters.append(cluster)
+        return True
+
+    def GetClusterCount(self):
+        return len(self.clusters)
+
+
+@_counted
+class FbxPose(_Object):
+    def __init__(self, container, name):
+        super(FbxPose, self).__init__(container, name)
+        self.nodes = []
+
+    def SetIsBindPose(self, is_bind_pose):
+        self.is_bind_pose = is_bind_pose
+
+    def Add(self, node, matrix):
+        self.nodes.append((node, matrix))
+        return len(self.nodes) - 1
+
+
+@_counted
+class FbxScene(_Object):
+    def __init__(self, container, name):
+        super(FbxScene, self).__init__(container, name)
+        self.root = FbxNode(self, 'RootNode')
+        self.poses = []
+
+    def GetFbxManager(self):
+        return self.container
+
+    def GetRootNode(self):
+        return self.root
+
+    def GetPoseCount(self):
+        return len(self.poses)
+
+    def AddPose(self, pose):
+        self.poses.append(pose)
+
+
+def _describe_scene(scene):
+    """Returns a JSON serializable summary of a scene, for export."""
+    nodes = []
+
+    def visit(node):
+        attribute = node.GetNodeAttribute()
+        entry = {
+            'name': node.name,
+            'translation': list(node.LclTranslation.value.values[:3]),
+            'children': [c.name for c in node.children],
+        }
+        if isinstance(attribute, FbxMesh):
+            entry['control_points'] = [
+                list(p.values[:3]) for p in attribute.control_points
+                if p is not None]
+            entry['polygon_count'] = len(attribute.polygons)
+            if attribute.normals is not None:
+                entry['normals'] = [
+                    list(n.values[:3])
+                    for n in attribute.normals.direct_array.values
+                    if n is not None]
+        nodes.append(entry)
+        for child in node.children:
+            visit(child)
+
+    visit(scene.root)
+    return {'nodes': nodes}
+
+
+@_counted
+class FbxExporter(_Object):
+    def Initialize(self, path, file_format=-1, io_settings=None):
+        self.path = path
+        self.file_format = file_format
+        return True
+
+    def Export(self, scene):
+        with open(self.path, 'w') as f:
+            json.dump(_describe_scene(scene), f)
+        return True
+
+
+@_counted
+class FbxImporter(_Object):
+    def Initialize(self, path, file_format=-1, io_settings=None):
+        import os
+        self.path = path
+        return os.path.exists(path)
+
+    def Import(self, scene):
+        return True
@@ -0,0 +1,249 @@
+# Times each stage of the rigging pipeline.
+#
+# Runs against the real FBX SDK when it is installed, and otherwise against
+# the pure Python stand-in in `fbx_stub.py`, which also counts the SDK calls
+# made by each stage. Results are written as JSON so they can be compared
+# between commits:
+#
+#     python benchmarks/rigging.py --output before.json
+#     # ... make some changes ...
+#     python benchmarks/rigging.py --output after.json --compare before.json
+#
+# Timings with the stub measure the Python side of each stage; SDK call
+# counts are exact for either backend.
+
+
+def _install_backend(backend):
+    """Makes the requested FBX backend importable as `fbx`.
+
+    Returns the name of the backend in use.
+    """
+    import os
+    import sys
+
+    if backend in ('auto', 'fbx'):
+        try:
+            import fbx  # noqa
+            return 'fbx'
+        except ImportError:
+            if backend == 'fbx':
+                raise
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import fbx_stub
+    fbx_stub.install()
+    return 'stub'
+
+
+def synthetic_bodies(num_bodies, num_vertices, seed=0):
+    """Returns an NxVx3 array of random vertices in centimeter units."""
+    import numpy as np
+
+    random_state = np.random.RandomState(seed)
+    scale = np.array([60., 180., 30.])
+    return random_state.uniform(-0.5, 0.5, (num_bodies, num_vertices, 3)) * (
+        scale)
+
+
+def synthetic_obj(vertices):
+    """Returns OBJ text with the given vertices and quad faces."""
+    lines = ['v {:.6f} {:.6f} {:.6f}'.format(*v) for v in vertices]
+    lines.extend(
+        'f {} {} {} {}'.format(*range(fi, fi + 4))
+        for fi in range(1, len(vertices) - 3))
+    return '\n'.join(lines) + '\n'
+
+
+class StageTimer(object):
+    """Collects wall times and SDK call counts per named stage."""
+
+    def __init__(self):
+        self._times = {}
+        self._calls = {}
+
+    def time(self, stage, fn, *args, **kwargs):
+        """Calls `fn`, recording its wall time and SDK calls under `stage`.
+
+        Returns the result of `fn`.
+        """
+        import time
+        from bodylabs_rigger.instrumentation import sdk_call_count
+
+        calls_before = sdk_call_count()
+        start = time.time()
+        result = fn(*args, **kwargs)
+        elapsed = time.time() - start
+        calls_after = sdk_call_count()
+
+        self._times.setdefault(stage, []).append(elapsed)
+        if calls_before is not None:
+            self._calls.setdefault(stage, []).append(
+                calls_after - calls_before)
+        return result
+
+    def summary(self):
+        import numpy as np
+
+        summary = {}
+        for stage, times in self._times.iteritems():
+            times = np.array(times) * 1000.
+            summary[stage] = {
+                'runs': len(times),
+                'mean_ms': float(times.mean()),
+                'median_ms': float(np.median(times)),
+                'min_ms': float(times.min()),
+                'max_ms': float(times.max()),
+            }
+            if stage in self._calls:
+                summary[stage]['sdk_calls'] = int(
+                    np.mean(self._calls[stage]))
+        return summary
+
+
+def run_benchmarks(num_bodies, output_directory):
+    import os
+    import bodylabs_rigger.static
+    from fbx import FbxScene
+    from bodylabs_rigger.bodykit.mesh_generator import MeshGenerator
+    from bodylabs_rigger.factory import RiggedModelFactory
+    from bodylabs_rigger.fbx_util import (
+        create_fbx_manager,
+        export_fbx_scene,
+    )
+    from bodylabs_rigger.rig_assets import RigAssets
+
+    timer = StageTimer()
+    static_dir = os.path.dirname(bodylabs_rigger.static.__file__)
+    for extension in ['json', 'bin']:
+        for _ in range(num_bodies):
+            assets = timer.time(
+                'rig_assets_load_{}'.format(extension), RigAssets.load,
+                os.path.join(static_dir, 'rig_assets.' + extension))
+
+    factory = RiggedModelFactory(**assets.__dict__)
+    num_vertices = int(assets.textured_mesh.faces.max()) + 1
+    bodies = synthetic_bodies(num_bodies, num_vertices)
+
+    mesh_generator = MeshGenerator('benchmark', 'benchmark')
+    for v in bodies:
+        timer.time(
+            'parse_vertices', mesh_generator._parse_vertices,
+            synthetic_obj(v))
+
+    timer.time(
+        'calculate_joint_positions_batch',
+        factory._joint_position_solver.solve, bodies)
+
+    fbx_manager = create_fbx_manager()
+    # The template is built once per FbxManager.
+    timer.time('build_template', factory._get_template, fbx_manager)
+
+    for bi, v in enumerate(bodies):
+        fbx_scene = FbxScene.Create(fbx_manager, '')
+        root = fbx_scene.GetRootNode()
+        joint_positions = timer.time(
+            'calculate_joint_positions',
+            factory._joint_position_solver.solve, v)
+        world_positions, local_translations = timer.time(
+            'calculate_skeleton_translations',
+            factory._skeleton_translation_maps, joint_positions)
+        fbx_node_map = timer.time(
+            'extend_skeleton', factory._extend_skeleton,
+            root, factory._joint_tree, local_translations, fbx_scene)
+        fbx_mesh_node = timer.time(
+            'set_mesh', factory._set_mesh, v, fbx_scene, root)
+        timer.time(
+            'add_skin_and_bind_pose', factory._add_skin_and_bind_pose,
+            fbx_node_map, fbx_mesh_node, fbx_scene, world_positions)
+        timer.time(
+            'export_fbx_scene', export_fbx_scene, fbx_manager, fbx_scene,
+            os.path.join(output_directory, 'body_{}.fbx'.format(bi)))
+        fbx_scene.Destroy()
+
+    for v in bodies:
+        fbx_scene = timer.time(
+            'construct_rig', factory.construct_rig, v, fbx_manager)
+        fbx_scene.Destroy()
+
+    fbx_manager.Destroy()
+    return timer.summary()
+
+
+def _git_revision():
+    import subprocess
+
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_comparison(stages, baseline_stages):
+    print '{:<36} {:>12} {:>12} {:>8}'.format(
+        'stage', 'baseline ms', 'current ms', 'ratio')
+    for stage in sorted(stages):
+        current = stages[stage]['median_ms']
+        baseline = baseline_stages.get(stage, {}).get('median_ms')
+        if baseline is None:
+            print '{:<36} {:>12} {:>12.3f} {:>8}'.format(
+                stage, '-', current, '-')
+        else:
+            print '{:<36} {:>12.3f} {:>12.3f} {:>8.2f}'.format(
+                stage, baseline, current, current / baseline)
+
+
+def main():
+    import argparse
+    import json
+    import platform
+    import shutil
+    import tempfile
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--num_bodies', default=10, type=int, required=False,
+        help='The number of synthetic bodies to rig.')
+    parser.add_argument(
+        '--backend', default='auto', choices=['auto', 'fbx', 'stub'],
+        help='The FBX backend. "auto" uses the SDK if it is installed.')
+    parser.add_argument(
+        '--output', default=None, required=False,
+        help='The JSON file to which results are written.')
+    parser.add_argument(
+        '--compare', default=None, required=False,
+        help='A JSON results file to compare against.')
+    args = parser.parse_args()
+
+    backend = _install_backend(args.backend)
+
+    output_directory = tempfile.mkdtemp()
+    try:
+        stages = run_benchmarks(args.num_bodies, output_directory)
+    finally:
+        shutil.rmtree(output_directory)
+
+    results = {
+        'backend': backend,
+        'num_bodies': args.num_bodies,
+        'git_revision': _git_revision(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'stages': stages,
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        _print_comparison(stages, baseline['stages'])
+    else:
+        print json.dumps(results, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
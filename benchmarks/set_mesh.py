@@ -0,0 +1,116 @@
+# Compares building the rig mesh element by element against copying the
+# prebuilt mesh template.
+#
+# Requires the Python FBX SDK.
+#
+#     python benchmarks/set_mesh.py --num_meshes 20
+
+
+def set_mesh_per_element(textured_mesh, v, fbx_scene, root):
+    """The original mesh construction, for reference.
+
+    Every control point, polygon vertex and UV element is passed to the SDK
+    individually.
+    """
+    from fbx import (
+        FbxLayerElement,
+        FbxMesh,
+        FbxNode,
+        FbxVector2,
+        FbxVector4,
+    )
+
+    fbx_mesh_node = FbxNode.Create(fbx_scene, textured_mesh.name)
+    root.AddChild(fbx_mesh_node)
+
+    fbx_mesh = FbxMesh.Create(fbx_scene, '')
+    fbx_mesh_node.SetNodeAttribute(fbx_mesh)
+
+    num_vertices = v.shape[0]
+    fbx_mesh.InitControlPoints(num_vertices)
+    for vi in range(num_vertices):
+        fbx_mesh.SetControlPointAt(FbxVector4(*v[vi, :]), vi)
+
+    faces = textured_mesh.faces.tolist()
+    for fi, face in enumerate(faces):
+        fbx_mesh.BeginPolygon(fi)
+        for vi in face:
+            fbx_mesh.AddPolygon(vi)
+        fbx_mesh.EndPolygon()
+    fbx_mesh.BuildMeshEdgeArray()
+
+    fbx_mesh.GenerateNormals(False, True)
+
+    uv_indices = textured_mesh.uv_indices.ravel().tolist()
+    uv_values = textured_mesh.uv_values.tolist()
+    uv = fbx_mesh.CreateElementUV('')
+    uv.SetMappingMode(FbxLayerElement.eByPolygonVertex)
+    uv.SetReferenceMode(FbxLayerElement.eIndexToDirect)
+    index_array = uv.GetIndexArray()
+    direct_array = uv.GetDirectArray()
+    index_array.SetCount(len(uv_indices))
+    direct_array.SetCount(len(uv_values))
+    for ei, uvi in enumerate(uv_indices):
+        index_array.SetAt(ei, uvi)
+        direct_array.SetAt(uvi, FbxVector2(*uv_values[uvi]))
+
+    return fbx_mesh_node
+
+
+def time_mesh_construction(set_mesh, meshes, fbx_manager):
+    """Returns the mean number of seconds `set_mesh` takes per mesh."""
+    import time
+    from fbx import FbxScene
+
+    elapsed = 0.
+    for v in meshes:
+        fbx_scene = FbxScene.Create(fbx_manager, '')
+        start = time.time()
+        set_mesh(v, fbx_scene, fbx_scene.GetRootNode())
+        elapsed += time.time() - start
+        fbx_scene.Destroy()
+    return elapsed / len(meshes)
+
+
+def main():
+    import argparse
+    import numpy as np
+    from bodylabs_rigger.factory import RiggedModelFactory
+    from bodylabs_rigger.fbx_util import create_fbx_manager
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--num_meshes', default=20, type=int, required=False,
+        help='The number of meshes to build with each method.')
+    args = parser.parse_args()
+
+    factory = RiggedModelFactory.create_default()
+    textured_mesh = factory._textured_mesh
+    num_vertices = int(textured_mesh.faces.max()) + 1
+    meshes = [
+        np.random.uniform(-50., 50., size=(num_vertices, 3))
+        for _ in range(args.num_meshes)
+    ]
+
+    manager = create_fbx_manager()
+
+    def per_element(v, fbx_scene, root):
+        return set_mesh_per_element(textured_mesh, v, fbx_scene, root)
+
+    before = time_mesh_construction(per_element, meshes, manager)
+
+    # Build the template outside of the timed loop, as a long running
+    # factory would.
+    factory._get_template(manager)
+    after = time_mesh_construction(factory._set_mesh, meshes, manager)
+
+    print 'Per-element mesh construction: {:.2f} ms/mesh'.format(
+        before * 1000.)
+    print 'Template mesh construction:    {:.2f} ms/mesh'.format(
+        after * 1000.)
+    print 'Speedup: {:.1f}x'.format(before / after)
+    manager.Destroy()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+# A memory-mapped archive format for large batches of bodies.
+#
+# Keeping millions of bodies as separate files makes batch jobs slow to list,
+# open and parse. A body archive stores them in one file instead:
+#
+#     magic          8 bytes, `_MAGIC`
+#     header_offset  little-endian uint64
+#     header_size    little-endian uint64
+#     vertices       NxVx3 little-endian float32, in centimeter units
+#     ids            N fixed-width UTF-8 body ids, in body order
+#     index_ids      the same ids, sorted
+#     index_bodies   int64, the body index of each sorted id
+#     header         UTF-8 JSON with the number of bodies and vertices and
+#                    an array table giving the dtype, shape and file offset
+#                    of each array
+#
+# Each array is aligned to `_ALIGNMENT` bytes. The header comes last so the
+# writer can stream bodies without knowing how many there will be.
+#
+# The reader memory-maps the file, so bodies and chunks of bodies are views
+# of the file rather than copies, the process only holds the pages it is
+# using, and looking up a body by id is a binary search of the index:
+#
+#     with BodyArchiveWriter('bodies.bodies') as writer:
+#         for body_id, vertices in bodies:
+#             writer.add(body_id, vertices)
+#
+#     archive = BodyArchive('bodies.bodies')
+#     for ids, vertices in archive.iter_chunks(1024):
+#         joint_positions = solver.solve(vertices)  # vertices is NxVx3
+#     vertices = archive.get('some-body-id')
+#
+# To pack vertex files (see `vertex_io.py`) into an archive:
+#
+#     python -m bodylabs_rigger.body_archive bodies.bodies meshes/
+
+_MAGIC = b'BLBODYA1'
+_ALIGNMENT = 64
+
+BODY_ARCHIVE_EXTENSION = '.bodies'
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+class BodyArchiveWriter(object):
+    """Writes bodies to a new archive, one at a time or in stacks."""
+
+    def __init__(self, path, num_vertices=None):
+        """Initializes the BodyArchiveWriter.
+
+        path: the archive to create. An existing file is overwritten.
+        num_vertices: the number of vertices of every body. Defaults to
+            that of the first body added.
+        """
+        import os
+
+        self.path = os.path.expanduser(path)
+        self._num_vertices = num_vertices
+        self._ids = []
+        self._seen_ids = set()
+        self._file = open(self.path, 'wb')
+        # The header offset stays zero until the archive is closed.
+        self._file.write(_MAGIC)
+        self._file.write(b'\0' * (_ALIGNMENT - len(_MAGIC)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, body_id, vertices):
+        """Adds a body.
+
+        body_id: a unique string identifying the body
+        vertices: a Vx3 array in centimeter units
+        """
+        self.add_many([body_id], [vertices])
+
+    def add_many(self, body_ids, vertices):
+        """Adds a stack of bodies.
+
+        body_ids: a unique string for each body. Ids can't end with a null
+            character, which the fixed-width id arrays use as padding.
+        vertices: an NxVx3 array in centimeter units
+
+        If the bodies are rejected, none of them are added.
+        """
+        import numpy as np
+
+        vertices = np.asarray(vertices, dtype='<f4')
+        num_vertices = self._num_vertices
+        if num_vertices is None and vertices.ndim == 3:
+            num_vertices = vertices.shape[1]
+        if vertices.shape != (len(body_ids), num_vertices, 3):
+            raise ValueError(
+                'Expected {} bodies of {}x3 vertices, got shape {}.'.format(
+                    len(body_ids), num_vertices, vertices.shape))
+        encoded_ids = []
+        batch_ids = set()
+        for body_id in body_ids:
+            if not isinstance(body_id, bytes):
+                body_id = body_id.encode('utf-8')
+            if (not body_id or body_id in self._seen_ids or
+                    body_id in batch_ids):
+                raise ValueError(
+                    'Body ids must be unique and non-empty: {!r}'.format(
+                        body_id))
+            if body_id.endswith(b'\0'):
+                raise ValueError(
+                    "Body ids can't end with a null character: {!r}".format(
+                        body_id))
+            batch_ids.add(body_id)
+            encoded_ids.append(body_id)
+
+        self._file.write(np.ascontiguousarray(vertices).tobytes())
+        self._num_vertices = num_vertices
+        self._seen_ids.update(batch_ids)
+        self._ids.extend(encoded_ids)
+
+    def close(self):
+        """Writes the index and header, and closes the file."""
+        import json
+        import struct
+        import numpy as np
+
+        if self._file.closed:
+            return
+        id_width = max([len(body_id) for body_id in self._ids] or [1])
+        ids = np.array(self._ids, dtype='S{}'.format(id_width))
+        order = np.argsort(ids, kind='mergesort')
+        arrays = [
+            ('ids', ids),
+            ('index_ids', ids[order]),
+            ('index_bodies', order.astype('<i8')),
+        ]
+
+        header = {
+            'num_bodies': len(self._ids),
+            'num_vertices': self._num_vertices or 0,
+            'arrays': {
+                'vertices': {
+                    'dtype': '<f4',
+                    'shape': [len(self._ids), self._num_vertices or 0, 3],
+                    'offset': _ALIGNMENT,
+                },
+            },
+        }
+        f = self._file
+        for name, a in arrays:
+            offset = _align(f.tell())
+            f.write(b'\0' * (offset - f.tell()))
+            header['arrays'][name] = {
+                'dtype': a.dtype.str,
+                'shape': list(a.shape),
+                'offset': offset,
+            }
+            f.write(a.tobytes())
+
+        header_offset = f.tell()
+        header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+        f.write(header_bytes)
+        f.seek(0)
+        f.write(_MAGIC)
+        f.write(struct.pack('<QQ', header_offset, len(header_bytes)))
+        f.close()
+
+
+class BodyArchive(object):
+    """Reads a memory-mapped body archive."""
+
+    def __init__(self, path):
+        import json
+        import os
+        import struct
+        import numpy as np
+
+        self.path = os.path.expanduser(path)
+        data = np.memmap(self.path, dtype=np.uint8, mode='r')
+        preamble = data[:len(_MAGIC) + 16].tobytes()
+        if not preamble.startswith(_MAGIC):
+            raise ValueError('Not a body archive: {}'.format(path))
+        header_offset, header_size = struct.unpack(
+            '<QQ', preamble[len(_MAGIC):])
+        if header_offset == 0:
+            raise ValueError(
+                'Incomplete body archive (was the writer closed?): '
+                '{}'.format(path))
+        header = json.loads(
+            data[header_offset:header_offset + header_size].tobytes().decode(
+                'utf-8'))
+
+        arrays = {}
+        for name, info in header['arrays'].iteritems():
+            dtype = np.dtype(str(info['dtype']))
+            shape = tuple(info['shape'])
+            start = info['offset']
+            stop = start + dtype.itemsize * int(np.prod(shape))
+            arrays[name] = data[start:stop].view(dtype).reshape(shape)
+
+        self.num_vertices = header['num_vertices']
+        self.vertices = arrays['vertices']
+        self._ids = arrays['ids']
+        self._index_ids = arrays['index_ids']
+        self._index_bodies = arrays['index_bodies']
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def __getitem__(self, index):
+        """Returns the Vx3 vertices of the body at an index."""
+        return self.vertices[index]
+
+    def body_id(self, index):
+        return self._ids[index].decode('utf-8')
+
+    def index_of(self, body_id):
+        """Returns the index of a body, raising KeyError if it isn't in the
+        archive.
+        """
+        import numpy as np
+
+        if not isinstance(body_id, bytes):
+            body_id = body_id.encode('utf-8')
+        i = int(np.searchsorted(self._index_ids, body_id))
+        if i == len(self._index_ids) or self._index_ids[i] != body_id:
+            raise KeyError(body_id)
+        return int(self._index_bodies[i])
+
+    def get(self, body_id):
+        """Returns the Vx3 vertices of a body, by id."""
+        return self.vertices[self.index_of(body_id)]
+
+    def iter_chunks(self, chunk_size=1024, start=0, stop=None):
+        """Yields (body ids, NxVx3 vertices) for consecutive chunks of
+        bodies, from index `start` up to `stop`.
+
+        The vertices are read-only views of the archive.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        for chunk_start in range(start, stop, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, stop)
+            body_ids = [
+                body_id.decode('utf-8')
+                for body_id in self._ids[chunk_start:chunk_stop]]
+            yield body_ids, self.vertices[chunk_start:chunk_stop]
+
+    def __iter__(self):
+        """Yields (body id, Vx3 vertices) for each body."""
+        for body_ids, vertices in self.iter_chunks():
+            for body_id, body_vertices in zip(body_ids, vertices):
+                yield body_id, body_vertices
+
+
+def main():
+    import argparse
+    from bodylabs_rigger.vertex_io import iter_vertex_files
+
+    parser = argparse.ArgumentParser(
+        description='Pack vertex files into a body archive.')
+    parser.add_argument('archive_path', help='The archive to write.')
+    parser.add_argument(
+        'inputs', nargs='+',
+        help=('Vertex files (.npy or .obj), directories of vertex files or '
+              'glob patterns. Each body is identified by its file name, '
+              'without the extension.'))
+    args = parser.parse_args()
+
+    with BodyArchiveWriter(args.archive_path) as writer:
+        for name, vertices in iter_vertex_files(args.inputs):
+            writer.add(name, vertices)
+    print 'Wrote {} bodies to {}.'.format(len(writer), args.archive_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Generates many meshes at once using concurrent BodyKit requests.
+#
+# Example usage:
+#
+#     generator = ConcurrentMeshGenerator(
+#         access_key, secret, max_concurrency=8)
+#     for index, mesh in generator.iter_random_meshes(100):
+#         if mesh is not None:
+#             ...
+#
+# Requests run on a pool of threads which share the generator's keep-alive
+# connection pool, and meshes are yielded in the order they arrive.
+
+from bodylabs_rigger.bodykit.mesh_generator import MeshGenerator
+
+
+class ConcurrentMeshGenerator(MeshGenerator):
+    """A MeshGenerator which fetches many meshes concurrently."""
+
+    def __init__(self, bodykit_access_key, bodykit_secret, max_concurrency=8,
+                 **kwargs):
+        """Initializes the ConcurrentMeshGenerator.
+
+        max_concurrency: the maximum number of requests in flight at once.
+        kwargs: passed through to MeshGenerator.
+        """
+        kwargs.setdefault('max_connections', max_concurrency)
+        super(ConcurrentMeshGenerator, self).__init__(
+            bodykit_access_key, bodykit_secret, **kwargs)
+        self._max_concurrency = max_concurrency
+
+    def iter_meshes(self, mesh_requests):
+        """Fetches meshes concurrently.
+
+        mesh_requests: an iterable of (measurements, unit_system, gender)
+            tuples, as taken by `get_mesh_for_measurements`. It is consumed
+            lazily, so at most `max_concurrency` requests are pending at
+            once.
+
+        Yields (index, mesh) pairs in the order the meshes arrive, where
+        index is the position of the request in `mesh_requests` and mesh is
+        a Vx3 numpy array, or None if the request failed.
+        """
+        import Queue
+        from multiprocessing.pool import ThreadPool
+
+        completed = Queue.Queue()
+
+        def fetch(index, mesh_request):
+            try:
+                completed.put(
+                    (index, self.get_mesh_for_measurements(*mesh_request)))
+            except Exception:
+                completed.put((index, None))
+                raise
+
+        pool = ThreadPool(self._max_concurrency)
+        try:
+            in_flight = 0
+            for index, mesh_request in enumerate(mesh_requests):
+                if in_flight == self._max_concurrency:
+                    yield completed.get()
+                    in_flight -= 1
+                pool.apply_async(fetch, (index, mesh_request))
+                in_flight += 1
+            for _ in range(in_flight):
+                yield completed.get()
+        finally:
+            pool.terminate()
+
+    def get_meshes_for_measurements(self, mesh_requests):
+        """Fetches meshes concurrently.
+
+        mesh_requests: a sequence of (measurements, unit_system, gender)
+            tuples.
+
+        Returns a list of meshes in request order. Failed requests are None.
+        """
+        meshes = [None] * len(mesh_requests)
+        for index, mesh in self.iter_meshes(mesh_requests):
+            meshes[index] = mesh
+        return meshes
+
+    def iter_random_meshes(self, num_meshes):
+        """Fetches meshes for random measurements concurrently.
+
+        The random measurements are drawn up front on the calling thread, so
+        they are reproducible for a given access key.
+
+        Yields (index, mesh) pairs in the order the meshes arrive.
+        """
+        mesh_requests = [
+            self._random_mesh_request() for _ in range(num_meshes)]
+        return self.iter_meshes(mesh_requests)
@@ -0,0 +1,151 @@
+# On-disk cache for generated meshes.
+#
+# Meshes are keyed by a hash of the BodyKit request parameters and stored as
+# compressed numpy files. Entries are written to a temporary file and renamed
+# into place, so concurrent processes never observe a partial entry, and the
+# least recently used entries are evicted once the cache exceeds its size
+# limit.
+#
+# Example usage:
+#
+#     cache = MeshCache('~/.cache/bodylabs_rigger/meshes', max_bytes=2 ** 30)
+#     mesh_generator = MeshGenerator(access_key, secret, cache=cache)
+#
+# Any object with the same `get` and `put` methods can be used as a cache.
+
+
+class MeshCache(object):
+    """A size-bounded LRU cache of mesh vertices on disk."""
+
+    _ENTRY_EXTENSION = '.npz'
+    _LOCK_FILENAME = '.lock'
+
+    def __init__(self, directory, max_bytes=None):
+        """Initializes the MeshCache.
+
+        directory: the directory in which entries are stored. It is created
+            if it doesn't exist.
+        max_bytes: if not None, the least recently used entries are evicted
+            to keep the total size of the entries below this limit.
+        """
+        import os
+
+        self._directory = os.path.expanduser(directory)
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(self._directory):
+            try:
+                os.makedirs(self._directory)
+            except OSError:
+                # Another process may have created it first.
+                if not os.path.isdir(self._directory):
+                    raise
+
+    @staticmethod
+    def key(params):
+        """Returns the cache key for JSON serializable request parameters."""
+        import hashlib
+        import json
+
+        return hashlib.sha1(
+            json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        import os
+
+        return os.path.join(
+            self._directory, key + MeshCache._ENTRY_EXTENSION)
+
+    def get(self, key):
+        """Returns the cached Vx3 vertices for the key, or None."""
+        import os
+        import numpy as np
+
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as entry:
+                vertices = entry['vertices']
+            # Mark the entry as recently used.
+            os.utime(path, None)
+        except (IOError, OSError, KeyError, ValueError):
+            # Missing, or evicted by another process while we read it.
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return vertices
+
+    def put(self, key, vertices):
+        """Stores the vertices under the key."""
+        import os
+        import tempfile
+        import numpy as np
+
+        fd, temp_path = tempfile.mkstemp(
+            dir=self._directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, vertices=vertices)
+            os.rename(temp_path, self._entry_path(key))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        if self._max_bytes is not None:
+            self._evict()
+
+    def _entries(self):
+        """Returns a list of (mtime, size, path) for each cache entry."""
+        import os
+
+        entries = []
+        for filename in os.listdir(self._directory):
+            if not filename.endswith(MeshCache._ENTRY_EXTENSION):
+                continue
+            path = os.path.join(self._directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        """Removes the least recently used entries over the size limit."""
+        import fcntl
+        import os
+
+        with open(os.path.join(
+                self._directory, MeshCache._LOCK_FILENAME), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = sorted(self._entries())
+                total_bytes = sum(size for _, size, _ in entries)
+                for _, size, path in entries:
+                    if total_bytes <= self._max_bytes:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    total_bytes -= size
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @property
+    def size_bytes(self):
+        """The total size of the cache entries."""
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self):
+        """Removes every entry."""
+        import os
+
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -7,9 +7,34 @@
 class MeshGenerator(object):
     _BODYKIT_MESH_ENDPOINT = 'https://api.bodylabs.com/instant/mesh'
     _EXPECTED_VERTICES_PER_MESH = 4916
-
-    def __init__(self, bodykit_access_key, bodykit_secret):
+    # Responses which indicate a transient failure worth retrying.
+    _RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+    # Matches a vertex line, capturing its three coordinates. Lines with any
+    # other number of coordinates are skipped.
+    _VERTEX_LINE_PATTERN = r'^v (\S+ \S+ \S+)\r?$'
+
+    def __init__(self, bodykit_access_key, bodykit_secret, endpoint=None,
+                 max_retries=3, retry_backoff=0.5, max_connections=10,
+                 cache=None, timeout=(10., 60.)):
+        """Initializes the MeshGenerator.
+
+        endpoint: the URL of the mesh endpoint. Defaults to the BodyKit
+            Instant API, but may point e.g. at a local stub server.
+        max_retries: the number of times a request is retried after a
+            connection error or a 429/5xx response.
+        retry_backoff: the delay in seconds before the first retry. The
+            delay doubles with every further retry, unless the server sends a
+            Retry-After header.
+        max_connections: the number of keep-alive connections to the
+            endpoint which are kept open for reuse.
+        cache: an optional MeshCache (see `mesh_cache.py`) in which to look
+            up meshes before requesting them.
+        timeout: the (connect, read) timeouts of each request, in seconds.
+            The read timeout bounds the wait for each chunk of the response,
+            so a stalled server fails the attempt, which is then retried.
+        """
         import random
+        import requests
 
         self._api_access_key = bodykit_access_key
         self._api_secret = bodykit_secret
@@ -17,17 +42,64 @@ class MeshGenerator(object):
             'Authorization': 'SecretPair accesskey={},secret={}'.format(
                 bodykit_access_key, bodykit_secret)
         }
+        self._endpoint = endpoint or MeshGenerator._BODYKIT_MESH_ENDPOINT
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._cache = cache
+        self._timeout = timeout
+
+        # Reuse connections across requests rather than opening a new one
+        # for every mesh.
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_connections)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
 
         random.seed(self._api_access_key)
 
-    def _request_mesh_obj(self, measurements, unit_system, gender):
-        """Requests a mesh from measurements.
+    def _retry_delay(self, attempt, response=None):
+        """Returns the number of seconds to wait before retrying."""
+        if response is not None:
+            try:
+                return float(response.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                pass
+        return self._retry_backoff * (2 ** attempt)
 
-        Returns a mesh in OBJ format or None if the request failed.
+    def _post_with_retries(self, params, stream=False):
+        """POSTs a mesh request, retrying transient failures.
+
+        stream: if True, the response body is not downloaded up front.
+
+        Returns the successful response.
         """
+        import time
         import requests
 
-        params = {
+        for attempt in range(self._max_retries + 1):
+            is_last_attempt = attempt == self._max_retries
+            try:
+                response = self._session.post(
+                    self._endpoint, headers=self._api_headers, json=params,
+                    stream=stream, timeout=self._timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if is_last_attempt:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                continue
+
+            if (response.status_code in MeshGenerator._RETRY_STATUS_CODES and
+                    not is_last_attempt):
+                response.close()
+                time.sleep(self._retry_delay(attempt, response))
+                continue
+            if response.status_code != 200:
+                response.raise_for_status()
+            return response
+
+    def _mesh_request_params(self, measurements, unit_system, gender):
+        return {
             'measurements': measurements,
             'unitSystem': unit_system,
             'gender': gender,
@@ -39,40 +111,26 @@ class MeshGenerator(object):
             'meshFaces': 'quads',
         }
 
-        response = requests.post(MeshGenerator._BODYKIT_MESH_ENDPOINT,
-                                 headers=self._api_headers,
-                                 json=params)
-        if response.status_code != 200:
-            response.raise_for_status()
-        return response.text
+    def _request_mesh_obj(self, measurements, unit_system, gender):
+        """Requests a mesh from measurements.
 
-    def _parse_vertices(self, mesh_obj):
-        """Parses the vertices from an OBJ mesh string.
+        Returns a mesh in OBJ format or None if the request failed.
+        """
+        params = self._mesh_request_params(measurements, unit_system, gender)
+        return self._post_with_retries(params).text
 
-        For background on the OBJ format, see
-            http://en.wikipedia.org/wiki/Wavefront_.obj_file
+    @classmethod
+    def _parse_vertex_lines(cls, vertex_coords):
+        """Parses the coordinates of OBJ vertex lines.
+
+        vertex_coords: an iterable over the 'x y z' text of each vertex line
 
         Returns a Vx3 numpy array, where V is the number of vertices.
         """
-        import re
         import numpy as np
 
-        vertex_line_re = re.compile(r'^v (\S+) (\S+) (\S+)$')
-        vertices = []
-        for line in mesh_obj.split('\n'):
-            vertex_match = re.match(vertex_line_re, line)
-            if vertex_match is None:
-                continue
-            try:
-                vertices.extend([
-                    float(coord) for coord in vertex_match.groups()
-                ])
-            except ValueError:
-                raise ValueError(
-                    "Failed to parse float in vertex line: '{}'".format(line))
-
-        # Since we parsed the line, we can assume this is evenly divisible.
-        num_vertices = len(vertices) / 3
+        vertex_coords = list(vertex_coords)
+        num_vertices = len(vertex_coords)
 
         # Since the mesh topology doesn't change, we can double check our
         # line parsing by verifying the expected number of vertices.
@@ -81,25 +139,105 @@ class MeshGenerator(object):
                 'Mesh has wrong number of vertices: {} vs {}'.format(
                     num_vertices, MeshGenerator._EXPECTED_VERTICES_PER_MESH))
 
-        return np.array(vertices).reshape(-1, 3)
+        # Convert all coordinates in a single pass.
+        try:
+            vertices = np.array(
+                ' '.join(vertex_coords).split(), dtype=np.float64)
+        except ValueError:
+            # Find the offending line for the error message.
+            for coords in vertex_coords:
+                try:
+                    [float(coord) for coord in coords.split()]
+                except ValueError:
+                    raise ValueError(
+                        "Failed to parse float in vertex line: 'v {}'".format(
+                            coords))
+            raise
+
+        return vertices.reshape(-1, 3)
+
+    @classmethod
+    def _parse_vertices(cls, mesh_obj):
+        """Parses the vertices from an OBJ mesh string.
+
+        For background on the OBJ format, see
+            http://en.wikipedia.org/wiki/Wavefront_.obj_file
+
+        Returns a Vx3 numpy array, where V is the number of vertices.
+        """
+        import re
+
+        # Only pull out the vertex lines, skipping the texture and face lines
+        # which make up most of the file.
+        vertex_line_re = re.compile(
+            MeshGenerator._VERTEX_LINE_PATTERN, re.MULTILINE)
+        return cls._parse_vertex_lines(vertex_line_re.findall(mesh_obj))
+
+    def _parse_vertices_from_response(self, response):
+        """Parses the vertices from a streamed OBJ response.
+
+        Only the vertex lines are kept, so the full OBJ text is never held
+        in memory.
+
+        Returns a Vx3 numpy array, where V is the number of vertices.
+        """
+        import re
+
+        vertex_line_re = re.compile(MeshGenerator._VERTEX_LINE_PATTERN)
+
+        def iter_vertex_coords():
+            for line in response.iter_lines(chunk_size=64 * 1024):
+                if not line.startswith(b'v '):
+                    continue
+                vertex_match = vertex_line_re.match(line)
+                if vertex_match is not None:
+                    yield vertex_match.group(1)
+
+        return self._parse_vertex_lines(iter_vertex_coords())
+
+    def _request_mesh_vertices(self, measurements, unit_system, gender):
+        """Requests a mesh from measurements, parsing it as it streams in.
+
+        Returns a Vx3 numpy array, where V is the number of vertices.
+        """
+        from contextlib import closing
+
+        params = self._mesh_request_params(measurements, unit_system, gender)
+        response = self._post_with_retries(params, stream=True)
+        with closing(response):
+            return self._parse_vertices_from_response(response)
 
     def get_mesh_for_measurements(self, measurements, unit_system, gender):
-        from requests import HTTPError
+        import logging
+        from requests import RequestException
+
+        cache_key = None
+        if self._cache is not None:
+            cache_key = self._cache.key(dict(
+                self._mesh_request_params(
+                    measurements, 'unitedStates', gender),
+                endpoint=self._endpoint))
+            vertices = self._cache.get(cache_key)
+            if vertices is not None:
+                return vertices
 
         try:
-            mesh_obj = self._request_mesh_obj(
+            vertices = self._request_mesh_vertices(
                 measurements, 'unitedStates', gender)
-        except HTTPError as e:
-            print 'Mesh request failed: {}'.format(e)
+        except RequestException as e:
+            logging.getLogger(__name__).warning('Mesh request failed: %s', e)
             return None
-
-        try:
-            return self._parse_vertices(mesh_obj)
         except ValueError as e:
-            print 'Failed to parse OBJ vertices: {}'.format(e)
+            logging.getLogger(__name__).warning(
+                'Failed to parse OBJ vertices: %s', e)
             return None
 
-    def get_random_mesh(self):
+        if cache_key is not None:
+            self._cache.put(cache_key, vertices)
+        return vertices
+
+    def _random_mesh_request(self):
+        """Returns random (measurements, unit_system, gender) arguments."""
         import random
 
         measurements = {
@@ -107,6 +245,7 @@ class MeshGenerator(object):
             'weight': random.uniform(120, 220),
         }
         gender = random.choice(['male', 'female'])
+        return measurements, 'unitedStates', gender
 
-        return self.get_mesh_for_measurements(
-            measurements, 'unitedStates', gender)
+    def get_random_mesh(self):
+        return self.get_mesh_for_measurements(*self._random_mesh_request())
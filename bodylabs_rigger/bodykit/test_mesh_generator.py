@@ -0,0 +1,154 @@
+import unittest
+
+
+def _obj_for_request(params):
+    """Returns an OBJ mesh whose vertices are all at the requested height,
+    so each response can be matched to its request.
+    """
+    height = params['measurements']['height']
+    lines = ['v {0} {0} {0}'.format(height)] * 4916
+    lines += ['vt 0.5 0.5', 'f 1/1 2/1 3/1 4/1']
+    return '\n'.join(lines) + '\n'
+
+
+class _StubServer(object):
+    """A local stand-in for the mesh endpoint.
+
+    Each request takes the next of the scripted responses, given as
+    (status code, headers, delay in seconds before responding), and gets a
+    200 with a mesh once they run out.
+    """
+
+    def __init__(self, responses=None):
+        import BaseHTTPServer
+        import json
+        import SocketServer
+        import threading
+        import time
+
+        self.responses = list(responses or [])
+        self.request_times = []
+        lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_POST(self):
+                params = json.loads(self.rfile.read(
+                    int(self.headers['Content-Length'])))
+                with lock:
+                    server.request_times.append(time.time())
+                    if server.responses:
+                        status, headers, delay = server.responses.pop(0)
+                    else:
+                        status, headers, delay = 200, {}, 0.
+                time.sleep(delay)
+                body = _obj_for_request(params) if status == 200 else ''
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # The client gives up on stalled responses.
+                pass
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self.endpoint = 'http://127.0.0.1:{}/instant/mesh'.format(
+            self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TestMeshGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.close()
+
+    def generator(self, responses, cls=None, **kwargs):
+        from bodylabs_rigger.bodykit.mesh_generator import MeshGenerator
+
+        self.server = _StubServer(responses)
+        kwargs.setdefault('retry_backoff', 0.01)
+        return (cls or MeshGenerator)(
+            'key', 'secret', endpoint=self.server.endpoint, **kwargs)
+
+    def test_retries_throttled_and_failed_requests(self):
+        generator = self.generator([
+            (429, {'Retry-After': '0.3'}, 0.),
+            (503, {}, 0.),
+        ])
+        mesh = generator.get_mesh_for_measurements(
+            {'height': 70.}, 'unitedStates', 'male')
+
+        self.assertEqual(mesh.shape, (4916, 3))
+        self.assertTrue((mesh == 70.).all())
+        times = self.server.request_times
+        self.assertEqual(len(times), 3)
+        # The first retry waits as long as Retry-After says, the second
+        # only for the backoff.
+        self.assertGreaterEqual(times[1] - times[0], 0.3)
+        self.assertLess(times[2] - times[1], 0.3)
+
+    def test_gives_up_after_max_retries(self):
+        import logging
+
+        generator = self.generator([(503, {}, 0.)] * 3, max_retries=2)
+        # The failure is logged as a warning.
+        logger = logging.getLogger('bodylabs_rigger.bodykit.mesh_generator')
+        handler = logging.NullHandler()
+        logger.addHandler(handler)
+        try:
+            mesh = generator.get_mesh_for_measurements(
+                {'height': 70.}, 'unitedStates', 'male')
+        finally:
+            logger.removeHandler(handler)
+
+        self.assertIsNone(mesh)
+        self.assertEqual(len(self.server.request_times), 3)
+
+    def test_retries_stalled_requests(self):
+        generator = self.generator([(200, {}, 2.)], timeout=(1., 0.2))
+        mesh = generator.get_mesh_for_measurements(
+            {'height': 70.}, 'unitedStates', 'male')
+
+        self.assertEqual(mesh.shape, (4916, 3))
+        self.assertEqual(len(self.server.request_times), 2)
+
+    def test_iter_meshes_yields_every_mesh(self):
+        from bodylabs_rigger.bodykit.concurrent_mesh_generator import (
+            ConcurrentMeshGenerator,
+        )
+
+        generator = self.generator(
+            [(429, {'Retry-After': '0.1'}, 0.), (503, {}, 0.)],
+            cls=ConcurrentMeshGenerator, max_concurrency=4)
+        mesh_requests = [
+            ({'height': 60. + i}, 'unitedStates', 'female')
+            for i in range(10)]
+        meshes = dict(generator.iter_meshes(iter(mesh_requests)))
+
+        self.assertEqual(sorted(meshes), range(10))
+        for index, mesh in meshes.items():
+            self.assertTrue((mesh == 60. + index).all())
+        self.assertEqual(len(self.server.request_times), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
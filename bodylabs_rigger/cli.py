@@ -0,0 +1,276 @@
+# Command line tool for rigging batches of meshes.
+#
+# Rigs every vertex file (.npy or .obj) in the given directories, glob
+# patterns and files, or a stream of concatenated .npy arrays on stdin, and
+# writes one FBX file per mesh:
+#
+#     bodylabs-rig meshes/ 'more/*.obj' --output_directory rigs/
+#     cat bodies/*.npy | bodylabs-rig - --output_directory rigs/
+#
+# A JSON line per mesh, with its status and timings, is appended to the
+# report file. Meshes whose output already exists are skipped, so an
+# interrupted run can simply be restarted. Each output is named after its
+# mesh, so inputs with the same name (e.g. in/a/body0.npy and
+# in/b/body0.npy) are rejected before any rigging. Bodies from archives are
+# named after their ids, escaped to be safe as file names.
+
+
+def _output_filename(name):
+    return name + '.fbx'
+
+
+def _escape_body_id(body_id):
+    """Returns a body id from an archive as a name which is safe to use as a
+    file name.
+
+    Body ids can be any string, so every character other than an ASCII
+    letter, digit, '_', '-' or '.' is percent-escaped from its UTF-8 bytes,
+    as is a leading '.'. So ids like '../body' or 'a/b' stay in the output
+    directory, non-ASCII ids become ASCII file names, and distinct ids get
+    distinct names.
+    """
+    import urllib
+
+    if not isinstance(body_id, bytes):
+        body_id = body_id.encode('utf-8')
+    name = urllib.quote(body_id, safe='')
+    if name.startswith('.'):
+        name = '%2E' + name[1:]
+    return name
+
+
+def _iter_names(inputs):
+    """Yields (name, source) for each mesh in the vertex files and body
+    archives among the inputs, without reading the meshes. The names are
+    those of the output files, without the extension.
+    """
+    import os
+    from bodylabs_rigger.body_archive import (
+        BODY_ARCHIVE_EXTENSION,
+        BodyArchive,
+    )
+    from bodylabs_rigger.vertex_io import find_vertex_files
+
+    for input_path in inputs:
+        if input_path == '-':
+            continue
+        if input_path.endswith(BODY_ARCHIVE_EXTENSION):
+            archive = BodyArchive(input_path)
+            for index in range(len(archive)):
+                yield _escape_body_id(archive.body_id(index)), input_path
+            continue
+        for path in find_vertex_files([input_path]):
+            yield os.path.splitext(os.path.basename(path))[0], path
+
+
+def _find_duplicate_names(inputs):
+    """Returns a description of each mesh whose output file would be the
+    same as an earlier mesh's, e.g. in/a/body0.npy and in/b/body0.npy.
+    """
+    first_sources = {}
+    duplicates = []
+    for name, source in _iter_names(inputs):
+        filename = _output_filename(name)
+        if filename in first_sources:
+            duplicates.append('{} ({} and {})'.format(
+                filename, first_sources[filename], source))
+        else:
+            first_sources[filename] = source
+    return duplicates
+
+
+def _iter_jobs(inputs, output_directory, overwrite, skipped):
+    """Yields (name, vertices, output_path) for each mesh to rig.
+
+    Meshes whose output exists (unless overwriting) are passed to `skipped`
+    instead, without reading their input files.
+    """
+    import os
+    import sys
+    from bodylabs_rigger.body_archive import (
+        BODY_ARCHIVE_EXTENSION,
+        BodyArchive,
+    )
+    from bodylabs_rigger.vertex_io import (
+        find_vertex_files,
+        iter_npy_stream,
+        read_vertices,
+    )
+
+    def output_path_for(name):
+        return os.path.join(output_directory, _output_filename(name))
+
+    def is_done(output_path):
+        # Workers rename each output into place once it's complete (see
+        # pool.py), so an interrupted export leaves no file here. Empty
+        # files are still rigged again, in case they come from elsewhere.
+        return (
+            not overwrite and os.path.exists(output_path) and
+            os.path.getsize(output_path) > 0)
+
+    for input_path in inputs:
+        if input_path == '-':
+            for index, vertices in enumerate(iter_npy_stream(sys.stdin)):
+                name = 'stdin_{:06}'.format(index)
+                output_path = output_path_for(name)
+                if is_done(output_path):
+                    skipped(name, output_path)
+                    continue
+                yield name, vertices, output_path
+            continue
+
+        if input_path.endswith(BODY_ARCHIVE_EXTENSION):
+            archive = BodyArchive(input_path)
+            for index in range(len(archive)):
+                name = archive.body_id(index)
+                output_path = output_path_for(_escape_body_id(name))
+                if is_done(output_path):
+                    skipped(name, output_path)
+                    continue
+                yield name, archive[index], output_path
+            continue
+
+        for path in find_vertex_files([input_path]):
+            name = os.path.splitext(os.path.basename(path))[0]
+            output_path = output_path_for(name)
+            if is_done(output_path):
+                skipped(name, output_path)
+                continue
+            try:
+                vertices = read_vertices(path)
+            except (IOError, ValueError) as e:
+                skipped(name, output_path, error=str(e))
+                continue
+            yield name, vertices, output_path
+
+
+def main():
+    import argparse
+    import json
+    import os
+    import sys
+    import time
+    from bodylabs_rigger.pool import RigPool
+
+    parser = argparse.ArgumentParser(
+        description='Rig meshes and export them as FBX files.')
+    parser.add_argument(
+        'inputs', nargs='+',
+        help=('Vertex files (.npy or .obj), directories of vertex files, '
+              'glob patterns, body archives (.bodies, see body_archive.py), '
+              'or - to read concatenated .npy arrays from stdin.'))
+    parser.add_argument(
+        '--output_directory', required=True,
+        help='The directory to write the rigged meshes.')
+    parser.add_argument(
+        '--report', default=None, required=False,
+        help=('The JSON lines file to which per-mesh results are appended. '
+              'Defaults to report.jsonl in the output directory.'))
+    parser.add_argument(
+        '--num_workers', default=None, type=int, required=False,
+        help='The number of worker processes. Defaults to the CPU count.')
+    parser.add_argument(
+        '--max_pending_per_worker', default=2, type=int, required=False,
+        help='The number of meshes queued per worker, which bounds memory.')
+    parser.add_argument(
+        '--rig_assets', default=None, required=False,
+        help='A RigAssets file to use instead of the default assets.')
+    parser.add_argument(
+        '--output_cache_directory', default=None, required=False,
+        help='A directory in which to cache rigged outputs across runs.')
+    parser.add_argument(
+        '--overwrite', action='store_true',
+        help='Rig meshes even if their output already exists.')
+    parser.add_argument(
+        '--validate', action='store_true',
+        help=('Check each mesh before rigging it (see validation.py), and '
+              'report invalid meshes as errors instead of rigging them.'))
+    args = parser.parse_args()
+
+    duplicates = _find_duplicate_names(args.inputs)
+    if duplicates:
+        parser.error(
+            'Several meshes would be written to the same output file. '
+            'Rename them or rig them in separate runs: ' +
+            ', '.join(duplicates))
+
+    output_directory = os.path.expanduser(args.output_directory)
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    report_path = args.report or os.path.join(
+        output_directory, 'report.jsonl')
+
+    counts = {'ok': 0, 'skipped': 0, 'error': 0}
+    with open(report_path, 'a') as report:
+        def write_record(record):
+            counts[record['status']] += 1
+            report.write(json.dumps(record, sort_keys=True) + '\n')
+            report.flush()
+
+        def skipped(name, output_path, error=None):
+            write_record({
+                'name': name,
+                'output_path': output_path,
+                'status': 'skipped' if error is None else 'error',
+                'error': error,
+                'timestamp': time.time(),
+            })
+
+        validator = None
+        if args.validate:
+            from bodylabs_rigger.rig_assets import RigAssets
+            from bodylabs_rigger.validation import BodyValidator
+
+            if args.rig_assets is None:
+                assets = RigAssets.load_default()
+            else:
+                assets = RigAssets.load(args.rig_assets)
+            validator = BodyValidator(
+                assets.textured_mesh, assets.joint_position_spec)
+
+        # The name of each mesh being rigged, by output path.
+        names = {}
+
+        def jobs():
+            for name, vertices, output_path in _iter_jobs(
+                    args.inputs, output_directory, args.overwrite, skipped):
+                if output_path in names:
+                    # Meshes from stdin aren't checked up front.
+                    skipped(name, output_path, error=(
+                        'Another mesh, {}, is being written to the same '
+                        'output file.'.format(names[output_path])))
+                    continue
+                if validator is not None:
+                    reasons = validator.validate(vertices)
+                    if reasons:
+                        skipped(name, output_path, error='Invalid mesh: ' +
+                                '; '.join(reasons))
+                        continue
+                names[output_path] = name
+                yield vertices, output_path
+
+        with RigPool(
+                num_workers=args.num_workers,
+                max_pending_per_worker=args.max_pending_per_worker,
+                rig_assets_path=args.rig_assets,
+                output_cache_directory=args.output_cache_directory) as pool:
+            for result in pool.imap(jobs()):
+                write_record({
+                    'name': names.pop(result.output_path, None),
+                    'output_path': result.output_path,
+                    'status': 'ok' if result.error is None else 'error',
+                    'error': result.error,
+                    'cache_hit': result.cache_hit,
+                    'timings': result.timings,
+                    'worker_pid': result.worker_pid,
+                    'timestamp': time.time(),
+                })
+
+    print 'Rigged {ok}, skipped {skipped}, failed {error}.'.format(**counts)
+    print 'Report: {}'.format(report_path)
+    if counts['error']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,20 @@
+class _RigTemplate(object):
+    """The SDK objects shared by every rig built with one FbxManager."""
+
+    def __init__(self, fbx_manager, scene, mesh, clusters):
+        """Initializes the _RigTemplate.
+
+        fbx_manager: the FbxManager which owns the template
+        scene: the FbxScene containing the template objects
+        mesh: the FbxMesh with the rig topology and UV map
+        clusters: dict mapping joint name to a populated FbxCluster
+        """
+        self.fbx_manager = fbx_manager
+        self.scene = scene
+        self.mesh = mesh
+        self.clusters = clusters
+
+
 class RiggedModelFactory(object):
     """Generates rigged models from vertices.
 
@@ -8,7 +25,7 @@ class RiggedModelFactory(object):
     """
 
     def __init__(self, textured_mesh, joint_tree, joint_position_spec,
-                 clusters):
+                 clusters, instrumentation=None):
         """Initializes the RiggedModelFactory.
 
         textured_mesh: a TexturedMesh object
@@ -16,130 +33,245 @@ class RiggedModelFactory(object):
         joint_position_spec: dict mapping joint name to position specification.
             See `joint_positions.py` for more details.
         clusters: dict mapping joint name to ControlPointCluster
+        instrumentation: an Instrumentation to which the stages of
+            `construct_rig` are reported. See `instrumentation.py`. Defaults
+            to a NullInstrumentation, which records nothing.
         """
+        from bodylabs_rigger.instrumentation import NullInstrumentation
+        from bodylabs_rigger.joint_positions import JointPositionSolver
+        from bodylabs_rigger.normals import VertexNormals
+
         self._textured_mesh = textured_mesh
         self._joint_tree = joint_tree
         self._joint_position_spec = joint_position_spec
         self._clusters = clusters
-
-    def _set_mesh(self, v, fbx_scene, root):
-        """Set the FbxMesh for the given scene.
-
-        v: the mesh vertices
-        fbx_scene: the FbxScene to which this mesh should be added
-        root: the FbxNode off which the mesh will be added
-
-        Returns the FbxNode to which the mesh was added.
+        self._joint_position_solver = JointPositionSolver(joint_position_spec)
+        self.vertex_normals = VertexNormals(textured_mesh.faces)
+
+        # Precompute how to derive the local translation of each skeleton
+        # node from the solved joint positions. Every node's global transform
+        # is a pure translation, so its local translation is simply the
+        # offset from its parent's position. A node without a position keeps
+        # a zero local translation, i.e. it sits at its parent's position.
+        self._skeleton_joint_names, self._skeleton_parent_indices = (
+            joint_tree.flatten())
+        solved_joint_indices = {
+            name: ji
+            for ji, name in enumerate(self._joint_position_solver.joint_names)
+        }
+        # Index len(joint_names) refers to an appended row at the origin.
+        origin_index = len(self._joint_position_solver.joint_names)
+        self._skeleton_position_indices = []
+        for name, parent_index in zip(self._skeleton_joint_names,
+                                      self._skeleton_parent_indices):
+            if name in solved_joint_indices:
+                position_index = solved_joint_indices[name]
+            elif parent_index >= 0:
+                position_index = (
+                    self._skeleton_position_indices[parent_index])
+            else:
+                position_index = origin_index
+            self._skeleton_position_indices.append(position_index)
+        self._template = None
+        self.instrumentation = instrumentation or NullInstrumentation()
+
+    def _create_template(self, fbx_manager):
+        """Builds the parts of the rig which are the same for every mesh.
+
+        The mesh polygons, edges and UV layer only depend on the topology,
+        and the skin clusters only on the vertex weight map. We build them
+        once per FbxManager, in a template scene of their own, and copy them
+        into each new rig, along with an empty normal layer. Only the
+        control points, normals, joint translations and cluster matrices are
+        then set per rig.
+
+        fbx_manager: the FbxManager which will own the template
+
+        Returns a _RigTemplate.
         """
         from fbx import (
+            FbxCluster,
             FbxLayerElement,
             FbxMesh,
             FbxNode,
+            FbxScene,
+            FbxSkin,
             FbxVector2,
-            FbxVector4,
         )
 
-        # Create a new node in the scene.
-        fbx_mesh_node = FbxNode.Create(fbx_scene, self._textured_mesh.name)
-        root.AddChild(fbx_mesh_node)
-
-        fbx_mesh = FbxMesh.Create(fbx_scene, '')
+        template_scene = FbxScene.Create(fbx_manager, 'rig_template')
+        fbx_mesh_node = FbxNode.Create(
+            template_scene, self._textured_mesh.name)
+        template_scene.GetRootNode().AddChild(fbx_mesh_node)
+        fbx_mesh = FbxMesh.Create(template_scene, '')
         fbx_mesh_node.SetNodeAttribute(fbx_mesh)
 
-        # Vertices.
-        num_vertices = v.shape[0]
-        fbx_mesh.InitControlPoints(num_vertices)
-        for vi in range(num_vertices):
-            new_control_point = FbxVector4(*v[vi, :])
-            fbx_mesh.SetControlPointAt(new_control_point, vi)
-
-        # Faces.
-        faces = self._textured_mesh.faces
-        for fi in range(faces.shape[0]):
-            face = faces[fi, :]
+        # The control points are filled in for each rig.
+        fbx_mesh.InitControlPoints(self.vertex_normals.num_vertices)
+
+        # Faces. The SDK bindings only accept native Python numbers, so
+        # convert the int32 numpy arrays up front.
+        faces = self._textured_mesh.faces.tolist()
+        for fi, face in enumerate(faces):
             fbx_mesh.BeginPolygon(fi)
-            for vi in range(faces.shape[1]):
-                fbx_mesh.AddPolygon(face[vi])
+            for vi in face:
+                fbx_mesh.AddPolygon(vi)
             fbx_mesh.EndPolygon()
         fbx_mesh.BuildMeshEdgeArray()
 
-        # Vertex normals.
-        fbx_mesh.GenerateNormals(
-            False,  # pOverwrite
-            True,   # pByCtrlPoint
-        )
-
         # UV map.
-        uv_indices = self._textured_mesh.uv_indices.ravel()
-        uv_values = self._textured_mesh.uv_values
+        uv_indices = self._textured_mesh.uv_indices.ravel().tolist()
+        uv_values = self._textured_mesh.uv_values.tolist()
         uv = fbx_mesh.CreateElementUV('')
         uv.SetMappingMode(FbxLayerElement.eByPolygonVertex)
         uv.SetReferenceMode(FbxLayerElement.eIndexToDirect)
         index_array = uv.GetIndexArray()
         direct_array = uv.GetDirectArray()
-        index_array.SetCount(uv_indices.size)
-        direct_array.SetCount(uv_values.shape[0])
+        index_array.SetCount(len(uv_indices))
+        direct_array.SetCount(len(uv_values))
         for ei, uvi in enumerate(uv_indices):
             index_array.SetAt(ei, uvi)
-            direct_array.SetAt(uvi, FbxVector2(*uv_values[uvi, :]))
+        for uvi, uv_value in enumerate(uv_values):
+            direct_array.SetAt(uvi, FbxVector2(*uv_value))
+
+        # Vertex normals, which are filled in for each rig.
+        normal = fbx_mesh.CreateElementNormal()
+        normal.SetMappingMode(FbxLayerElement.eByControlPoint)
+        normal.SetReferenceMode(FbxLayerElement.eDirect)
+        normal.GetDirectArray().SetCount(self.vertex_normals.num_vertices)
+
+        # Skin clusters, without their links and matrices. The skin is kept
+        # off the template mesh so copying the mesh doesn't pick it up.
+        skin = FbxSkin.Create(template_scene, '')
+        clusters = {}
+        for node_name, control_points in self._clusters.iteritems():
+            cluster = FbxCluster.Create(template_scene, '')
+            cluster.SetLinkMode(FbxCluster.eNormalize)
+            # The bindings take one control point at a time.
+            for vid, weight in zip(control_points.indices.tolist(),
+                                   control_points.weights.tolist()):
+                cluster.AddControlPointIndex(vid, weight)
+            skin.AddCluster(cluster)
+            clusters[node_name] = cluster
 
-        return fbx_mesh_node
+        return _RigTemplate(fbx_manager, template_scene, fbx_mesh, clusters)
+
+    def _get_template(self, fbx_manager):
+        """Returns the _RigTemplate for the given FbxManager.
 
-    def _set_node_translation(self, location, fbx_node):
-        """Translates a node to a location in world coordinates.
+        Only the template for the most recently used FbxManager is kept.
+        """
+        if (self._template is None or
+                self._template.fbx_manager is not fbx_manager):
+            self._template = self._create_template(fbx_manager)
+        return self._template
+
+    def _set_mesh(self, v, fbx_scene, root, normals=None):
+        """Set the FbxMesh for the given scene.
+
+        v: the mesh vertices
+        fbx_scene: the FbxScene to which this mesh should be added
+        root: the FbxNode off which the mesh will be added
+        normals: the Vx3 unit vertex normals. Computed from `v` if None.
 
-        location: an unpackable (x, y, z) vector
-        fbx_node: the FbxNode to translate
+        Returns the FbxNode to which the mesh was added.
         """
+        import numpy as np
         from fbx import (
-            FbxAMatrix,
-            FbxDouble4,
+            FbxMesh,
+            FbxNode,
             FbxVector4,
         )
 
-        # We want to affect a target global position change by modifying the
-        # local node translation. If the global transformation were based
-        # solely on translation, rotation, and scale, we could set each of
-        # these individually and be done. However, the global transformation
-        # matrix computation is more complicated. For details, see
-        #   http://help.autodesk.com/view/FBX/2015/ENU/
-        #       ?guid=__files_GUID_10CDD63C_79C1_4F2D_BB28_AD2BE65A02ED_htm
-        #
-        # We get around this by setting the world transform to our desired
-        # global translation matrix, then solving for the local translation.
-        global_pos_mat = FbxAMatrix()
-        global_pos_mat.SetIdentity()
-        global_pos_mat.SetT(FbxVector4(*location))
-
-        current_global_pos_mat = fbx_node.EvaluateGlobalTransform()
-        parent_global_pos_mat = fbx_node.GetParent().EvaluateGlobalTransform()
-        current_local_translation = FbxAMatrix()
-        current_local_translation.SetIdentity()
-        current_local_translation.SetT(
-            FbxVector4(fbx_node.LclTranslation.Get()))
-        new_local_translation = (
-            parent_global_pos_mat.Inverse() *
-            global_pos_mat *
-            current_global_pos_mat.Inverse() *
-            parent_global_pos_mat *
-            current_local_translation
-        )
-        fbx_node.LclTranslation.Set(FbxDouble4(*new_local_translation.GetT()))
+        # Create a new node in the scene.
+        fbx_mesh_node = FbxNode.Create(fbx_scene, self._textured_mesh.name)
+        root.AddChild(fbx_mesh_node)
+
+        # Copy the topology and UV map from the template.
+        fbx_mesh = FbxMesh.Create(fbx_scene, '')
+        fbx_mesh.Copy(self._get_template(fbx_scene.GetFbxManager()).mesh)
+        fbx_mesh_node.SetNodeAttribute(fbx_mesh)
+
+        # Vertices. The bindings have no bulk setter for control points, but
+        # converting the whole array to Python floats at once avoids the
+        # per-element numpy scalar unpacking.
+        vertices = np.asarray(v, dtype=np.float64).tolist()
+        for vi, (x, y, z) in enumerate(vertices):
+            fbx_mesh.SetControlPointAt(FbxVector4(x, y, z), vi)
+
+        # Vertex normals. Computing them in numpy over the known topology
+        # is much cheaper than having the SDK generate them.
+        if normals is None:
+            normals = self.vertex_normals.compute(v)
+        normals = np.asarray(normals, dtype=np.float64).tolist()
+        normal_array = fbx_mesh.GetElementNormal(0).GetDirectArray()
+        for vi, (x, y, z) in enumerate(normals):
+            normal_array.SetAt(vi, FbxVector4(x, y, z, 0.))
+
+        return fbx_mesh_node
+
+    def _calculate_skeleton_translations(self, joint_positions):
+        """Calculates the world and local translation of each skeleton node.
+
+        joint_positions: a Jx3 or NxJx3 numpy array of world joint positions,
+            as returned by `JointPositionSolver.solve`
+
+        Returns a tuple of two Kx3 or NxKx3 numpy arrays, where K is the
+        number of nodes in the skeleton (in the order given by
+        `JointTree.flatten`): the world position of each node, and its
+        translation relative to its parent node.
+        """
+        import numpy as np
+
+        joint_positions = np.asarray(joint_positions, dtype=np.float64)
+        origin = np.zeros(joint_positions.shape[:-2] + (1, 3))
+        world_positions = np.concatenate(
+            [joint_positions, origin], axis=-2)[
+                ..., self._skeleton_position_indices, :]
+        # The root's parent index of -1 selects the appended origin.
+        parent_positions = np.concatenate(
+            [world_positions, origin], axis=-2)[
+                ..., self._skeleton_parent_indices, :]
+        return world_positions, world_positions - parent_positions
+
+    def _skeleton_translation_maps(self, joint_positions):
+        """Returns maps from joint name to world and local translations.
+
+        The translations are given as lists. Joints without a solved
+        position are omitted from the local translations.
+
+        joint_positions: a Jx3 numpy array of world joint positions, as
+            returned by `JointPositionSolver.solve`
+        """
+        world_positions, local_translations = (
+            self._calculate_skeleton_translations(joint_positions))
+        world_position_map = dict(zip(
+            self._skeleton_joint_names, world_positions.tolist()))
+        solved_joint_names = set(self._joint_position_solver.joint_names)
+        local_translation_map = {
+            name: translation
+            for name, translation in zip(
+                self._skeleton_joint_names, local_translations.tolist())
+            if name in solved_joint_names
+        }
+        return world_position_map, local_translation_map
 
     def _extend_skeleton(self, parent_fbx_node, reference_joint_tree,
-                         target_fbx_node_positions, fbx_scene):
+                         local_translations, fbx_scene):
         """Extend the FbxNode skeleton according to the reference JointTree.
 
         parent_fbx_node: the FbxNode off which the skeleton will be extended
         reference_joint_tree: the reference JointTree object providing the
             hierarchy
-        target_fbx_node_positions: a mapping from joint name to the desired
-           position for the respective FbxNode in the skeleton
+        local_translations: a mapping from joint name to the translation of
+           the respective FbxNode relative to its parent
         fbx_scene: the FbxScene to which the skeleton should be added
 
         Returns a map from node name to FbxNode.
         """
+        import logging
         from fbx import (
+            FbxDouble4,
             FbxNode,
             FbxSkeleton,
         )
@@ -155,18 +287,21 @@ class RiggedModelFactory(object):
         parent_fbx_node.AddChild(node)
         fbx_node_map[node_name] = node
 
-        node_position = target_fbx_node_positions.get(node_name, None)
-        if node_position is not None:
-            self._set_node_translation(node_position, node)
+        local_translation = local_translations.get(node_name, None)
+        if local_translation is not None:
+            x, y, z = local_translation
+            node.LclTranslation.Set(FbxDouble4(x, y, z, 1.))
         else:
-            print "Position information missing for '{}'".format(node_name)
+            logging.getLogger(__name__).warning(
+                "Position information missing for '%s'", node_name)
 
         for child in reference_joint_tree.children:
             fbx_node_map.update(self._extend_skeleton(
-                node, child, target_fbx_node_positions, fbx_scene))
+                node, child, local_translations, fbx_scene))
         return fbx_node_map
 
-    def _add_skin_and_bind_pose(self, fbx_node_map, fbx_mesh_node, fbx_scene):
+    def _add_skin_and_bind_pose(self, fbx_node_map, fbx_mesh_node, fbx_scene,
+                                world_positions):
         """Adds a deformer skin and bind pose.
 
         fbx_node_map: a map from node name to FbxNode. These nodes will become
@@ -176,84 +311,158 @@ class RiggedModelFactory(object):
             mesh.
         fbx_scene: the FbxScene to which the skin and bind pose should be
             added.
+        world_positions: a map from node name to the node's world position.
+            The global transform of every skeleton node is a pure
+            translation, so the link and bind pose matrices follow directly
+            from these positions.
         """
         from fbx import (
+            FbxAMatrix,
             FbxCluster,
             FbxMatrix,
             FbxPose,
             FbxSkin,
+            FbxVector4,
         )
 
         mesh = fbx_mesh_node.GetNodeAttribute()
 
         # Create the bind pose. We'll give the bind pose a unique name since
-        # it is added at the level of the global scene.
+        # it is added at the level of the global scene. The mesh node sits
+        # untransformed at the root, so its global transform is the identity.
         bind_pose = FbxPose.Create(
             fbx_scene, 'pose{}'.format(fbx_scene.GetPoseCount() + 1))
         bind_pose.SetIsBindPose(True)
-        bind_pose.Add(fbx_mesh_node, FbxMatrix(
-            fbx_mesh_node.EvaluateGlobalTransform()))
+        mesh_transform = FbxAMatrix()
+        mesh_transform.SetIdentity()
+        bind_pose.Add(fbx_mesh_node, FbxMatrix(mesh_transform))
+
+        # Copy the populated clusters from the template.
+        template_clusters = self._get_template(
+            fbx_scene.GetFbxManager()).clusters
 
         skin = FbxSkin.Create(fbx_scene, '')
         for node_name, node in fbx_node_map.iteritems():
-            cluster_info = self._clusters.get(node_name)
-            if cluster_info is None:
+            template_cluster = template_clusters.get(node_name)
+            if template_cluster is None:
                 continue
 
             cluster = FbxCluster.Create(fbx_scene, '')
+            cluster.Copy(template_cluster)
             cluster.SetLink(node)
             cluster.SetLinkMode(FbxCluster.eNormalize)
 
-            vindices = cluster_info.indices
-            weights = cluster_info.weights
-            for vid, weight in zip(vindices, weights):
-                cluster.AddControlPointIndex(vid, weight)
-
-            transform = node.EvaluateGlobalTransform()
+            x, y, z = world_positions[node_name]
+            transform = FbxAMatrix()
+            transform.SetIdentity()
+            transform.SetT(FbxVector4(x, y, z))
             cluster.SetTransformLinkMatrix(transform)
             bind_pose.Add(node, FbxMatrix(transform))
             skin.AddCluster(cluster)
         mesh.AddDeformer(skin)
         fbx_scene.AddPose(bind_pose)
 
-    def construct_rig(self, vertices, fbx_manager):
+    def construct_rig(self, vertices, fbx_manager, normals=None):
         """Construct rig for the given vertices.
 
         vertices: an Vx3 numpy array in centimeter units.
+        normals: the Vx3 unit vertex normals, e.g. computed for a batch of
+            bodies at once with `vertex_normals.compute`. Computed from the
+            vertices if None.
 
-        Returns a new FbxScene.
+        Returns a new FbxScene. The caller should destroy it when done, e.g.
+        by using `SceneLifecycle.rigged_scene` (see `scene_lifecycle.py`).
+        If rigging fails, the partial scene is destroyed.
         """
-        from joint_positions import calculate_joint_positions
         from fbx import FbxScene
 
-        fbx_scene = FbxScene.Create(fbx_manager, '')
+        instrumentation = self.instrumentation
+        with instrumentation.stage('construct_rig'):
+            fbx_scene = FbxScene.Create(fbx_manager, '')
+            try:
+                self._build_rig(vertices, fbx_scene, normals)
+            except Exception:
+                fbx_scene.Destroy()
+                raise
+
+        return fbx_scene
+
+    def _build_rig(self, vertices, fbx_scene, normals):
+        """Adds the skeleton, mesh, skin and bind pose to an empty scene."""
+        instrumentation = self.instrumentation
 
         # We'll build the rig off of this node. One child will root
         # the joint skeleton and another will contain the mesh and skin.
         rig_root_node = fbx_scene.GetRootNode()
 
-        target_joint_positions = calculate_joint_positions(
-            vertices, self._joint_position_spec)
+        with instrumentation.stage('joint_positions'):
+            joint_positions = self._joint_position_solver.solve(vertices)
+            world_positions, local_translations = (
+                self._skeleton_translation_maps(joint_positions))
 
         # Add the skeleton to the scene, saving the nodes by name. We'll
         # then use this map to link the nodes to their vertex clusters.
-        fbx_node_map = self._extend_skeleton(
-            rig_root_node, self._joint_tree, target_joint_positions,
-            fbx_scene)
+        with instrumentation.stage('skeleton'):
+            fbx_node_map = self._extend_skeleton(
+                rig_root_node, self._joint_tree, local_translations,
+                fbx_scene)
 
         # Add the mesh, skin, and bind pose.
-        fbx_mesh_node = self._set_mesh(vertices, fbx_scene, rig_root_node)
-        self._add_skin_and_bind_pose(fbx_node_map, fbx_mesh_node, fbx_scene)
+        with instrumentation.stage('mesh'):
+            fbx_mesh_node = self._set_mesh(
+                vertices, fbx_scene, rig_root_node, normals)
+        with instrumentation.stage('skin_and_bind_pose'):
+            self._add_skin_and_bind_pose(
+                fbx_node_map, fbx_mesh_node, fbx_scene, world_positions)
+
+    @property
+    def skeleton_joint_names(self):
+        """The names of the skeleton nodes, in the order of `JointTree.flatten`
+        and of the rows returned by `skeleton_positions`.
+        """
+        return list(self._skeleton_joint_names)
+
+    @property
+    def skeleton_parent_indices(self):
+        """The index of each skeleton node's parent, or -1 for the root."""
+        return list(self._skeleton_parent_indices)
+
+    @property
+    def joint_position_solver(self):
+        """The JointPositionSolver for the rig's joint position spec."""
+        return self._joint_position_solver
+
+    @property
+    def rig_assets(self):
+        """The RigAssets of the factory, e.g. for its `fingerprint`, or to
+        create the SDK-free tools which work with the same rig: a
+        BodyValidator (`validation.py`), skinning weights (`skinning.py`) or
+        a GlbExporter (`gltf.py`).
+        """
+        from bodylabs_rigger.rig_assets import RigAssets
 
-        return fbx_scene
+        return RigAssets(
+            textured_mesh=self._textured_mesh,
+            joint_tree=self._joint_tree,
+            joint_position_spec=self._joint_position_spec,
+            clusters=self._clusters)
+
+    def skeleton_positions(self, vertices):
+        """Solves the skeleton of the rig for bodies, without the FBX SDK.
+
+        vertices: a Vx3 or NxVx3 numpy array in centimeter units
+
+        Returns a tuple of two Kx3 or NxKx3 numpy arrays, in the order of
+        `skeleton_joint_names`: the world position of each node, and its
+        translation relative to its parent node.
+        """
+        return self._calculate_skeleton_translations(
+            self._joint_position_solver.solve(vertices))
 
     @classmethod
-    def create_default(cls):
-        import os
-        import bodylabs_rigger.static
+    def create_default(cls, instrumentation=None):
         from bodylabs_rigger.rig_assets import RigAssets
 
-        assets = RigAssets.load(os.path.join(
-            os.path.dirname(bodylabs_rigger.static.__file__),
-            'rig_assets.json'))
-        return cls(**assets.__dict__)
+        return cls(
+            instrumentation=instrumentation,
+            **RigAssets.load_default().__dict__)
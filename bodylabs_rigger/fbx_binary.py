@@ -0,0 +1,264 @@
+# Reads and writes the FBX binary file format, without the FBX SDK.
+#
+# A binary FBX file is a tree of records. Each record has a name, a list of
+# typed properties (scalars, strings, or numeric arrays which may be zlib
+# compressed) and nested records:
+#
+#     document = parse_fbx(data)
+#     geometry = document.find('Objects').find('Geometry')
+#     vertices = geometry.find('Vertices').properties[0][1]
+#     data = serialize_fbx(document)
+#
+# Parsing records the byte offset of each property's value in `offsets`, so
+# values in uncompressed files can be overwritten in place. The serializer
+# writes arrays uncompressed unless asked otherwise, which gives every array a
+# fixed size and position (see `fbx_template.py`).
+
+_MAGIC = b'Kaydara FBX Binary  \x00\x1a\x00'
+_FOOTER_MAGIC = (
+    b'\xf8\x5a\x8c\x6a\xde\xf5\xd9\x7e\xec\xe9\x0c\xe3\x75\x8f\x29\x0b')
+
+# Versions from 7.5 use 64-bit offsets in record headers.
+_LARGE_HEADER_VERSION = 7500
+
+_SCALAR_FORMATS = {
+    b'Y': '<h',
+    b'C': '<?',
+    b'I': '<i',
+    b'F': '<f',
+    b'D': '<d',
+    b'L': '<q',
+}
+_ARRAY_DTYPES = {
+    b'b': '<?',
+    b'i': '<i4',
+    b'l': '<i8',
+    b'f': '<f4',
+    b'd': '<f8',
+}
+_STRING_TYPES = (b'S', b'R')
+
+
+class FbxRecord(object):
+    """A record in a binary FBX file."""
+
+    def __init__(self, name, properties=None, children=None,
+                 has_sentinel=None):
+        """Initializes the FbxRecord.
+
+        name: the record name, as bytes
+        properties: a list of (type code, value) tuples. Scalars are Python
+            numbers, strings are bytes and arrays are numpy arrays.
+        children: a list of nested FbxRecords
+        has_sentinel: whether the nested records are followed by a null
+            record. The SDK writes one after nested records, and for some
+            records without properties. Defaults to whether there are
+            nested records.
+        """
+        self.name = name
+        self.properties = list(properties or [])
+        self.children = list(children or [])
+        if has_sentinel is None:
+            has_sentinel = bool(self.children)
+        self.has_sentinel = has_sentinel
+        # The byte offset of each property's value in the parsed file. For
+        # arrays it's the offset of the array data, or None if compressed.
+        self.offsets = [None] * len(self.properties)
+
+    def find(self, name):
+        """Returns the first nested record with the given name, or None."""
+        for child in self.children:
+            if child.name == name:
+                return child
+        return None
+
+    def find_all(self, name):
+        return [child for child in self.children if child.name == name]
+
+
+class FbxDocument(FbxRecord):
+    """The top-level records of a binary FBX file."""
+
+    def __init__(self, version, children=None, footer_id=None):
+        """Initializes the FbxDocument.
+
+        version: the file format version, e.g. 7400
+        children: the top-level FbxRecords
+        footer_id: the 16 bytes which start the file footer. The SDK
+            derives them from the creation time.
+        """
+        super(FbxDocument, self).__init__(b'', children=children)
+        self.version = version
+        self.footer_id = footer_id or b'\0' * 16
+
+
+def _record_header(version):
+    import struct
+
+    if version >= _LARGE_HEADER_VERSION:
+        return struct.Struct('<QQQ')
+    return struct.Struct('<III')
+
+
+def _parse_record(data, offset, header):
+    """Parses the record at `offset`.
+
+    Returns the FbxRecord, or None for a null record, and the offset
+    following it.
+    """
+    import struct
+    import zlib
+    import numpy as np
+
+    end_offset, num_properties, _ = header.unpack_from(data, offset)
+    if end_offset == 0:
+        return None, offset + header.size + 1
+    offset += header.size
+    name_length = struct.unpack_from('<B', data, offset)[0]
+    name = data[offset + 1:offset + 1 + name_length]
+    offset += 1 + name_length
+
+    record = FbxRecord(name)
+    for _ in range(num_properties):
+        type_code = data[offset:offset + 1]
+        offset += 1
+        value_offset = offset
+        if type_code in _SCALAR_FORMATS:
+            value_format = _SCALAR_FORMATS[type_code]
+            value = struct.unpack_from(value_format, data, offset)[0]
+            offset += struct.calcsize(value_format)
+        elif type_code in _ARRAY_DTYPES:
+            length, encoding, num_bytes = struct.unpack_from(
+                '<III', data, offset)
+            offset += 12
+            value_offset = offset
+            raw = data[offset:offset + num_bytes]
+            offset += num_bytes
+            if encoding == 1:
+                raw = zlib.decompress(raw)
+                value_offset = None
+            elif encoding != 0:
+                raise ValueError(
+                    'Unknown FBX array encoding {} at byte {}.'.format(
+                        encoding, value_offset))
+            value = np.frombuffer(raw, dtype=_ARRAY_DTYPES[type_code])
+            if len(value) != length:
+                raise ValueError(
+                    'Expected {} values in the FBX array at byte {}, '
+                    'got {}.'.format(length, value_offset, len(value)))
+        elif type_code in _STRING_TYPES:
+            length = struct.unpack_from('<I', data, offset)[0]
+            offset += 4
+            value_offset = offset
+            value = data[offset:offset + length]
+            offset += length
+        else:
+            raise ValueError(
+                'Unknown FBX property type {!r} at byte {}.'.format(
+                    type_code, offset - 1))
+        record.properties.append((type_code, value))
+        record.offsets.append(value_offset)
+
+    while offset < end_offset:
+        child, offset = _parse_record(data, offset, header)
+        if child is None:
+            record.has_sentinel = True
+            break
+        record.children.append(child)
+    if offset != end_offset:
+        raise ValueError(
+            'FBX record {!r} should end at byte {}, not {}.'.format(
+                name, end_offset, offset))
+    return record, end_offset
+
+
+def parse_fbx(data):
+    """Parses the bytes of a binary FBX file into an FbxDocument."""
+    import struct
+
+    if not data.startswith(_MAGIC):
+        raise ValueError('Not a binary FBX file.')
+    offset = len(_MAGIC)
+    version = struct.unpack_from('<I', data, offset)[0]
+    offset += 4
+    header = _record_header(version)
+
+    children = []
+    while True:
+        if offset + header.size + 1 > len(data):
+            raise ValueError('Truncated FBX file.')
+        record, offset = _parse_record(data, offset, header)
+        if record is None:
+            break
+        children.append(record)
+    return FbxDocument(
+        version, children=children, footer_id=data[offset:offset + 16])
+
+
+def _write_record(out, record, header, compress_arrays):
+    import struct
+    import zlib
+    import numpy as np
+
+    start = len(out)
+    out.extend(b'\0' * header.size)
+    out.extend(struct.pack('<B', len(record.name)))
+    out.extend(record.name)
+
+    properties_start = len(out)
+    for type_code, value in record.properties:
+        out.extend(type_code)
+        if type_code in _SCALAR_FORMATS:
+            out.extend(struct.pack(_SCALAR_FORMATS[type_code], value))
+        elif type_code in _ARRAY_DTYPES:
+            array = np.ascontiguousarray(
+                value, dtype=_ARRAY_DTYPES[type_code]).ravel()
+            raw = array.tobytes()
+            encoding = 0
+            if compress_arrays:
+                raw = zlib.compress(raw)
+                encoding = 1
+            out.extend(struct.pack('<III', len(array), encoding, len(raw)))
+            out.extend(raw)
+        elif type_code in _STRING_TYPES:
+            out.extend(struct.pack('<I', len(value)))
+            out.extend(value)
+        else:
+            raise ValueError(
+                'Unknown FBX property type {!r} in record {!r}.'.format(
+                    type_code, record.name))
+    properties_length = len(out) - properties_start
+
+    for child in record.children:
+        _write_record(out, child, header, compress_arrays)
+    if record.children or record.has_sentinel:
+        out.extend(b'\0' * (header.size + 1))
+    header.pack_into(
+        out, start, len(out), len(record.properties), properties_length)
+
+
+def serialize_fbx(document, compress_arrays=False):
+    """Returns the bytes of a binary FBX file.
+
+    document: an FbxDocument
+    compress_arrays: if True, zlib compress every array. Otherwise each
+        array is stored as is, so its size depends only on its length.
+    """
+    import struct
+
+    header = _record_header(document.version)
+    out = bytearray(_MAGIC)
+    out.extend(struct.pack('<I', document.version))
+    for record in document.children:
+        _write_record(out, record, header, compress_arrays)
+    out.extend(b'\0' * (header.size + 1))
+
+    # The footer: its id, padding to align the version to 16 bytes, then a
+    # fixed block.
+    out.extend(document.footer_id)
+    out.extend(b'\0' * 4)
+    out.extend(b'\0' * (16 - len(out) % 16))
+    out.extend(struct.pack('<I', document.version))
+    out.extend(b'\0' * 120)
+    out.extend(_FOOTER_MAGIC)
+    return bytes(out)
@@ -0,0 +1,415 @@
+# Exports rigged bodies by patching a reference FBX file.
+#
+# The FBX files of two bodies differ only in the control points and normals
+# of the mesh, the local translations of the skeleton nodes, and the link and
+# bind pose matrices of the joints. The topology, UVs, skinning weights,
+# connections and settings are byte-identical, apart from values the SDK
+# picks afresh for each export: the creation time and file id in the header,
+# the footer id and the object UIDs. So rather than building and exporting a
+# scene for every body, an FbxTemplate takes the file the SDK exported for one
+# reference body, rewrites it with uncompressed arrays (so every value has a
+# fixed size and position) and records where the variable values are. Each
+# body's file is then a copy of the template with those values overwritten
+# from numpy arrays.
+#
+# Example usage:
+#
+#     template = build_fbx_template(factory, vertices[0], fbx_manager)
+#     for body_vertices, output_path in zip(vertices, output_paths):
+#         world_positions, local_translations = (
+#             factory.skeleton_positions(body_vertices))
+#         template.export(
+#             output_path, body_vertices, world_positions, local_translations,
+#             factory.vertex_normals.compute(body_vertices))
+#
+# The template only needs the SDK to be built; `FbxTemplate(reference_data,
+# factory.skeleton_joint_names)` builds it from an existing export instead.
+# When adopting it for a new SDK version or rig, pass `check=True` to
+# `build_fbx_template`, which compares a patched file against the SDK's
+# export of a second body and imports it back.
+#
+# Templates are only available through this module: the bodylabs-rig command
+# and RigPool export every body with the SDK.
+#
+# The cluster Transform matrices and the mesh's bind pose matrix are the
+# identity for every body, so they are left as they are. Every file also keeps
+# the reference's header, footer id and UIDs.
+
+# Top-level records describing the file rather than the scene, which the SDK
+# writes afresh for each export.
+_FILE_RECORDS = (b'FBXHeaderExtension', b'FileId', b'CreationTime')
+
+
+def _identity_with_translations(translations):
+    """Returns Nx16 FBX matrices (row-major, acting on row vectors) for Nx3
+    translations.
+    """
+    import numpy as np
+
+    matrices = np.tile(np.eye(4).ravel(), (len(translations), 1))
+    matrices[:, 12:15] = translations
+    return matrices
+
+
+def _write_doubles(buffer, starts, values):
+    """Writes rows of little-endian doubles into a uint8 numpy buffer.
+
+    starts: the byte offset of each row
+    values: an array with one row per offset
+    """
+    import numpy as np
+
+    rows = np.ascontiguousarray(values, dtype='<f8').reshape(
+        len(starts), -1).view(np.uint8)
+    if len(starts) == 1:
+        buffer[starts[0]:starts[0] + rows.shape[1]] = rows[0]
+    else:
+        buffer[
+            np.asarray(starts)[:, np.newaxis] +
+            np.arange(rows.shape[1])] = rows
+
+
+def _normalized(data):
+    """Returns the bytes of a binary FBX file without the values which differ
+    between exports of the same scene.
+
+    The file's header records are dropped, the footer id is zeroed, and the
+    object UIDs are renumbered in the order the objects appear.
+    """
+    from bodylabs_rigger.fbx_binary import (
+        FbxDocument,
+        parse_fbx,
+        serialize_fbx,
+    )
+
+    document = parse_fbx(data)
+    children = [
+        record for record in document.children
+        if record.name not in _FILE_RECORDS]
+
+    uids = {}
+    for name in (b'Documents', b'Objects'):
+        container = document.find(name)
+        for record in container.children if container is not None else []:
+            if record.properties and record.properties[0][0] == b'L':
+                uids.setdefault(record.properties[0][1], len(uids) + 1)
+
+    # UIDs are also referenced by connections and pose nodes.
+    records = list(children)
+    while records:
+        record = records.pop()
+        record.properties = [
+            (type_code, uids.get(value, value) if type_code == b'L' else value)
+            for type_code, value in record.properties]
+        records.extend(record.children)
+    return serialize_fbx(FbxDocument(document.version, children=children))
+
+
+def _scene_values(fbx_scene):
+    """Returns (local translation, control points) for each node of a scene,
+    by name, as numpy arrays. Nodes without a mesh have no control points.
+    """
+    import numpy as np
+    from fbx import FbxMesh
+
+    values = {}
+    nodes = [fbx_scene.GetRootNode()]
+    while nodes:
+        node = nodes.pop()
+        for ci in range(node.GetChildCount()):
+            child = node.GetChild(ci)
+            nodes.append(child)
+            translation = child.LclTranslation.Get()
+            control_points = None
+            mesh = child.GetNodeAttribute()
+            if isinstance(mesh, FbxMesh):
+                control_points = np.array([
+                    [point[0], point[1], point[2]] for point in (
+                        mesh.GetControlPointAt(i)
+                        for i in range(mesh.GetControlPointsCount()))])
+            values[child.GetName()] = (
+                np.array([translation[0], translation[1], translation[2]]),
+                control_points)
+    return values
+
+
+def _object_name(record):
+    """Returns the name of an object record, without its class suffix."""
+    return record.properties[1][1].split(b'\x00\x01')[0].decode('utf-8')
+
+
+def _array_offset(record, name, length):
+    """Returns the data offset of the array in a nested record, checking
+    its length.
+    """
+    child = record.find(name) if record is not None else None
+    if child is None or not child.properties:
+        raise ValueError('The reference FBX has no {} array.'.format(name))
+    type_code, value = child.properties[0]
+    if type_code != b'd' or len(value) != length:
+        raise ValueError(
+            'Expected {} doubles in the reference FBX {} array, got {} '
+            '{!r}.'.format(length, name, len(value), type_code))
+    return child.offsets[0]
+
+
+class FbxTemplate(object):
+    """A reference FBX file and the offsets of its per-body values."""
+
+    def __init__(self, reference, skeleton_joint_names):
+        """Initializes the FbxTemplate.
+
+        reference: the bytes of a binary FBX file exported from
+            `RiggedModelFactory.construct_rig`
+        skeleton_joint_names: the name of each skeleton node, in the order
+            of `JointTree.flatten`
+        """
+        import numpy as np
+        from bodylabs_rigger.fbx_binary import parse_fbx, serialize_fbx
+
+        self._data = serialize_fbx(parse_fbx(reference))
+        document = parse_fbx(self._data)
+        objects = document.find(b'Objects')
+        connections = document.find(b'Connections')
+        if objects is None or connections is None:
+            raise ValueError('The reference FBX has no objects.')
+        joint_indices = {
+            name: ji for ji, name in enumerate(skeleton_joint_names)}
+
+        meshes = [
+            record for record in objects.find_all(b'Geometry')
+            if record.properties[2][1] == b'Mesh']
+        if len(meshes) != 1:
+            raise ValueError(
+                'Expected one mesh in the reference FBX, found {}.'.format(
+                    len(meshes)))
+        mesh = meshes[0]
+        self._num_vertices = len(mesh.find(b'Vertices').properties[0][1]) // 3
+        self._vertices_offset = _array_offset(
+            mesh, b'Vertices', 3 * self._num_vertices)
+        self._normals_offset = _array_offset(
+            mesh.find(b'LayerElementNormal'), b'Normals',
+            3 * self._num_vertices)
+
+        # The skeleton nodes, and the offsets of the x, y and z values of
+        # their Lcl Translation. The SDK omits translations which are zero.
+        joint_ids = {}
+        translation_joints = []
+        translation_offsets = []
+        for model in objects.find_all(b'Model'):
+            ji = joint_indices.get(_object_name(model))
+            if ji is None:
+                continue
+            joint_ids[model.properties[0][1]] = ji
+            for prop in model.find(b'Properties70').find_all(b'P'):
+                if prop.properties[0][1] == b'Lcl Translation':
+                    translation_joints.append(ji)
+                    translation_offsets.append(prop.offsets[-3:])
+        self._translation_joints = np.array(translation_joints, dtype=np.int64)
+        self._translation_offsets = np.array(
+            translation_offsets, dtype=np.int64).reshape(-1)
+        self.translated_joint_names = [
+            skeleton_joint_names[ji] for ji in translation_joints]
+
+        # Each cluster's TransformLink matrix is its joint's bind transform.
+        linked_joints = {}
+        for c in connections.find_all(b'C'):
+            if c.properties[1][1] in joint_ids:
+                linked_joints[c.properties[2][1]] = joint_ids[
+                    c.properties[1][1]]
+        link_joints = []
+        link_offsets = []
+        for deformer in objects.find_all(b'Deformer'):
+            if deformer.properties[2][1] != b'Cluster':
+                continue
+            link_joints.append(linked_joints[deformer.properties[0][1]])
+            link_offsets.append(_array_offset(deformer, b'TransformLink', 16))
+
+        # As is each joint's bind pose matrix.
+        for pose in objects.find_all(b'Pose'):
+            for pose_node in pose.find_all(b'PoseNode'):
+                ji = joint_ids.get(pose_node.find(b'Node').properties[0][1])
+                if ji is not None:
+                    link_joints.append(ji)
+                    link_offsets.append(
+                        _array_offset(pose_node, b'Matrix', 16))
+        self._link_joints = np.array(link_joints, dtype=np.int64)
+        self._link_offsets = np.array(link_offsets, dtype=np.int64)
+
+    @property
+    def num_vertices(self):
+        return self._num_vertices
+
+    def to_bytes(self, vertices, world_positions, local_translations,
+                 normals):
+        """Returns the FBX file for one body.
+
+        vertices: a Vx3 numpy array in centimeter units
+        world_positions, local_translations: Kx3 numpy arrays with the world
+            and local translation of each skeleton node, as returned by
+            `RiggedModelFactory.skeleton_positions`
+        normals: the Vx3 unit vertex normals
+        """
+        import numpy as np
+
+        world_positions = np.asarray(world_positions, dtype=np.float64)
+        local_translations = np.asarray(local_translations, dtype=np.float64)
+        buffer = np.frombuffer(bytearray(self._data), dtype=np.uint8)
+        _write_doubles(buffer, [self._vertices_offset], vertices)
+        _write_doubles(buffer, [self._normals_offset], normals)
+        _write_doubles(
+            buffer, self._translation_offsets,
+            local_translations[self._translation_joints].reshape(-1, 1))
+        _write_doubles(
+            buffer, self._link_offsets, _identity_with_translations(
+                world_positions[self._link_joints]))
+        return buffer.tobytes()
+
+    def check(self, reference, vertices, world_positions, local_translations,
+              normals):
+        """Raises ValueError unless patching the template with a body's
+        values reproduces the file the SDK exported for it, apart from the
+        header, footer id and UIDs.
+
+        Checked with a body other than the template's reference, this
+        catches values which vary between bodies but which the template
+        doesn't patch.
+
+        reference: the bytes of the binary FBX file exported for the body
+        vertices, world_positions, local_translations, normals: as for
+            `to_bytes`
+        """
+        if _normalized(self.to_bytes(
+                vertices, world_positions, local_translations,
+                normals)) != _normalized(reference):
+            raise ValueError(
+                'The FBX template does not reproduce the file exported by '
+                'the SDK.')
+
+    def check_import(self, fbx_manager, expected_scene, vertices,
+                     world_positions, local_translations, normals):
+        """Raises ValueError unless the SDK imports the patched file for a
+        body as the rig it was patched from: the same nodes, with the same
+        local translations and mesh control points.
+
+        fbx_manager: the FbxManager to import with
+        expected_scene: the FbxScene of the body, as returned by
+            `RiggedModelFactory.construct_rig`
+        vertices, world_positions, local_translations, normals: as for
+            `to_bytes`
+        """
+        import os
+        import tempfile
+        import numpy as np
+        from bodylabs_rigger.fbx_util import import_fbx_scene
+
+        fd, path = tempfile.mkstemp(suffix='.fbx')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.export(
+                    f, vertices, world_positions, local_translations,
+                    normals)
+            imported_scene = import_fbx_scene(fbx_manager, path)
+            try:
+                imported = _scene_values(imported_scene)
+            finally:
+                imported_scene.Destroy()
+        finally:
+            os.remove(path)
+
+        expected = _scene_values(expected_scene)
+        if sorted(imported) != sorted(expected):
+            raise ValueError(
+                'The patched FBX file has nodes {}, expected {}.'.format(
+                    ', '.join(sorted(imported)), ', '.join(sorted(expected))))
+        for name, (translation, control_points) in expected.iteritems():
+            imported_translation, imported_control_points = imported[name]
+            if not np.allclose(imported_translation, translation):
+                raise ValueError(
+                    'The patched FBX file has the wrong translation for '
+                    '{}: {}, expected {}.'.format(
+                        name, imported_translation, translation))
+            if control_points is None:
+                continue
+            if (imported_control_points is None or
+                    imported_control_points.shape != control_points.shape or
+                    not np.allclose(imported_control_points, control_points)):
+                raise ValueError(
+                    'The patched FBX file has the wrong control points for '
+                    '{}.'.format(name))
+
+    def export(self, output, vertices, world_positions, local_translations,
+               normals):
+        """Writes the FBX file for one body.
+
+        output: a path, or a file-like object opened for binary writing
+        vertices, world_positions, local_translations, normals: as for
+            `to_bytes`
+
+        Returns the number of bytes written.
+        """
+        import os
+
+        data = self.to_bytes(
+            vertices, world_positions, local_translations, normals)
+        if hasattr(output, 'write'):
+            output.write(data)
+        else:
+            with open(os.path.expanduser(output), 'wb') as f:
+                f.write(data)
+        return len(data)
+
+
+def build_fbx_template(factory, vertices, fbx_manager, check=False):
+    """Builds an FbxTemplate from a body rigged and exported with the SDK.
+
+    factory: the RiggedModelFactory of the rig
+    vertices: a Vx3 numpy array in centimeter units. Every joint the rig
+        positions must have a non-zero translation relative to its parent.
+    fbx_manager: the FbxManager to rig and export with
+    check: if True, also check that the template reproduces the export of
+        a second body, and that the SDK imports the patched file as that
+        body's rig. This rigs and exports the second body with the SDK and
+        imports a file, so it costs several times as much as building the
+        template.
+    """
+    import numpy as np
+    from bodylabs_rigger.fbx_util import export_fbx_scene_to_bytes
+
+    def export_with_sdk(fbx_scene):
+        return export_fbx_scene_to_bytes(
+            fbx_manager, fbx_scene, file_format='binary')
+
+    fbx_scene = factory.construct_rig(vertices, fbx_manager)
+    try:
+        template = FbxTemplate(
+            export_with_sdk(fbx_scene), factory.skeleton_joint_names)
+    finally:
+        fbx_scene.Destroy()
+    # A solved joint without a translation in the reference would keep a
+    # zero translation in every body.
+    untranslated = (
+        set(factory.joint_position_solver.joint_names) &
+        set(factory.skeleton_joint_names)) - set(
+            template.translated_joint_names)
+    if untranslated:
+        raise ValueError(
+            'The reference body has no translation for joints {}; use a '
+            'different body.'.format(', '.join(sorted(untranslated))))
+    if not check:
+        return template
+
+    # Scaling and shifting the body changes every value the template
+    # patches.
+    check_vertices = 1.01 * np.asarray(vertices) + 1.
+    check_values = [check_vertices] + list(
+        factory.skeleton_positions(check_vertices)) + [
+            factory.vertex_normals.compute(check_vertices)]
+    fbx_scene = factory.construct_rig(check_vertices, fbx_manager)
+    try:
+        template.check(export_with_sdk(fbx_scene), *check_values)
+        # The SDK should also read a patched file back as the rig.
+        template.check_import(fbx_manager, fbx_scene, *check_values)
+    finally:
+        fbx_scene.Destroy()
+    return template
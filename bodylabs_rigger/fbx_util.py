@@ -8,6 +8,8 @@
 #     # ... Make some changes ...
 #
 #     export_fbx_scene(manager, scene, 'path/to/scene_modified.fbx')
+#     # Or, e.g. to upload the scene without keeping a copy on disk:
+#     data = export_fbx_scene_to_bytes(manager, scene, file_format='binary')
 #     manager.Destroy()
 #     # Delete the (now unusable) FbxManager to avoid accidental
 #     # usage in later code.
@@ -46,14 +48,260 @@ def import_fbx_scene(fbx_manager, scene_path):
     return scene
 
 
-def export_fbx_scene(fbx_manager, scene, output_path):
+# Writer descriptions registered by the FBX SDK, by file format name.
+_FILE_FORMAT_DESCRIPTIONS = {
+    'binary': 'FBX binary (*.fbx)',
+    'ascii': 'FBX ascii (*.fbx)',
+}
+
+
+def _find_writer_id(fbx_manager, file_format):
+    """Returns the SDK writer id for a file format name.
+
+    file_format: 'binary', 'ascii', or None to let the SDK choose the format
+        from the file extension.
+    """
+    if file_format is None:
+        return -1
+    if file_format not in _FILE_FORMAT_DESCRIPTIONS:
+        raise ValueError('Unknown file format: {}'.format(file_format))
+    writer_id = fbx_manager.GetIOPluginRegistry().FindWriterIDByDescription(
+        _FILE_FORMAT_DESCRIPTIONS[file_format])
+    if writer_id < 0:
+        raise RuntimeError(
+            'No FBX writer is registered for the {} format.'.format(
+                file_format))
+    return writer_id
+
+
+def _default_temp_directory():
+    """Returns a memory backed directory for temporary exports if there is
+    one, falling back to the default temporary directory.
+    """
+    import os
+    import tempfile
+
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+class ExportResult(object):
+    """The outcome of exporting one scene with a BatchExporter."""
+
+    def __init__(self, output_path, num_bytes, seconds):
+        """Initializes the ExportResult.
+
+        output_path: the path of the FBX file
+        num_bytes: the size of the FBX file
+        seconds: the time taken to export the scene
+        """
+        self.output_path = output_path
+        self.num_bytes = num_bytes
+        self.seconds = seconds
+
+
+class BatchExporter(object):
+    """Exports many scenes with a single FbxExporter.
+
+    The exporter, writer format and IO settings are set up once, and each
+    scene is destroyed as soon as it has been written, so memory stays flat
+    however many scenes are exported. For parallel exports, use one
+    BatchExporter per process, each with its own FbxManager (as the RigPool
+    workers do).
+
+    Example usage:
+
+        with BatchExporter(manager, '~/rigs') as exporter:
+            for name, vertices in meshes:
+                scene = factory.construct_rig(vertices, manager)
+                result = exporter.export(scene, name + '.fbx')
+                print result.output_path, result.num_bytes, result.seconds
+    """
+
+    def __init__(self, fbx_manager, output_directory=None,
+                 file_format='binary', embed_media=False,
+                 destroy_scenes=True):
+        """Initializes the BatchExporter.
+
+        fbx_manager: the FbxManager which owns the scenes
+        output_directory: the directory relative to which output paths are
+            resolved. It is created if needed.
+        file_format: 'binary', 'ascii', or None to let the SDK choose the
+            format from each file extension.
+        embed_media: if not None, whether to embed media such as textures in
+            the files. It is set on the manager's IO settings.
+        destroy_scenes: whether to destroy each scene once it is exported,
+            including when the export fails.
+        """
+        import os
+        from fbx import (
+            EXP_FBX_EMBEDDED,
+            FbxExporter,
+        )
+
+        self._fbx_manager = fbx_manager
+        self._output_directory = None
+        if output_directory is not None:
+            self._output_directory = os.path.expanduser(output_directory)
+        self._writer_id = _find_writer_id(fbx_manager, file_format)
+        self._io_settings = fbx_manager.GetIOSettings()
+        if embed_media is not None:
+            self._io_settings.SetBoolProp(EXP_FBX_EMBEDDED, embed_media)
+        self._destroy_scenes = destroy_scenes
+        # Directories known to exist, so each is only checked once.
+        self._directories = set()
+        self._exporter = FbxExporter.Create(fbx_manager, '')
+
+        self.num_files = 0
+        self.total_bytes = 0
+        self.total_seconds = 0.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        """Destroys the FbxExporter."""
+        if self._exporter is not None:
+            self._exporter.Destroy()
+            self._exporter = None
+
+    def _resolve_output_path(self, output_path):
+        import os
+
+        output_path = os.path.expanduser(output_path)
+        if self._output_directory is not None:
+            output_path = os.path.join(self._output_directory, output_path)
+
+        directory = os.path.dirname(output_path)
+        if directory and directory not in self._directories:
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Another process may have created it first.
+                    if not os.path.isdir(directory):
+                        raise
+            self._directories.add(directory)
+        return output_path
+
+    def export(self, scene, output_path):
+        """Writes a scene to an FBX file.
+
+        output_path: the path of the file, relative to the output directory
+            if there is one
+
+        Returns an ExportResult.
+        """
+        import os
+        import time
+
+        if self._exporter is None:
+            raise RuntimeError('BatchExporter has been closed.')
+
+        try:
+            start = time.time()
+            output_path = self._resolve_output_path(output_path)
+            if not self._exporter.Initialize(
+                    output_path, self._writer_id, self._io_settings):
+                raise IOError('Failed to open FBX file for export: {}'.format(
+                    output_path))
+            if not self._exporter.Export(scene):
+                raise IOError(
+                    'Failed to export scene: {}'.format(output_path))
+            seconds = time.time() - start
+        finally:
+            if self._destroy_scenes:
+                scene.Destroy()
+
+        num_bytes = os.path.getsize(output_path)
+        self.num_files += 1
+        self.total_bytes += num_bytes
+        self.total_seconds += seconds
+        return ExportResult(output_path, num_bytes, seconds)
+
+    def export_all(self, scenes):
+        """Exports a sequence of scenes.
+
+        scenes: an iterable of (scene, output_path) pairs. It is consumed
+            lazily, so scenes can be built one at a time.
+
+        Yields an ExportResult per scene.
+        """
+        for scene, output_path in scenes:
+            yield self.export(scene, output_path)
+
+
+def export_fbx_scene(fbx_manager, scene, output_path, file_format=None,
+                     embed_media=None):
+    """Writes a scene to an FBX file.
+
+    To export many scenes, a BatchExporter avoids setting up the exporter
+    for each one.
+
+    file_format: 'binary' or 'ascii'. Defaults to the SDK's choice for the
+        output path.
+    embed_media: if not None, whether to embed media such as textures in
+        the file. It is set on the manager's IO settings, so it also applies
+        to later exports. Defaults to the current IO settings.
+
+    Returns the expanded output path.
+    """
+    with BatchExporter(
+            fbx_manager, file_format=file_format, embed_media=embed_media,
+            destroy_scenes=False) as exporter:
+        return exporter.export(scene, output_path).output_path
+
+
+def export_fbx_scene_to_file(fbx_manager, scene, fileobj,
+                             file_format='binary', embed_media=False,
+                             temp_directory=None):
+    """Writes a scene in FBX format to a file-like object.
+
+    The SDK can only export to a path, so the scene is exported to a
+    temporary file, by default in memory backed /dev/shm where available,
+    which is copied to `fileobj` and removed.
+
+    fileobj: an object with a `write` method, e.g. an open file or socket
+        file, or a BytesIO
+    file_format, embed_media: as for `export_fbx_scene`. Unlike there, they
+        default to a binary file without embedded media, so the output
+        doesn't depend on the manager's settings.
+    temp_directory: the directory for the temporary file.
+
+    Returns the number of bytes written.
+    """
     import os
-    from fbx import FbxExporter
+    import shutil
+    import tempfile
+
+    fd, temp_path = tempfile.mkstemp(
+        suffix='.fbx', dir=temp_directory or _default_temp_directory())
+    os.close(fd)
+    try:
+        export_fbx_scene(
+            fbx_manager, scene, temp_path, file_format=file_format,
+            embed_media=embed_media)
+        with open(temp_path, 'rb') as f:
+            shutil.copyfileobj(f, fileobj, 1024 * 1024)
+        return os.path.getsize(temp_path)
+    finally:
+        os.remove(temp_path)
+
+
+def export_fbx_scene_to_bytes(fbx_manager, scene, file_format='binary',
+                              embed_media=False, temp_directory=None):
+    """Returns a scene in FBX format as a byte string.
 
-    output_path = os.path.expanduser(output_path)
+    See `export_fbx_scene_to_file`.
+    """
+    import io
 
-    exporter = FbxExporter.Create(fbx_manager, '')
-    exporter.Initialize(output_path, -1, fbx_manager.GetIOSettings())
-    exporter.Export(scene)
-    exporter.Destroy()
-    return output_path
+    output = io.BytesIO()
+    export_fbx_scene_to_file(
+        fbx_manager, scene, output, file_format=file_format,
+        embed_media=embed_media, temp_directory=temp_directory)
+    return output.getvalue()
@@ -0,0 +1,296 @@
+# Writes rigged bodies as skinned glTF 2.0 binary (GLB) files.
+#
+# This doesn't use the FBX SDK at all: the whole file is packed with numpy,
+# so it is much faster than building and exporting an FbxScene, and can run
+# anywhere numpy does. The output matches the FBX rig: the same joint
+# hierarchy, rest pose and skinning weights, with up to four joints per
+# vertex as glTF requires (the strongest four, renormalized).
+#
+# Example usage:
+#
+#     assets = factory.rig_assets
+#     exporter = GlbExporter(
+#         assets.textured_mesh, assets.joint_tree, assets.clusters)
+#     world_positions, _ = factory.skeleton_positions(vertices)
+#     exporter.export('body.glb', vertices, world_positions)
+#
+# Everything which depends only on the topology, texture map and weights is
+# packed once, when the exporter is created. glTF uses meters, so positions
+# are scaled from centimeters by default.
+
+_GLB_MAGIC = b'glTF'
+_GLB_VERSION = 2
+_GLB_CHUNK_JSON = 0x4E4F534A
+_GLB_CHUNK_BIN = 0x004E4942
+
+# glTF accessor component types and buffer view targets.
+_UNSIGNED_BYTE = 5121
+_UNSIGNED_SHORT = 5123
+_UNSIGNED_INT = 5125
+_FLOAT = 5126
+_ARRAY_BUFFER = 34962
+_ELEMENT_ARRAY_BUFFER = 34963
+
+_MAX_JOINTS_PER_VERTEX = 4
+
+
+def _add_array(array, component_type, accessor_type, target, offset,
+               buffer_views, accessors, extra=None):
+    """Adds a buffer view and accessor for an array stored at `offset`.
+
+    buffer_views, accessors: the lists of the glTF document to append to
+    extra: additional accessor properties, e.g. min and max
+
+    Returns the array's bytes, padded to a multiple of four, and the offset
+    following them.
+    """
+    import numpy as np
+
+    data = np.ascontiguousarray(array).tobytes()
+    view = {
+        'buffer': 0,
+        'byteOffset': offset,
+        'byteLength': len(data),
+    }
+    if target is not None:
+        view['target'] = target
+    buffer_views.append(view)
+    accessor = {
+        'bufferView': len(buffer_views) - 1,
+        'componentType': component_type,
+        'count': int(array.size if accessor_type == 'SCALAR' else len(array)),
+        'type': accessor_type,
+    }
+    accessor.update(extra or {})
+    accessors.append(accessor)
+    padding = -len(data) % 4
+    return data + b'\0' * padding, offset + len(data) + padding
+
+
+class GlbExporter(object):
+    """Packs rigged bodies into GLB files."""
+
+    def __init__(self, textured_mesh, joint_tree, clusters, unit_scale=0.01):
+        """Initializes the GlbExporter.
+
+        textured_mesh: the TexturedMesh of the rig
+        joint_tree: the JointTree at the root of the joint hierarchy
+        clusters: dict mapping joint name to ControlPointCluster
+        unit_scale: the factor converting vertex units to meters. Defaults
+            to converting from centimeters.
+        """
+        import numpy as np
+        from bodylabs_rigger.normals import VertexNormals
+
+        self._mesh_name = textured_mesh.name
+        self._unit_scale = unit_scale
+        self._joint_names, self._parent_indices = joint_tree.flatten()
+        num_joints = len(self._joint_names)
+
+        # glTF has one index per vertex for all attributes, so split each
+        # vertex into one copy per distinct UV it's used with.
+        faces = np.asarray(textured_mesh.faces, dtype=np.int64)
+        uv_indices = np.asarray(textured_mesh.uv_indices, dtype=np.int64)
+        uv_values = np.asarray(textured_mesh.uv_values, dtype=np.float32)
+        num_vertices = int(faces.max()) + 1
+        self._vertex_normals = VertexNormals(faces, num_vertices)
+        corner_keys = faces.ravel() * len(uv_values) + uv_indices.ravel()
+        split_keys, corner_split_indices = np.unique(
+            corner_keys, return_inverse=True)
+        # The source vertex of each split vertex, used to gather positions.
+        self._split_sources = split_keys // len(uv_values)
+        num_split_vertices = len(split_keys)
+
+        # Triangulate each quad (a, b, c, d) as (a, b, c) and (a, c, d).
+        quads = corner_split_indices.reshape(-1, 4)
+        triangles = np.concatenate(
+            [quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]], axis=1).reshape(
+                -1, 3)
+        index_dtype, index_type = (
+            (np.uint16, _UNSIGNED_SHORT) if num_split_vertices < 2 ** 16
+            else (np.uint32, _UNSIGNED_INT))
+
+        # glTF puts the UV origin at the top left.
+        uvs = uv_values[split_keys % len(uv_values)].copy()
+        uvs[:, 1] = 1. - uvs[:, 1]
+
+        # Keep the strongest joints of each vertex.
+        dense_weights = np.zeros((num_vertices, num_joints), dtype=np.float32)
+        for ji, name in enumerate(self._joint_names):
+            cluster = clusters.get(name)
+            if cluster is not None:
+                dense_weights[cluster.indices, ji] = cluster.weights
+        strongest = np.argsort(-dense_weights, axis=1)[
+            :, :_MAX_JOINTS_PER_VERTEX]
+        strongest_weights = dense_weights[
+            np.arange(num_vertices)[:, np.newaxis], strongest]
+        totals = strongest_weights.sum(axis=1)
+        totals[totals == 0] = 1.
+        strongest_weights /= totals[:, np.newaxis]
+        # Unused slots must have zero weight, and we point them at joint 0.
+        strongest[strongest_weights == 0] = 0
+        joint_dtype, joint_type = (
+            (np.uint8, _UNSIGNED_BYTE) if num_joints < 2 ** 8
+            else (np.uint16, _UNSIGNED_SHORT))
+
+        # The static part of the binary buffer, followed for each body by
+        # the positions, normals and inverse bind matrices.
+        self._static_buffer_views = []
+        self._static_accessors = []
+        static_arrays = [
+            (triangles.astype(index_dtype), index_type, 'SCALAR',
+             _ELEMENT_ARRAY_BUFFER),
+            (uvs, _FLOAT, 'VEC2', _ARRAY_BUFFER),
+            (strongest[self._split_sources].astype(joint_dtype), joint_type,
+             'VEC4', _ARRAY_BUFFER),
+            (strongest_weights[self._split_sources].astype(np.float32),
+             _FLOAT, 'VEC4', _ARRAY_BUFFER),
+        ]
+        static_chunks = []
+        offset = 0
+        for array, component_type, accessor_type, target in static_arrays:
+            chunk, offset = _add_array(
+                array, component_type, accessor_type, target, offset,
+                self._static_buffer_views, self._static_accessors)
+            static_chunks.append(chunk)
+        self._static_bytes = b''.join(static_chunks)
+        (self._indices_accessor, self._uv_accessor, self._joints_accessor,
+         self._weights_accessor) = range(4)
+        self._num_joints = num_joints
+
+    def to_bytes(self, vertices, world_positions, normals=None):
+        """Returns a GLB file for one body.
+
+        vertices: a Vx3 numpy array in centimeter units
+        world_positions: a Kx3 numpy array with the world position of each
+            joint, in the order of `JointTree.flatten`
+        normals: the Vx3 unit vertex normals. Computed from `vertices` if
+            None.
+        """
+        import json
+        import struct
+        import numpy as np
+
+        vertices = np.asarray(vertices, dtype=np.float64)
+        world_positions = np.asarray(
+            world_positions, dtype=np.float64) * self._unit_scale
+        if normals is None:
+            normals = self._vertex_normals.compute(vertices)
+
+        positions = (
+            vertices[self._split_sources] * self._unit_scale).astype(
+                np.float32)
+        split_normals = np.asarray(normals, dtype=np.float32)[
+            self._split_sources]
+        # Every bind transform is a pure translation, so its inverse is the
+        # opposite translation. glTF matrices are column-major.
+        inverse_bind_matrices = np.zeros(
+            (self._num_joints, 4, 4), dtype=np.float32)
+        inverse_bind_matrices[:, [0, 1, 2, 3], [0, 1, 2, 3]] = 1.
+        inverse_bind_matrices[:, 3, :3] = -world_positions
+
+        buffer_views = list(self._static_buffer_views)
+        accessors = list(self._static_accessors)
+        chunks = [self._static_bytes]
+        offset = len(self._static_bytes)
+        position_accessor = len(accessors)
+        chunk, offset = _add_array(
+            positions, _FLOAT, 'VEC3', _ARRAY_BUFFER, offset, buffer_views,
+            accessors, extra={
+                'min': positions.min(axis=0).tolist(),
+                'max': positions.max(axis=0).tolist(),
+            })
+        chunks.append(chunk)
+        normal_accessor = len(accessors)
+        chunk, offset = _add_array(
+            split_normals, _FLOAT, 'VEC3', _ARRAY_BUFFER, offset,
+            buffer_views, accessors)
+        chunks.append(chunk)
+        inverse_bind_accessor = len(accessors)
+        chunk, offset = _add_array(
+            inverse_bind_matrices, _FLOAT, 'MAT4', None, offset,
+            buffer_views, accessors)
+        chunks.append(chunk)
+        binary = b''.join(chunks)
+
+        # The joints are nodes 0 to K-1, followed by the mesh node.
+        local_translations = world_positions.copy()
+        parent_indices = np.asarray(self._parent_indices)
+        has_parent = parent_indices >= 0
+        local_translations[has_parent] -= world_positions[
+            parent_indices[has_parent]]
+        nodes = []
+        for ji, name in enumerate(self._joint_names):
+            nodes.append({
+                'name': name,
+                'translation': local_translations[ji].tolist(),
+            })
+        for ji, parent_index in enumerate(self._parent_indices):
+            if parent_index >= 0:
+                nodes[parent_index].setdefault('children', []).append(ji)
+        mesh_node = len(nodes)
+        nodes.append({'name': self._mesh_name, 'mesh': 0, 'skin': 0})
+        root_joints = [
+            ji for ji, parent_index in enumerate(self._parent_indices)
+            if parent_index < 0]
+
+        gltf = {
+            'asset': {
+                'version': '2.0',
+                'generator': 'bodylabs_rigger',
+            },
+            'scene': 0,
+            'scenes': [{'nodes': root_joints + [mesh_node]}],
+            'nodes': nodes,
+            'meshes': [{
+                'name': self._mesh_name,
+                'primitives': [{
+                    'attributes': {
+                        'POSITION': position_accessor,
+                        'NORMAL': normal_accessor,
+                        'TEXCOORD_0': self._uv_accessor,
+                        'JOINTS_0': self._joints_accessor,
+                        'WEIGHTS_0': self._weights_accessor,
+                    },
+                    'indices': self._indices_accessor,
+                }],
+            }],
+            'skins': [{
+                'inverseBindMatrices': inverse_bind_accessor,
+                'joints': range(self._num_joints),
+                'skeleton': root_joints[0],
+            }],
+            'accessors': accessors,
+            'bufferViews': buffer_views,
+            'buffers': [{'byteLength': len(binary)}],
+        }
+        json_bytes = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+        json_bytes += b' ' * (-len(json_bytes) % 4)
+
+        return b''.join([
+            struct.pack(
+                '<4sII', _GLB_MAGIC, _GLB_VERSION,
+                12 + 8 + len(json_bytes) + 8 + len(binary)),
+            struct.pack('<II', len(json_bytes), _GLB_CHUNK_JSON),
+            json_bytes,
+            struct.pack('<II', len(binary), _GLB_CHUNK_BIN),
+            binary,
+        ])
+
+    def export(self, output, vertices, world_positions, normals=None):
+        """Writes a GLB file for one body.
+
+        output: a path, or a file-like object opened for binary writing
+        vertices, world_positions, normals: as for `to_bytes`
+
+        Returns the number of bytes written.
+        """
+        import os
+
+        data = self.to_bytes(vertices, world_positions, normals=normals)
+        if hasattr(output, 'write'):
+            output.write(data)
+        else:
+            with open(os.path.expanduser(output), 'wb') as f:
+                f.write(data)
+        return len(data)
@@ -0,0 +1,293 @@
+# Instrumentation for the rigging hot path.
+#
+# The RiggedModelFactory reports each stage of `construct_rig` (and the pool
+# workers report each export) to its `instrumentation` object:
+#
+#     joint_positions      solving the joint positions from the vertices
+#     skeleton             building the skeleton nodes
+#     mesh                 building the mesh
+#     skin_and_bind_pose   building the skin clusters and bind pose
+#     construct_rig        the whole rig, including the stages above
+#     export               writing the FBX file
+#
+# By default this is a NullInstrumentation, whose stages do nothing. To see
+# where the time goes, use an Instrumentation instead:
+#
+#     instrumentation = Instrumentation()
+#     factory = RiggedModelFactory.create_default(
+#         instrumentation=instrumentation)
+#     # ... rig some meshes ...
+#     print json.dumps(instrumentation.summary(), indent=2)
+#
+# For each stage it aggregates the wall time, the number of FBX SDK calls
+# (when the `fbx` module keeps count, as the benchmark stub does) and the
+# peak resident memory of the process into fixed-size histograms, so it can
+# stay enabled in long running jobs. Callbacks can be added to receive every
+# individual measurement, e.g. to forward them to a metrics service.
+
+
+def sdk_call_count():
+    """Returns the total number of FBX SDK calls so far, or None if the
+    `fbx` module doesn't count them.
+    """
+    import sys
+
+    counts = getattr(sys.modules.get('fbx'), 'CALL_COUNTS', None)
+    if counts is None:
+        return None
+    return sum(counts.values())
+
+
+def peak_rss_bytes():
+    """Returns the peak resident memory of this process so far, in bytes."""
+    import resource
+    import sys
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes.
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return peak
+
+
+def current_rss_bytes():
+    """Returns the resident memory of this process, in bytes.
+
+    Falls back to the peak resident memory where the current value isn't
+    available (i.e. without /proc).
+    """
+    import os
+
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return peak_rss_bytes()
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class Histogram(object):
+    """Aggregates positive values into logarithmically spaced buckets.
+
+    Adding a value is O(1) and the memory used is fixed, regardless of the
+    number of values. Percentiles are accurate to within one bucket, i.e.
+    about 12% with the default of 20 buckets per decade.
+    """
+
+    def __init__(self, min_value=1e-6, max_value=1e12, buckets_per_decade=20):
+        """Initializes the Histogram.
+
+        min_value, max_value: the range of the buckets. Values outside it are
+            counted in the first or last bucket, and are still reflected
+            exactly in the min, max and mean.
+        buckets_per_decade: the number of buckets per power of ten.
+        """
+        import math
+
+        self._min_value = float(min_value)
+        self._buckets_per_decade = buckets_per_decade
+        self._num_buckets = 2 + int(math.ceil(
+            math.log10(max_value / self._min_value) * buckets_per_decade))
+        self._counts = [0] * self._num_buckets
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        import math
+
+        if value <= self._min_value:
+            return 0
+        bucket = 1 + int(
+            math.log10(value / self._min_value) * self._buckets_per_decade)
+        return min(bucket, self._num_buckets - 1)
+
+    def _bucket_upper_bound(self, bucket):
+        return self._min_value * 10 ** (
+            float(bucket) / self._buckets_per_decade)
+
+    def add(self, value):
+        self._counts[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Adds the values counted by another Histogram with the same
+        buckets.
+        """
+        if (other._min_value != self._min_value or
+                other._num_buckets != self._num_buckets or
+                other._buckets_per_decade != self._buckets_per_decade):
+            raise ValueError('Histograms have different buckets.')
+        for bucket, count in enumerate(other._counts):
+            self._counts[bucket] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, q):
+        """Returns an estimate of the q-th percentile, for q in [0, 100]."""
+        if not self.count:
+            return None
+        rank = q / 100. * self.count
+        seen = 0
+        for bucket, count in enumerate(self._counts):
+            seen += count
+            if count and seen >= rank:
+                estimate = self._bucket_upper_bound(bucket)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+class NullInstrumentation(object):
+    """Instrumentation which records nothing.
+
+    Every stage shares one do-nothing context manager, so the only cost is a
+    method call on entering and leaving each stage.
+    """
+
+    _STAGE = _NullStage()
+
+    def stage(self, name):
+        return NullInstrumentation._STAGE
+
+
+class _Stage(object):
+    """Measures a single run of a stage."""
+
+    def __init__(self, instrumentation, name):
+        self._instrumentation = instrumentation
+        self._name = name
+
+    def __enter__(self):
+        import time
+
+        self._sdk_calls = sdk_call_count()
+        self._peak_rss = peak_rss_bytes()
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        import time
+
+        measurement = {'wall_seconds': time.time() - self._start}
+        sdk_calls = sdk_call_count()
+        if sdk_calls is not None and self._sdk_calls is not None:
+            measurement['sdk_calls'] = sdk_calls - self._sdk_calls
+        peak_rss = peak_rss_bytes()
+        measurement['peak_rss_bytes'] = peak_rss
+        # Nonzero only if the process reached a new peak during the stage.
+        measurement['peak_rss_growth_bytes'] = peak_rss - self._peak_rss
+        measurement['failed'] = exc_type is not None
+        self._instrumentation._record(self._name, measurement)
+        return False
+
+
+class Instrumentation(object):
+    """Records the wall time, SDK calls and peak memory of each stage."""
+
+    # The measurements aggregated into histograms.
+    _HISTOGRAM_KEYS = ('wall_seconds', 'sdk_calls', 'peak_rss_growth_bytes')
+
+    def __init__(self, callbacks=None):
+        """Initializes the Instrumentation.
+
+        callbacks: a list of functions called with the stage name and a dict
+            of measurements (wall_seconds, sdk_calls if known,
+            peak_rss_bytes, peak_rss_growth_bytes and failed) after every
+            run of a stage. They are called on the thread running the stage.
+        """
+        import threading
+
+        self._callbacks = list(callbacks or [])
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._failures = {}
+        self._peak_rss_bytes = {}
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def stage(self, name):
+        """Returns a context manager which measures a run of the named
+        stage.
+        """
+        return _Stage(self, name)
+
+    def _record(self, name, measurement):
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            for key in Instrumentation._HISTOGRAM_KEYS:
+                if key in measurement:
+                    if key not in histograms:
+                        histograms[key] = Histogram()
+                    histograms[key].add(measurement[key])
+            if measurement['failed']:
+                self._failures[name] = self._failures.get(name, 0) + 1
+            self._peak_rss_bytes[name] = max(
+                self._peak_rss_bytes.get(name, 0),
+                measurement['peak_rss_bytes'])
+        for callback in self._callbacks:
+            callback(name, measurement)
+
+    def histogram(self, name, key='wall_seconds'):
+        """Returns the Histogram of a measurement for the named stage, or
+        None if it hasn't been recorded.
+        """
+        with self._lock:
+            return self._histograms.get(name, {}).get(key)
+
+    def summary(self):
+        """Returns a JSON serializable dict mapping each stage name to its
+        aggregated measurements.
+        """
+        with self._lock:
+            summary = {}
+            for name, histograms in self._histograms.iteritems():
+                stage_summary = dict(
+                    (key, histogram.as_dict())
+                    for key, histogram in histograms.iteritems())
+                stage_summary['failures'] = self._failures.get(name, 0)
+                stage_summary['peak_rss_bytes'] = self._peak_rss_bytes[name]
+                summary[name] = stage_summary
+            return summary
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._failures = {}
+            self._peak_rss_bytes = {}
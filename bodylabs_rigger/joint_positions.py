@@ -35,6 +35,13 @@
 # ----------
 # 'LeftShoulder' and 'RightShoulder' are positioned 1/3 of the way from the
 # 'Neck' to the 'LeftArm' and 'RightArm' joints respectively.
+#
+# Batch solving
+# -------------
+# `JointPositionSolver` compiles a joint position spec into padded index
+# arrays and a relative position matrix once, and then positions every joint
+# for a whole stack of meshes in a handful of numpy operations. Use it when
+# rigging many meshes with the same spec.
 
 
 def calculate_joint_position(vertices, reference_vertices,
@@ -51,6 +58,117 @@ def calculate_joint_position(vertices, reference_vertices,
     return v1 + (v2 - v1) * np.array(relative_position)
 
 
+class JointPositionSolver(object):
+    """Vectorized joint position calculation for a fixed joint spec."""
+
+    _SHOULDER_JOINTS = [
+        ('LeftShoulder', 'LeftArm'),
+        ('RightShoulder', 'RightArm'),
+    ]
+
+    def __init__(self, joint_position_spec):
+        """Compiles the joint position spec.
+
+        joint_position_spec: a dict mapping joint name to position
+            specification (see above for details).
+        """
+        import numpy as np
+
+        spec_names = sorted(joint_position_spec.keys())
+        reference_vertices = [
+            np.asarray(
+                joint_position_spec[name]['reference_vertices']).ravel()
+            for name in spec_names
+        ]
+        max_references = max([len(r) for r in reference_vertices] + [2])
+
+        # Pad each row by repeating its first index. Repeated vertices don't
+        # change the min/max extrema, and a single reference vertex becomes
+        # a degenerate pair of identical extrema points.
+        self._reference_vertices = np.empty(
+            (len(spec_names), max_references), dtype=np.intp)
+        for ji, r in enumerate(reference_vertices):
+            self._reference_vertices[ji, :] = r[0]
+            self._reference_vertices[ji, :len(r)] = r
+            if len(r) == 2:
+                self._reference_vertices[ji, 1:] = r[1]
+        self._use_extrema = np.array(
+            [len(r) > 2 for r in reference_vertices], dtype=bool)
+        self._relative_positions = np.array([
+            joint_position_spec[name].get(
+                'relative_position', [0.5, 0.5, 0.5])
+            for name in spec_names
+        ], dtype=np.float64).reshape(-1, 3)
+
+        # 'LeftShoulder' and 'RightShoulder' are special cased.
+        self._derived_joints = []
+        self.missing_joints = []
+        names = list(spec_names)
+        for shoulder, arm in JointPositionSolver._SHOULDER_JOINTS:
+            for name in ['Neck', arm]:
+                if (name not in joint_position_spec and
+                        name not in self.missing_joints):
+                    self.missing_joints.append(name)
+            if 'Neck' in joint_position_spec and arm in joint_position_spec:
+                self._derived_joints.append((
+                    len(names),
+                    spec_names.index('Neck'),
+                    spec_names.index(arm),
+                ))
+                names.append(shoulder)
+        self.joint_names = names
+        self._num_spec_joints = len(spec_names)
+
+    def solve(self, vertices):
+        """Calculate joint positions for one or more meshes.
+
+        vertices: a Vx3 or NxVx3 numpy array
+
+        Returns a Jx3 or NxJx3 numpy array, respectively, where the joint
+        order is given by `joint_names`.
+        """
+        import numpy as np
+
+        vertices = np.asarray(vertices)
+        single_mesh = vertices.ndim == 2
+        if single_mesh:
+            vertices = vertices[np.newaxis]
+
+        num_meshes = vertices.shape[0]
+        positions = np.empty(
+            (num_meshes, len(self.joint_names), 3), dtype=np.float64)
+
+        v1 = vertices[:, self._reference_vertices[:, 0], :]
+        v2 = vertices[:, self._reference_vertices[:, 1], :]
+        if self._use_extrema.any():
+            joint_vertices = vertices[
+                :, self._reference_vertices[self._use_extrema], :]
+            v1[:, self._use_extrema] = joint_vertices.min(axis=2)
+            v2[:, self._use_extrema] = joint_vertices.max(axis=2)
+        spec_positions = positions[:, :self._num_spec_joints, :]
+        np.subtract(v2, v1, out=spec_positions)
+        spec_positions *= self._relative_positions
+        spec_positions += v1
+
+        for ji, neck_ji, arm_ji in self._derived_joints:
+            neck_pos = positions[:, neck_ji, :]
+            positions[:, ji, :] = (
+                neck_pos + (positions[:, arm_ji, :] - neck_pos) / 3.)
+
+        if single_mesh:
+            return positions[0]
+        return positions
+
+    def solve_map(self, vertices):
+        """Calculate joint positions for a single Vx3 mesh.
+
+        Returns a map from joint name to target location (as a 3-element
+        numpy array) in world coordinates.
+        """
+        positions = self.solve(vertices)
+        return dict(zip(self.joint_names, positions))
+
+
 def calculate_joint_positions(vertices, joint_position_spec):
     """Calculate the position of each joint relative to the given vertices.
 
@@ -61,23 +179,10 @@ def calculate_joint_positions(vertices, joint_position_spec):
     Returns a map from joint name to target location (as a 3-element numpy
     array) in world coordinates.
     """
-    joint_location_map = {}
-    for joint_name, joint_spec in joint_position_spec.iteritems():
-        joint_location_map[joint_name] = calculate_joint_position(
-            vertices, **joint_spec)
-
-    # 'LeftShoulder' and 'RightShoulder' are special cased.
-    try:
-        neck_pos = joint_location_map['Neck']
-        left_arm_pos = joint_location_map['LeftArm']
-        joint_location_map['LeftShoulder'] = (
-            neck_pos + (left_arm_pos - neck_pos) / 3.
-        )
-        right_arm_pos = joint_location_map['RightArm']
-        joint_location_map['RightShoulder'] = (
-            neck_pos + (right_arm_pos - neck_pos) / 3.
-        )
-    except KeyError as ke:
-        print "Unrecognized joint name: '{}'".format(ke)
-
-    return joint_location_map
+    import logging
+
+    solver = JointPositionSolver(joint_position_spec)
+    for joint_name in solver.missing_joints:
+        logging.getLogger(__name__).warning(
+            "Unrecognized joint name: '%s'", joint_name)
+    return solver.solve_map(vertices)
@@ -0,0 +1,80 @@
+# Vertex normals for meshes with a fixed topology.
+#
+# Every body shares the rig's quad topology, so which faces touch which
+# vertices only needs to be worked out once. The normal of each vertex is
+# then the normalized sum of the area-weighted normals of its faces, computed
+# for a whole stack of bodies at once:
+#
+#     vertex_normals = VertexNormals(textured_mesh.faces)
+#     normals = vertex_normals.compute(vertices)  # Vx3 or NxVx3
+
+
+class VertexNormals(object):
+    """Computes area-weighted vertex normals for a fixed quad topology."""
+
+    def __init__(self, faces, num_vertices=None):
+        """Initializes the VertexNormals.
+
+        faces: Fx4 array of vertex indices, in counter-clockwise order
+        num_vertices: the number of vertices. Defaults to one more than the
+            largest index in `faces`.
+        """
+        import numpy as np
+
+        faces = np.asarray(faces, dtype=np.int64)
+        if faces.ndim != 2 or faces.shape[1] != 4:
+            raise ValueError('Expected Fx4 quad faces, got {}.'.format(
+                faces.shape))
+        self._faces = faces
+        self._num_vertices = num_vertices or int(faces.max()) + 1
+        # The vertex at each corner of each face, in order.
+        self._incident_vertices = faces.ravel()
+
+    @property
+    def num_vertices(self):
+        return self._num_vertices
+
+    def face_normals(self, vertices):
+        """Returns the Fx3 or NxFx3 area-weighted face normals.
+
+        The cross product of a quad's diagonals is twice its (vector) area,
+        including for non-planar quads.
+        """
+        import numpy as np
+
+        vertices = np.asarray(vertices, dtype=np.float64)
+        corners = [vertices[..., self._faces[:, ci], :] for ci in range(4)]
+        return np.cross(corners[2] - corners[0], corners[3] - corners[1])
+
+    def compute(self, vertices):
+        """Returns unit vertex normals for a Vx3 or NxVx3 array of vertices.
+
+        Vertices which aren't part of any face, or whose faces have no area,
+        get a zero normal.
+        """
+        import numpy as np
+
+        vertices = np.asarray(vertices, dtype=np.float64)
+        batch_shape = vertices.shape[:-2]
+        num_bodies = int(np.prod(batch_shape))
+        face_normals = self.face_normals(
+            vertices.reshape((num_bodies,) + vertices.shape[-2:]))
+
+        # Sum each face's normal into its four vertices, for every body at
+        # once, by offsetting the vertex indices of each body.
+        indices = (
+            self._incident_vertices[np.newaxis, :] +
+            self._num_vertices * np.arange(num_bodies)[:, np.newaxis]
+        ).ravel()
+        normals = np.empty((num_bodies * self._num_vertices, 3))
+        for axis in range(3):
+            normals[:, axis] = np.bincount(
+                indices,
+                weights=np.repeat(
+                    face_normals[..., axis].ravel(), 4),
+                minlength=num_bodies * self._num_vertices)
+
+        lengths = np.sqrt((normals ** 2).sum(axis=1))
+        lengths[lengths == 0] = 1.
+        normals /= lengths[:, np.newaxis]
+        return normals.reshape(batch_shape + (self._num_vertices, 3))
@@ -0,0 +1,283 @@
+# Cache for rigged FBX outputs.
+#
+# Rigging and exporting a mesh is deterministic given the input vertices, the
+# rig assets and the exporter settings, so re-running a batch job over
+# unchanged bodies can reuse the FBX files from an earlier run.
+#
+# Entries are keyed by a hash of the vertex array, the factory's rig asset
+# fingerprint and the exporter settings. A JSON manifest maps each key to
+# its file, size and timestamps, so lookups never scan the cache directory.
+# The manifest is updated under a file lock and replaced atomically, so
+# several processes can share a cache.
+#
+# Example usage:
+#
+#     cache = RigOutputCache('~/rig_cache', max_bytes=50 * 2 ** 30)
+#     output_path, cache_hit = cached_rig_and_export(
+#         factory, vertices, fbx_manager, 'out/body.fbx', cache)
+#
+# Entries are private copies: files are copied into the cache, and hits are
+# copied out to the requested output path, each through a temporary file
+# which is renamed into place. So rewriting an output file never changes a
+# cache entry, and a reader never sees a partly written file.
+
+
+class RigOutputCache(object):
+    """A directory of FBX files indexed by a manifest."""
+
+    # Bump to invalidate existing entries when the rig output changes.
+    _CACHE_VERSION = 1
+    _MANIFEST_FILENAME = 'manifest.json'
+    _LOCK_FILENAME = '.lock'
+    _ENTRY_EXTENSION = '.fbx'
+    # The defaults of `export_fbx_scene`.
+    _DEFAULT_EXPORTER_SETTINGS = {'file_format': None, 'embed_media': None}
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        """Initializes the RigOutputCache.
+
+        directory: the directory in which entries are stored. It is created
+            if it doesn't exist.
+        max_bytes: if not None, the least recently used entries are evicted
+            to keep the total size of the entries below this limit.
+        max_age: if not None, entries which haven't been used for this many
+            seconds are evicted.
+        """
+        import os
+
+        self._directory = os.path.expanduser(directory)
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(self._directory):
+            try:
+                os.makedirs(self._directory)
+            except OSError:
+                # Another process may have created it first.
+                if not os.path.isdir(self._directory):
+                    raise
+
+    def key(self, vertices, rig_fingerprint, exporter_settings=None):
+        """Returns the cache key for a rig.
+
+        vertices: the Vx3 numpy array of mesh vertices
+        rig_fingerprint: the fingerprint of the rig assets, as returned by
+            `RigAssets.fingerprint`
+        exporter_settings: a dict of keyword arguments for
+            `export_fbx_scene`. Omitted settings take their defaults, so
+            None and {'file_format': None, 'embed_media': None} give the
+            same key.
+        """
+        import hashlib
+        import json
+        import numpy as np
+
+        # Fill in the defaults, so that settings which export the same file
+        # share a key.
+        settings = dict(RigOutputCache._DEFAULT_EXPORTER_SETTINGS)
+        settings.update(exporter_settings or {})
+
+        h = hashlib.sha1()
+        h.update(json.dumps({
+            'version': RigOutputCache._CACHE_VERSION,
+            'rig_fingerprint': rig_fingerprint,
+            'exporter_settings': settings,
+            'vertices_shape': list(np.shape(vertices)),
+        }, sort_keys=True).encode('utf-8'))
+        h.update(np.ascontiguousarray(vertices, dtype='<f8').tobytes())
+        return h.hexdigest()
+
+    def _path(self, filename):
+        import os
+
+        return os.path.join(self._directory, filename)
+
+    def _read_manifest(self):
+        import json
+
+        try:
+            with open(self._path(RigOutputCache._MANIFEST_FILENAME)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest):
+        import json
+        import os
+        import tempfile
+
+        fd, temp_path = tempfile.mkstemp(
+            dir=self._directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(temp_path, self._path(RigOutputCache._MANIFEST_FILENAME))
+
+    def _update_manifest(self, update):
+        """Applies `update` to the manifest while holding the lock.
+
+        update: a function which modifies the manifest dict in place.
+        """
+        import fcntl
+
+        with open(self._path(RigOutputCache._LOCK_FILENAME), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                manifest = self._read_manifest()
+                update(manifest)
+                self._write_manifest(manifest)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _copy_atomically(source, destination):
+        """Copies a file to a temporary file next to `destination`, and
+        renames it into place.
+        """
+        import os
+        import shutil
+        import uuid
+
+        # Unlike mkstemp, which creates the file with mode 0600, this
+        # honors the umask, as the renamed file is the output.
+        temp_path = os.path.join(
+            os.path.dirname(os.path.abspath(destination)),
+            '.{}.tmp'.format(uuid.uuid4().hex))
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as f, open(source, 'rb') as source_file:
+                shutil.copyfileobj(source_file, f)
+            os.rename(temp_path, destination)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def get(self, key, output_path=None):
+        """Looks up a cached FBX file.
+
+        output_path: if not None, the cached file is copied here.
+
+        Returns the path of the FBX file, or None on a miss.
+        """
+        import os
+        import time
+
+        entry = self._read_manifest().get(key)
+        cached_path = None
+        if entry is not None:
+            cached_path = self._path(entry['filename'])
+            if not os.path.exists(cached_path):
+                cached_path = None
+        if cached_path is None:
+            self.misses += 1
+            return None
+
+        if output_path is not None:
+            output_path = os.path.expanduser(output_path)
+            try:
+                RigOutputCache._copy_atomically(cached_path, output_path)
+            except (IOError, OSError):
+                # Evicted by another process while we copied it.
+                self.misses += 1
+                return None
+            cached_path = output_path
+
+        def touch(manifest):
+            if key in manifest:
+                manifest[key]['last_used'] = time.time()
+        self._update_manifest(touch)
+
+        self.hits += 1
+        return cached_path
+
+    def put(self, key, path):
+        """Adds an exported FBX file to the cache."""
+        import os
+        import time
+
+        filename = key + RigOutputCache._ENTRY_EXTENSION
+        RigOutputCache._copy_atomically(
+            os.path.expanduser(path), self._path(filename))
+
+        def add(manifest):
+            now = time.time()
+            manifest[key] = {
+                'filename': filename,
+                'size': os.path.getsize(self._path(filename)),
+                'created': now,
+                'last_used': now,
+            }
+            self._evict(manifest)
+        self._update_manifest(add)
+
+    def _evict(self, manifest):
+        """Removes expired and least recently used entries from the manifest
+        and the cache directory.
+        """
+        import os
+        import time
+
+        by_last_use = sorted(
+            manifest.items(), key=lambda item: item[1]['last_used'])
+        total_bytes = sum(entry['size'] for _, entry in by_last_use)
+        now = time.time()
+        for key, entry in by_last_use:
+            expired = (
+                self._max_age is not None and
+                now - entry['last_used'] > self._max_age)
+            too_large = (
+                self._max_bytes is not None and
+                total_bytes > self._max_bytes)
+            if not (expired or too_large):
+                continue
+            try:
+                os.remove(self._path(entry['filename']))
+            except OSError:
+                pass
+            total_bytes -= entry['size']
+            del manifest[key]
+
+    def evict(self):
+        """Applies the size and age limits."""
+        self._update_manifest(self._evict)
+
+    @property
+    def size_bytes(self):
+        """The total size of the cache entries."""
+        return sum(
+            entry['size'] for entry in self._read_manifest().itervalues())
+
+
+def cached_rig_and_export(factory, vertices, fbx_manager, output_path, cache,
+                          exporter_settings=None):
+    """Rigs and exports a mesh, reusing a cached FBX file if possible.
+
+    factory: the RiggedModelFactory
+    vertices: a Vx3 numpy array in centimeter units
+    fbx_manager: the FbxManager used on a cache miss
+    output_path: the path to which the FBX file is written
+    cache: a RigOutputCache
+    exporter_settings: a dict of keyword arguments for `export_fbx_scene`,
+        e.g. {'file_format': 'binary'}. They are also part of the cache
+        key.
+
+    Returns a tuple of the output path and whether it was a cache hit.
+    """
+    from bodylabs_rigger.fbx_util import export_fbx_scene
+
+    key = cache.key(
+        vertices, factory.rig_assets.fingerprint(), exporter_settings)
+    cached_path = cache.get(key, output_path)
+    if cached_path is not None:
+        return cached_path, True
+
+    rigged_mesh = factory.construct_rig(vertices, fbx_manager)
+    try:
+        output_path = export_fbx_scene(
+            fbx_manager, rigged_mesh, output_path,
+            **(exporter_settings or {}))
+    finally:
+        rigged_mesh.Destroy()
+    cache.put(key, output_path)
+    return output_path, False
@@ -0,0 +1,391 @@
+# Overlaps fetching, rigging and writing meshes.
+#
+# Meshes flow through three stages connected by bounded queues:
+#
+#     fetch threads -> RigPool worker processes -> writer threads
+#
+# Fetching (e.g. from BodyKit) is I/O bound and runs on threads. Rigging and
+# exporting is CPU bound and runs in a RigPool. Since FBX scenes can't be
+# passed between processes, the rig workers export each scene to a staging
+# directory (ideally on a local disk or tmpfs), and the writer threads move
+# the files to their final, possibly slower, destination. Without a staging
+# directory the workers export in place and the writers only record the
+# output sizes.
+#
+# Each stage blocks once the queue after it is full, so a slow stage holds
+# back the ones before it rather than letting meshes pile up in memory, and
+# the throughput is set by the slowest stage instead of the sum of all three.
+#
+# Example usage:
+#
+#     mesh_generator = MeshGenerator(access_key, secret)
+#     jobs = (
+#         (mesh_generator._random_mesh_request(), 'out/{}.fbx'.format(i))
+#         for i in range(100))
+#     with RigPool(num_workers=8) as pool:
+#         pipeline = RigPipeline(
+#             pool, lambda request: mesh_generator.get_mesh_for_measurements(
+#                 *request),
+#             staging_directory='/dev/shm/rigs')
+#         for result in pipeline.run(jobs):
+#             ...
+#         print pipeline.metrics()
+
+
+class PipelineResult(object):
+    """The outcome of a single mesh passing through the pipeline."""
+
+    def __init__(self, index, output_path, error=None, timings=None,
+                 cache_hit=False, num_bytes=None):
+        """Initializes the PipelineResult.
+
+        index: the position of the job in the iterable passed to `run`
+        output_path: the final path of the FBX file
+        error: None on success, otherwise a description of the failure
+        timings: dict mapping stage name to seconds
+        cache_hit: whether the FBX file came from the rig output cache
+        num_bytes: the size of the written FBX file
+        """
+        self.index = index
+        self.output_path = output_path
+        self.error = error
+        self.timings = timings or {}
+        self.cache_hit = cache_hit
+        self.num_bytes = num_bytes
+
+
+class _StageMetrics(object):
+    """Counters for a stage and the depth of the queue feeding it."""
+
+    def __init__(self):
+        import threading
+
+        self._lock = threading.Lock()
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.
+        self.max_queue_depth = 0
+        self._queue_depth_total = 0
+        self._queue_depth_samples = 0
+
+    def record_queue_depth(self, depth):
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            self._queue_depth_total += depth
+            self._queue_depth_samples += 1
+
+    def record_item(self, seconds, error=False):
+        with self._lock:
+            self.items += 1
+            self.busy_seconds += seconds
+            if error:
+                self.errors += 1
+
+    def as_dict(self):
+        with self._lock:
+            mean_queue_depth = 0.
+            if self._queue_depth_samples:
+                mean_queue_depth = (
+                    float(self._queue_depth_total) /
+                    self._queue_depth_samples)
+            return {
+                'items': self.items,
+                'errors': self.errors,
+                'busy_seconds': self.busy_seconds,
+                'max_queue_depth': self.max_queue_depth,
+                'mean_queue_depth': mean_queue_depth,
+            }
+
+
+class RigPipeline(object):
+    """Fetches, rigs and writes meshes in overlapping stages."""
+
+    STAGES = ('fetch', 'rig', 'write')
+    _POLL_INTERVAL = 0.5
+    # How often the dispatcher checks the RigPool for results while waiting
+    # for fetched meshes.
+    _RESULT_POLL_INTERVAL = 0.05
+    # Marks the end of a stage's input.
+    _DONE = object()
+
+    def __init__(self, rig_pool, fetch, num_fetch_threads=8,
+                 num_writer_threads=2, max_fetched=None, max_rigged=None,
+                 staging_directory=None):
+        """Initializes the RigPipeline.
+
+        rig_pool: a started RigPool, which rigs and exports the meshes
+        fetch: a function which takes a job's source (see `run`) and returns
+            a Vx3 numpy array of vertices, or None if the mesh couldn't be
+            fetched. It is called concurrently from the fetch threads.
+        num_fetch_threads: the number of concurrent fetches.
+        num_writer_threads: the number of threads moving exported files from
+            the staging directory.
+        max_fetched: the number of fetched meshes which may wait for a rig
+            worker. Defaults to twice the number of fetch threads.
+        max_rigged: the number of exported files which may wait for a
+            writer. Defaults to four times the number of writer threads.
+        staging_directory: if not None, the directory to which the rig
+            workers export before the writers move each file to its output
+            path.
+        """
+        import os
+
+        self._rig_pool = rig_pool
+        self._fetch = fetch
+        self._num_fetch_threads = num_fetch_threads
+        self._num_writer_threads = num_writer_threads
+        self._max_fetched = max_fetched or 2 * num_fetch_threads
+        self._max_rigged = max_rigged or 4 * num_writer_threads
+        self._staging_directory = None
+        if staging_directory is not None:
+            self._staging_directory = os.path.expanduser(staging_directory)
+        self._stage_metrics = dict(
+            (stage, _StageMetrics()) for stage in RigPipeline.STAGES)
+
+    def metrics(self):
+        """Returns a dict mapping each stage name to its counters.
+
+        For each stage, `items` and `errors` count the meshes it processed,
+        `busy_seconds` is the total time spent on them across threads or
+        workers, and `max_queue_depth` and `mean_queue_depth` describe the
+        queue feeding it, sampled whenever an item is added. For the rig
+        stage the queue depth includes the jobs queued in the RigPool.
+        """
+        return dict(
+            (stage, metrics.as_dict())
+            for stage, metrics in self._stage_metrics.iteritems())
+
+    def _put(self, queue, item, stop):
+        """Puts an item on a bounded queue, giving up if `stop` is set."""
+        import Queue
+
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=RigPipeline._POLL_INTERVAL)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _get(self, queue, stop):
+        """Gets an item from a queue, returning _DONE if `stop` is set."""
+        import Queue
+
+        while not stop.is_set():
+            try:
+                return queue.get(timeout=RigPipeline._POLL_INTERVAL)
+            except Queue.Empty:
+                pass
+        return RigPipeline._DONE
+
+    def _staging_path(self, index, output_path):
+        import os
+
+        if self._staging_directory is None:
+            return output_path
+        return os.path.join(
+            self._staging_directory,
+            '{:08}_{}'.format(index, os.path.basename(output_path)))
+
+    def _run_fetcher(self, jobs, jobs_lock, fetched, completed, stop):
+        import time
+        import traceback
+
+        metrics = self._stage_metrics['fetch']
+        while not stop.is_set():
+            with jobs_lock:
+                job = next(jobs, None)
+            if job is None:
+                return
+            index, (source, output_path) = job
+
+            start = time.time()
+            try:
+                vertices = self._fetch(source)
+                error = None
+                if vertices is None:
+                    error = 'Failed to fetch the mesh.'
+            except Exception:
+                vertices = None
+                error = traceback.format_exc()
+            elapsed = time.time() - start
+            metrics.record_item(elapsed, error=error is not None)
+
+            if error is not None:
+                self._put(completed, PipelineResult(
+                    index, output_path, error=error,
+                    timings={'fetch': elapsed}), stop)
+                continue
+
+            self._stage_metrics['rig'].record_queue_depth(
+                fetched.qsize() + self._rig_pool.num_outstanding)
+            if not self._put(
+                    fetched, (index, vertices, output_path, elapsed), stop):
+                return
+
+    def _run_fetchers(self, jobs, fetched, completed, stop):
+        """Runs the fetch threads, then marks the end of the fetched queue."""
+        import threading
+
+        jobs = enumerate(iter(jobs))
+        jobs_lock = threading.Lock()
+        threads = [
+            threading.Thread(
+                target=self._run_fetcher,
+                args=(jobs, jobs_lock, fetched, completed, stop))
+            for _ in range(self._num_fetch_threads)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._put(fetched, RigPipeline._DONE, stop)
+
+    def _run_dispatcher(self, fetched, rigged, stop):
+        """Feeds fetched meshes to the RigPool and queues its results.
+
+        The RigPool is only used from this thread, which polls it for
+        results between fetched meshes, so finished rigs reach the writers
+        while the fetchers are still working.
+        """
+        import Queue
+
+        pool = self._rig_pool
+        metrics = self._stage_metrics['rig']
+        # The index, output path and fetch time of each job, by job id.
+        jobs = {}
+
+        def queue_result(rig_result):
+            index, output_path, fetch_seconds = jobs.pop(rig_result.job_id)
+            # The other timings are nested within construct_rig.
+            metrics.record_item(
+                sum(rig_result.timings.get(stage, 0.) for stage in (
+                    'cache_lookup', 'construct_rig', 'export')),
+                error=rig_result.error is not None)
+            self._stage_metrics['write'].record_queue_depth(rigged.qsize())
+            return self._put(rigged, (
+                index, output_path, fetch_seconds, rig_result), stop)
+
+        fetching = True
+        try:
+            while not stop.is_set() and (fetching or jobs):
+                if fetching:
+                    try:
+                        item = fetched.get(
+                            timeout=RigPipeline._RESULT_POLL_INTERVAL)
+                    except Queue.Empty:
+                        item = None
+                    if item is RigPipeline._DONE:
+                        fetching = False
+                    elif item is not None:
+                        index, vertices, output_path, fetch_seconds = item
+                        # Blocks while the workers are busy, collecting
+                        # their results.
+                        job_id = pool.submit(
+                            vertices, self._staging_path(index, output_path))
+                        jobs[job_id] = (index, output_path, fetch_seconds)
+
+                # Hand on every finished rig. Once all the meshes are
+                # fetched, wait for the rest.
+                while jobs:
+                    rig_result = pool.get_result(
+                        timeout=0. if fetching else
+                        RigPipeline._POLL_INTERVAL)
+                    if rig_result is None:
+                        break
+                    if not queue_result(rig_result):
+                        return
+        finally:
+            for _ in range(self._num_writer_threads):
+                self._put(rigged, RigPipeline._DONE, stop)
+
+    def _run_writer(self, rigged, completed, stop):
+        import os
+        import shutil
+        import time
+        import traceback
+
+        metrics = self._stage_metrics['write']
+        while True:
+            item = self._get(rigged, stop)
+            if item is RigPipeline._DONE:
+                break
+            index, output_path, fetch_seconds, rig_result = item
+
+            timings = dict(rig_result.timings, fetch=fetch_seconds)
+            result = PipelineResult(
+                index, output_path, error=rig_result.error, timings=timings,
+                cache_hit=rig_result.cache_hit)
+            if result.error is None:
+                start = time.time()
+                try:
+                    if rig_result.output_path != output_path:
+                        directory = os.path.dirname(output_path)
+                        if directory and not os.path.isdir(directory):
+                            try:
+                                os.makedirs(directory)
+                            except OSError:
+                                # Another writer may have created it first.
+                                if not os.path.isdir(directory):
+                                    raise
+                        shutil.move(rig_result.output_path, output_path)
+                    result.num_bytes = os.path.getsize(output_path)
+                except (IOError, OSError):
+                    result.error = traceback.format_exc()
+                timings['write'] = time.time() - start
+                metrics.record_item(
+                    timings['write'], error=result.error is not None)
+
+            if not self._put(completed, result, stop):
+                return
+        self._put(completed, RigPipeline._DONE, stop)
+
+    def run(self, jobs):
+        """Runs jobs through the pipeline.
+
+        jobs: an iterable of (source, output_path) pairs, where source is
+            passed to `fetch`. It is consumed lazily by the fetch threads.
+
+        Yields a PipelineResult per job, in completion order. Closing the
+        generator early stops the stages; meshes already submitted to the
+        RigPool are still rigged, but not moved to their output paths.
+        """
+        import os
+        import Queue
+        import threading
+
+        if self._staging_directory is not None and not os.path.exists(
+                self._staging_directory):
+            os.makedirs(self._staging_directory)
+
+        fetched = Queue.Queue(self._max_fetched)
+        rigged = Queue.Queue(self._max_rigged)
+        completed = Queue.Queue()
+        stop = threading.Event()
+
+        threads = [
+            threading.Thread(
+                target=self._run_fetchers,
+                args=(jobs, fetched, completed, stop)),
+            threading.Thread(
+                target=self._run_dispatcher, args=(fetched, rigged, stop)),
+        ] + [
+            threading.Thread(
+                target=self._run_writer, args=(rigged, completed, stop))
+            for _ in range(self._num_writer_threads)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            num_writers_running = self._num_writer_threads
+            while num_writers_running:
+                result = completed.get()
+                if result is RigPipeline._DONE:
+                    num_writers_running -= 1
+                    continue
+                yield result
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,382 @@
+# Rigs and exports meshes in parallel worker processes.
+#
+# Each worker process creates its own FbxManager and RiggedModelFactory once,
+# then rigs meshes from its job queue and writes the FBX files directly. Only
+# the vertex arrays and small result records cross process boundaries. Each
+# file is exported to a temporary name beside its output path and renamed
+# into place, so a worker killed mid-export never leaves a partial output.
+#
+# Example usage:
+#
+#     with RigPool(num_workers=8) as pool:
+#         jobs = ((vertices, path) for vertices, path in ...)
+#         for result in pool.imap(jobs):
+#             if result.error is not None:
+#                 print 'Failed to rig {}: {}'.format(
+#                     result.output_path, result.error)
+#
+# A job which raises only fails that job. If a worker process dies (e.g. in
+# the SDK), its outstanding jobs are reported as failed and the worker is
+# replaced.
+
+
+class RigResult(object):
+    """The outcome of a single rigging job."""
+
+    def __init__(self, job_id, output_path, error=None, timings=None,
+                 worker_pid=None, cache_hit=False, memory=None):
+        """Initializes the RigResult.
+
+        job_id: the id returned by `RigPool.submit`
+        output_path: the path of the FBX file
+        error: None on success, otherwise a description of the failure
+        timings: dict mapping stage name to seconds
+        worker_pid: the pid of the worker process which ran the job
+        cache_hit: whether the FBX file came from the output cache
+        memory: the worker's memory gauge after the job, as returned by
+            `SceneLifecycle.gauge`
+        """
+        self.job_id = job_id
+        self.output_path = output_path
+        self.error = error
+        self.timings = timings or {}
+        self.worker_pid = worker_pid
+        self.cache_hit = cache_hit
+        self.memory = memory or {}
+
+
+def _export_atomically(exporter, scene, output_path):
+    """Exports a scene with a BatchExporter to a temporary file in the
+    output directory, then renames it to `output_path`.
+
+    Returns the output path.
+    """
+    import os
+    import uuid
+
+    output_path = os.path.expanduser(output_path)
+    directory = os.path.dirname(os.path.abspath(output_path))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another worker may have created it first.
+            if not os.path.isdir(directory):
+                raise
+    # Keep the extension, which the SDK may use to choose the writer.
+    # Unlike mkstemp, which creates the file with mode 0600, this honors
+    # the umask.
+    temp_path = os.path.join(directory, '.rigging-{}{}'.format(
+        uuid.uuid4().hex, os.path.splitext(output_path)[1]))
+    os.close(os.open(
+        temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+    try:
+        exporter.export(scene, temp_path)
+        os.rename(temp_path, output_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return output_path
+
+
+def _run_worker(job_queue, result_queue, rig_assets_path,
+                output_cache_directory, max_scenes_per_manager,
+                max_rss_bytes):
+    """Entry point for a worker process."""
+    import os
+    import time
+    import traceback
+    from bodylabs_rigger.factory import RiggedModelFactory
+    from bodylabs_rigger.instrumentation import Instrumentation
+    from bodylabs_rigger.rig_assets import RigAssets
+    from bodylabs_rigger.scene_lifecycle import SceneLifecycle
+
+    if rig_assets_path is None:
+        assets = RigAssets.load_default()
+    else:
+        assets = RigAssets.load(rig_assets_path)
+    factory = RiggedModelFactory(**assets.__dict__)
+
+    # Report the time taken by each stage of each job.
+    stage_timings = {}
+
+    def record_stage(name, measurement):
+        stage_timings[name] = measurement['wall_seconds']
+    instrumentation = Instrumentation(callbacks=[record_stage])
+    factory.instrumentation = instrumentation
+
+    output_cache = None
+    if output_cache_directory is not None:
+        from bodylabs_rigger.output_cache import RigOutputCache
+        output_cache = RigOutputCache(output_cache_directory)
+        rig_fingerprint = assets.fingerprint()
+
+    # Owns the FbxManager, which is recycled to bound the worker's memory.
+    # The exporter settings are also part of the output cache key.
+    exporter_settings = {'file_format': None, 'embed_media': None}
+    lifecycle = SceneLifecycle(
+        max_scenes=max_scenes_per_manager, max_rss_bytes=max_rss_bytes,
+        exporter_settings=exporter_settings)
+    try:
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+            job_id, vertices, output_path = job
+
+            stage_timings.clear()
+            timings = {}
+            error = None
+            cache_key = None
+            try:
+                if output_cache is not None:
+                    start = time.time()
+                    cache_key = output_cache.key(
+                        vertices, rig_fingerprint, exporter_settings)
+                    cached_path = output_cache.get(cache_key, output_path)
+                    timings['cache_lookup'] = time.time() - start
+                    if cached_path is not None:
+                        result_queue.put(RigResult(
+                            job_id, cached_path, timings=timings,
+                            worker_pid=os.getpid(), cache_hit=True,
+                            memory=lifecycle.gauge()))
+                        continue
+
+                with lifecycle.rigged_scene(factory, vertices) as scene:
+                    with instrumentation.stage('export'):
+                        output_path = _export_atomically(
+                            lifecycle.exporter, scene, output_path)
+
+                if cache_key is not None:
+                    output_cache.put(cache_key, output_path)
+            except Exception:
+                error = traceback.format_exc()
+            finally:
+                timings.update(stage_timings)
+
+            result_queue.put(RigResult(
+                job_id, output_path, error=error, timings=timings,
+                worker_pid=os.getpid(), memory=lifecycle.gauge()))
+    finally:
+        lifecycle.close()
+
+
+class _Worker(object):
+    """Bookkeeping for a single worker process."""
+
+    def __init__(self, process, job_queue):
+        self.process = process
+        self.job_queue = job_queue
+        # Map from job id to output path for jobs sent to this worker but
+        # not yet completed.
+        self.outstanding = {}
+
+
+class RigPool(object):
+    """A pool of worker processes which rig meshes and export FBX files."""
+
+    _POLL_INTERVAL = 0.5
+
+    def __init__(self, num_workers=None, max_pending_per_worker=2,
+                 rig_assets_path=None, output_cache_directory=None,
+                 max_scenes_per_manager=None, max_rss_bytes_per_worker=None):
+        """Initializes the RigPool.
+
+        The worker processes are started on `start` or when entering the
+        context manager.
+
+        num_workers: the number of worker processes. Defaults to the number
+            of CPUs.
+        max_pending_per_worker: the maximum number of jobs queued for each
+            worker. `submit` blocks once every worker is at this limit, which
+            bounds the number of vertex arrays held in memory.
+        rig_assets_path: the RigAssets file used to create each worker's
+            factory. Defaults to the default rig assets.
+        output_cache_directory: if not None, the directory of a
+            RigOutputCache (see `output_cache.py`) shared by the workers.
+            Meshes whose FBX output is cached are not rigged again.
+        max_scenes_per_manager: if not None, each worker recycles its
+            FbxManager after rigging this many meshes. See
+            `scene_lifecycle.py`.
+        max_rss_bytes_per_worker: if not None, each worker recycles its
+            FbxManager when the manager's growth takes its resident memory
+            past this limit. See `SceneLifecycle`.
+        """
+        import multiprocessing
+
+        if max_pending_per_worker < 1:
+            raise ValueError('max_pending_per_worker must be at least 1.')
+
+        self._num_workers = num_workers or multiprocessing.cpu_count()
+        self._max_pending_per_worker = max_pending_per_worker
+        self._rig_assets_path = rig_assets_path
+        self._output_cache_directory = output_cache_directory
+        self._max_scenes_per_manager = max_scenes_per_manager
+        self._max_rss_bytes_per_worker = max_rss_bytes_per_worker
+        self._result_queue = None
+        self._workers = []
+        self._next_job_id = 0
+        # Results collected while waiting for room in a job queue.
+        self._completed = []
+
+    def _start_worker(self):
+        import multiprocessing
+
+        job_queue = multiprocessing.Queue(self._max_pending_per_worker)
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(job_queue, self._result_queue, self._rig_assets_path,
+                  self._output_cache_directory, self._max_scenes_per_manager,
+                  self._max_rss_bytes_per_worker))
+        process.daemon = True
+        process.start()
+        return _Worker(process, job_queue)
+
+    def start(self):
+        import multiprocessing
+
+        if self._workers:
+            raise RuntimeError('RigPool has already been started.')
+        self._result_queue = multiprocessing.Queue()
+        self._workers = [
+            self._start_worker() for _ in range(self._num_workers)]
+
+    def close(self, timeout=None):
+        """Stops the workers once they have finished their queued jobs.
+
+        Results which have not been collected are discarded.
+        """
+        for worker in self._workers:
+            if worker.process.is_alive():
+                worker.job_queue.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        self._workers = []
+
+    def terminate(self):
+        """Stops the workers immediately."""
+        for worker in self._workers:
+            worker.process.terminate()
+        for worker in self._workers:
+            worker.process.join()
+        self._workers = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    @property
+    def num_outstanding(self):
+        """The number of submitted jobs whose results are not yet returned."""
+        return len(self._completed) + sum(
+            len(w.outstanding) for w in self._workers)
+
+    def submit(self, vertices, output_path):
+        """Queues a mesh to be rigged and exported.
+
+        Blocks while every worker already has `max_pending_per_worker`
+        outstanding jobs.
+
+        vertices: a Vx3 numpy array in centimeter units
+        output_path: the path to which the FBX file will be written
+
+        Returns the job id, which is reported in the corresponding RigResult.
+        """
+        if not self._workers:
+            raise RuntimeError('RigPool has not been started.')
+
+        while True:
+            worker = min(self._workers, key=lambda w: len(w.outstanding))
+            if len(worker.outstanding) < self._max_pending_per_worker:
+                break
+            self._completed.append(self._wait_for_result())
+
+        job_id = self._next_job_id
+        self._next_job_id += 1
+        worker.outstanding[job_id] = output_path
+        worker.job_queue.put((job_id, vertices, output_path))
+        return job_id
+
+    def get_result(self, timeout=None):
+        """Returns the next RigResult, in completion order.
+
+        Blocks until a result is available, or for at most `timeout`
+        seconds if it is not None, returning None if no result is ready by
+        then.
+        """
+        if self._completed:
+            return self._completed.pop(0)
+        if not any(w.outstanding for w in self._workers):
+            raise RuntimeError('No outstanding jobs.')
+        return self._wait_for_result(timeout)
+
+    def imap(self, jobs):
+        """Rigs a sequence of meshes.
+
+        jobs: an iterable of (vertices, output_path) pairs. It is consumed
+            lazily, so it may be a generator over an arbitrarily large
+            dataset.
+
+        Yields a RigResult per job, in completion order.
+        """
+        for vertices, output_path in jobs:
+            self.submit(vertices, output_path)
+            while self._completed:
+                yield self._completed.pop(0)
+        while self.num_outstanding:
+            yield self.get_result()
+
+    def _wait_for_result(self, timeout=None):
+        import Queue
+        import time
+
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            poll_interval = RigPool._POLL_INTERVAL
+            if deadline is not None:
+                poll_interval = max(
+                    0., min(poll_interval, deadline - time.time()))
+            try:
+                result = self._result_queue.get(timeout=poll_interval)
+            except Queue.Empty:
+                failed = self._replace_dead_workers()
+                if failed:
+                    self._completed.extend(failed[1:])
+                    return failed[0]
+                if deadline is not None and time.time() >= deadline:
+                    return None
+                continue
+
+            # Ignore late results for jobs already reported as failed.
+            for worker in self._workers:
+                if result.job_id in worker.outstanding:
+                    del worker.outstanding[result.job_id]
+                    return result
+
+    def _replace_dead_workers(self):
+        """Restarts workers which have exited unexpectedly.
+
+        Returns a list of failed RigResults for their outstanding jobs.
+        """
+        failed = []
+        for wi, worker in enumerate(self._workers):
+            if worker.process.is_alive():
+                continue
+            error = 'Worker process exited with code {}.'.format(
+                worker.process.exitcode)
+            for job_id, output_path in sorted(worker.outstanding.items()):
+                failed.append(RigResult(
+                    job_id, output_path, error=error,
+                    worker_pid=worker.process.pid))
+            self._workers[wi] = self._start_worker()
+        return failed
@@ -1,3 +1,59 @@
+# Serializable static data for the model rig.
+#
+# Rig assets can be stored in two formats:
+#
+# JSON
+# ----
+# The original, human readable format produced by `RigAssets.to_json`.
+#
+# Binary
+# ------
+# A flat, memory-mappable layout which loads in milliseconds and lets forked
+# worker processes share the array pages:
+#
+#     magic          8 bytes, `_BINARY_MAGIC`
+#     header_size    little-endian uint64
+#     header         UTF-8 JSON with the joint tree, joint position spec,
+#                    mesh name, cluster names and an array table giving the
+#                    dtype, shape and file offset of each array
+#     arrays         raw little-endian array data, each aligned to
+#                    `_BINARY_ALIGNMENT` bytes
+#
+# Indices are stored as int32 and UV coordinates and weights as float32. The
+# clusters are stored CSR-style: `cluster_offsets[i]:cluster_offsets[i + 1]`
+# slices the concatenated `cluster_indices` and `cluster_weights` for the
+# i-th name in the header's `cluster_names`.
+#
+# To convert JSON assets to the binary format:
+#
+#     python -m bodylabs_rigger.rig_assets rig_assets.json rig_assets.bin
+
+_BINARY_MAGIC = b'BLRIGAS1'
+_BINARY_ALIGNMENT = 64
+
+
+def _float32_to_json(values):
+    """Returns a float32 array as a flat list of floats for JSON.
+
+    Converting float32 values straight to float gives their exact binary
+    value, which prints as e.g. 0.10000000149011612. Instead, each value is
+    given the fewest significant digits that read back as the same float32,
+    e.g. 0.1.
+    """
+    import numpy as np
+
+    result = []
+    for value in np.asarray(values, dtype=np.float32).ravel():
+        # Every float32 round-trips through 9 significant digits, and every
+        # decimal with 6 through a float32.
+        for digits in range(6, 10):
+            shortest = float('{:.{}g}'.format(value, digits))
+            if np.float32(shortest) == value:
+                break
+        result.append(shortest)
+    return result
+
+
 class RigAssets(object):
     """Serializable wrapper for dependencies of a RiggedModelFactory."""
 
@@ -32,20 +88,187 @@ class RigAssets(object):
             }
         )
 
-    def dump(self, filename):
+    def fingerprint(self):
+        """Returns a hex digest identifying the contents of the assets.
+
+        Arrays are hashed in the dtypes of the binary format, so the same
+        assets loaded from JSON or from the binary format share a
+        fingerprint.
+        """
+        import hashlib
+        import json
+        import numpy as np
+
+        cluster_names = sorted(self.clusters.keys())
+        h = hashlib.sha1()
+        h.update(json.dumps({
+            'joint_tree': self.joint_tree.to_json(),
+            'joint_position_spec': self.joint_position_spec,
+            'mesh_name': self.textured_mesh.name,
+            'cluster_names': cluster_names,
+        }, sort_keys=True).encode('utf-8'))
+        arrays = [
+            np.asarray(self.textured_mesh.faces, dtype='<i4'),
+            np.asarray(self.textured_mesh.uv_indices, dtype='<i4'),
+            np.asarray(self.textured_mesh.uv_values, dtype='<f4'),
+        ]
+        for name in cluster_names:
+            arrays.append(
+                np.asarray(self.clusters[name].indices, dtype='<i4'))
+            arrays.append(
+                np.asarray(self.clusters[name].weights, dtype='<f4'))
+        for a in arrays:
+            h.update(np.ascontiguousarray(a).tobytes())
+        return h.hexdigest()
+
+    def dump(self, filename, binary=False):
+        """Writes the assets to a file.
+
+        binary: if True, use the memory-mappable binary format. Otherwise,
+            write JSON.
+        """
         import json
 
+        if binary:
+            self._dump_binary(filename)
+            return
+
         with open(filename, 'w') as f:
             json.dump(self.to_json(), f)
 
     @classmethod
-    def load(cls, filename):
+    def load(cls, filename, mmap=True):
+        """Loads assets written by `dump`.
+
+        The file format is detected automatically.
+
+        mmap: if True, the arrays of binary assets are memory-mapped
+            read-only rather than read into memory.
+        """
         import json
 
+        with open(filename, 'rb') as f:
+            is_binary = f.read(len(_BINARY_MAGIC)) == _BINARY_MAGIC
+        if is_binary:
+            return cls._load_binary(filename, mmap=mmap)
+
         with open(filename, 'r') as f:
             assets = cls.from_json(json.load(f))
         return assets
 
+    @classmethod
+    def load_default(cls):
+        """Loads the rig assets shipped with the package."""
+        import os
+        import bodylabs_rigger.static
+
+        return cls.load(os.path.join(
+            os.path.dirname(bodylabs_rigger.static.__file__),
+            'rig_assets.bin'))
+
+    def _dump_binary(self, filename):
+        import json
+        import struct
+        import numpy as np
+
+        cluster_names = sorted(self.clusters.keys())
+        cluster_sizes = [
+            len(self.clusters[name].indices) for name in cluster_names]
+        arrays = [
+            ('faces', np.asarray(self.textured_mesh.faces, dtype='<i4')),
+            ('uv_indices',
+             np.asarray(self.textured_mesh.uv_indices, dtype='<i4')),
+            ('uv_values',
+             np.asarray(self.textured_mesh.uv_values, dtype='<f4')),
+            ('cluster_offsets',
+             np.cumsum([0] + cluster_sizes).astype('<i4')),
+            ('cluster_indices', np.concatenate([
+                np.asarray(self.clusters[name].indices, dtype='<i4')
+                for name in cluster_names])),
+            ('cluster_weights', np.concatenate([
+                np.asarray(self.clusters[name].weights, dtype='<f4')
+                for name in cluster_names])),
+        ]
+
+        def align(offset):
+            return -(-offset // _BINARY_ALIGNMENT) * _BINARY_ALIGNMENT
+
+        # The array offsets depend on the header size, which in turn depends
+        # on the offsets. Reserve a generous fixed width for each offset.
+        header = {
+            'joint_tree': self.joint_tree.to_json(),
+            'joint_position_spec': self.joint_position_spec,
+            'mesh_name': self.textured_mesh.name,
+            'cluster_names': cluster_names,
+            'arrays': {
+                name: {
+                    'dtype': a.dtype.str,
+                    'shape': list(a.shape),
+                    'offset': 10 ** 15,
+                }
+                for name, a in arrays
+            },
+        }
+        reserved_size = len(json.dumps(header, sort_keys=True))
+        offset = align(len(_BINARY_MAGIC) + 8 + reserved_size)
+        for name, a in arrays:
+            header['arrays'][name]['offset'] = offset
+            offset = align(offset + a.nbytes)
+        header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+        header_bytes += b' ' * (reserved_size - len(header_bytes))
+
+        with open(filename, 'wb') as f:
+            f.write(_BINARY_MAGIC)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for name, a in arrays:
+                f.write(b'\0' * (header['arrays'][name]['offset'] - f.tell()))
+                f.write(a.tobytes())
+
+    @classmethod
+    def _load_binary(cls, filename, mmap=True):
+        import json
+        import struct
+        import numpy as np
+
+        if mmap:
+            data = np.memmap(filename, dtype=np.uint8, mode='r')
+        else:
+            data = np.fromfile(filename, dtype=np.uint8)
+
+        header_start = len(_BINARY_MAGIC) + 8
+        header_size, = struct.unpack(
+            '<Q', data[len(_BINARY_MAGIC):header_start].tobytes())
+        header = json.loads(
+            data[header_start:header_start + header_size].tobytes().decode(
+                'utf-8'))
+
+        arrays = {}
+        for name, info in header['arrays'].iteritems():
+            dtype = np.dtype(str(info['dtype']))
+            shape = tuple(info['shape'])
+            start = info['offset']
+            stop = start + dtype.itemsize * int(np.prod(shape))
+            arrays[name] = data[start:stop].view(dtype).reshape(shape)
+
+        offsets = arrays['cluster_offsets']
+        clusters = {}
+        for ci, name in enumerate(header['cluster_names']):
+            start, stop = offsets[ci], offsets[ci + 1]
+            clusters[name] = ControlPointCluster(
+                indices=arrays['cluster_indices'][start:stop],
+                weights=arrays['cluster_weights'][start:stop])
+
+        return cls(
+            textured_mesh=TexturedMesh(
+                faces=arrays['faces'],
+                uv_indices=arrays['uv_indices'],
+                uv_values=arrays['uv_values'],
+                name=header['mesh_name']),
+            joint_tree=JointTree.from_json(header['joint_tree']),
+            joint_position_spec=header['joint_position_spec'],
+            clusters=clusters)
+
 
 class JointTree(object):
     """A simple tree-based representation for a hierarchy of joints."""
@@ -61,6 +284,25 @@ class JointTree(object):
         if self.children is None:
             self.children = []
 
+    def flatten(self):
+        """Lists the joints of the subtree in depth-first pre-order.
+
+        Returns a tuple of the joint names and, for each joint, the index of
+        its parent in that list (-1 for the root of the subtree).
+        """
+        names = []
+        parent_indices = []
+        stack = [(self, -1)]
+        while stack:
+            joint, parent_index = stack.pop()
+            parent_index_of_children = len(names)
+            names.append(joint.name)
+            parent_indices.append(parent_index)
+            stack.extend(
+                (child, parent_index_of_children)
+                for child in reversed(joint.children))
+        return names, parent_indices
+
     def to_json(self):
         return {
             'name': self.name,
@@ -75,38 +317,46 @@ class JointTree(object):
 class TexturedMesh(object):
     """Wrapper for the faces and corresponding texture map of a mesh."""
 
+    __slots__ = ('faces', 'uv_indices', 'uv_values', 'name')
+
     def __init__(self, faces, uv_indices, uv_values, name=None):
         """Initializes the TexturedMesh.
 
-        Let F denote the number of faces in the mesh.
+        Let F denote the number of faces in the mesh. The arrays are stored
+        as int32 and float32, the same as in the binary format, so arrays
+        loaded from it are used without a copy.
 
-        faces: Fx4 numpy array of vertex indices (four per face).
-        uv_indices: Fx4 numpy array of `uv_values` row indices.
+        faces: Fx4 array of vertex indices (four per face).
+        uv_indices: Fx4 array of `uv_values` row indices.
         uv_values: each row gives the U and V coordinates for a particular
             face vertex.
         name: the name for this mesh
         """
-        self.faces = faces
-        self.uv_indices = uv_indices
-        self.uv_values = uv_values
+        import numpy as np
+
+        self.faces = np.asarray(faces, dtype=np.int32)
+        self.uv_indices = np.asarray(uv_indices, dtype=np.int32)
+        self.uv_values = np.asarray(uv_values, dtype=np.float32)
         self.name = name or 'Bodylabs_body'
 
     def to_json(self):
-        import numpy as np
-
-        # Flatten each numpy array.
+        # Flatten each array.
         return {
-            k: v.ravel().tolist() if isinstance(v, np.ndarray) else v
-            for k, v in self.__dict__.iteritems()
+            'faces': self.faces.ravel().tolist(),
+            'uv_indices': self.uv_indices.ravel().tolist(),
+            'uv_values': _float32_to_json(self.uv_values),
+            'name': self.name,
         }
 
     @classmethod
     def from_json(cls, o):
         import numpy as np
         return cls(
-            faces=np.array(o['faces']).reshape(-1, 4),
-            uv_indices=np.array(o['uv_indices']).reshape(-1, 4),
-            uv_values=np.array(o['uv_values']).reshape(-1, 2),
+            faces=np.array(o['faces'], dtype=np.int32).reshape(-1, 4),
+            uv_indices=np.array(
+                o['uv_indices'], dtype=np.int32).reshape(-1, 4),
+            uv_values=np.array(
+                o['uv_values'], dtype=np.float32).reshape(-1, 2),
             name=o.get('name'),  # Allow None for backwards compatibility.
         )
 
@@ -114,13 +364,51 @@ class TexturedMesh(object):
 class ControlPointCluster(object):
     """Wrapper for the indices and weights of a vertex control cluster."""
 
+    __slots__ = ('indices', 'weights')
+
     def __init__(self, indices, weights):
-        self.indices = indices
-        self.weights = weights
+        """Initializes the ControlPointCluster.
+
+        indices: the indices of the vertices in the cluster, stored as an
+            int32 array
+        weights: the weight of each vertex, stored as a float32 array
+        """
+        import numpy as np
+
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        if self.indices.shape != self.weights.shape:
+            raise ValueError(
+                'Cluster has {} indices but {} weights.'.format(
+                    len(self.indices), len(self.weights)))
 
     def to_json(self):
-        return self.__dict__
+        return {
+            'indices': self.indices.tolist(),
+            'weights': _float32_to_json(self.weights),
+        }
 
     @classmethod
     def from_json(cls, o):
         return cls(**o)
+
+
+def convert_json_to_binary(json_path, binary_path):
+    """Converts JSON rig assets to the memory-mappable binary format."""
+    RigAssets.load(json_path).dump(binary_path, binary=True)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Convert JSON rig assets to the binary format.')
+    parser.add_argument('json_path', help='The JSON rig assets to convert.')
+    parser.add_argument('binary_path', help='The binary file to write.')
+    args = parser.parse_args()
+
+    convert_json_to_binary(args.json_path, args.binary_path)
+
+
+if __name__ == '__main__':
+    main()
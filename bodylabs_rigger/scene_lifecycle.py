@@ -0,0 +1,196 @@
+# Bounds the memory held by the FBX SDK in long running processes.
+#
+# Every rigged scene creates tens of thousands of SDK objects owned by the
+# FbxManager. Destroying each scene when done with it releases most of them,
+# but the manager still grows slowly over many scenes. A SceneLifecycle owns
+# the FbxManager, destroys scenes when their context exits, and recycles the
+# manager (destroying it and creating a fresh one) after a number of scenes
+# or once the process grows past a memory limit:
+#
+#     lifecycle = SceneLifecycle(max_scenes=500, max_rss_bytes=2 * 2 ** 30)
+#     for vertices, output_path in meshes:
+#         with lifecycle.rigged_scene(factory, vertices) as scene:
+#             lifecycle.exporter.export(scene, output_path)
+#         print lifecycle.gauge()
+#     lifecycle.close()
+#
+# The factory rebuilds its rig template the first time it's used with a new
+# manager, so nothing else needs to change when the manager is recycled.
+#
+# Not all of the memory is the manager's: the allocator may keep freed pages,
+# and the rest of the process may grow. So the memory limit is applied to the
+# growth since the last recycle. The first manager may grow the process from
+# where it started to the limit, and each later manager may grow it by as
+# much from where its predecessor left it. Otherwise, once the memory after a
+# recycle stayed above the limit, the manager would be recycled after every
+# scene.
+
+
+class SceneLifecycle(object):
+    """Owns an FbxManager and the scenes created with it."""
+
+    def __init__(self, max_scenes=None, max_rss_bytes=None,
+                 exporter_settings=None):
+        """Initializes the SceneLifecycle.
+
+        The FbxManager is created when first needed.
+
+        max_scenes: if not None, the manager is recycled once this many
+            scenes have been created with it.
+        max_rss_bytes: if not None, the manager is recycled when the
+            resident memory of the process exceeds this limit after a scene
+            is destroyed, and has grown since the last recycle by more than
+            the limit allowed the first manager (see above). It is ignored
+            if the process has already reached it when the first manager is
+            created.
+        exporter_settings: dict of keyword arguments for the BatchExporter
+            returned by `exporter`, e.g. {'file_format': 'binary'}.
+        """
+        self._max_scenes = max_scenes
+        self._max_rss_bytes = max_rss_bytes
+        self._exporter_settings = dict(exporter_settings or {})
+        # Scenes are destroyed by the lifecycle, not the exporter.
+        self._exporter_settings['destroy_scenes'] = False
+        self._manager = None
+        self._exporter = None
+        # The resident memory when the current manager was created, and the
+        # growth allowed before it's recycled.
+        self._rss_at_creation = None
+        self._rss_budget = None
+
+        self.live_scenes = 0
+        self.scenes_created = 0
+        self.scenes_since_recycle = 0
+        self.manager_recycles = 0
+        # The number of SDK objects in the last destroyed scene, if the
+        # bindings can count them.
+        self.objects_per_scene = None
+
+    @property
+    def manager(self):
+        """The current FbxManager. Don't hold on to it across scenes, since
+        it is destroyed when recycled.
+        """
+        from bodylabs_rigger.fbx_util import create_fbx_manager
+        from bodylabs_rigger.instrumentation import current_rss_bytes
+
+        if self._manager is None:
+            if self._max_rss_bytes is not None:
+                self._rss_at_creation = current_rss_bytes()
+                if self._rss_budget is None:
+                    self._rss_budget = (
+                        self._max_rss_bytes - self._rss_at_creation)
+            self._manager = create_fbx_manager()
+            self.scenes_since_recycle = 0
+        return self._manager
+
+    @property
+    def exporter(self):
+        """A BatchExporter for the current FbxManager."""
+        from bodylabs_rigger.fbx_util import BatchExporter
+
+        if self._exporter is None:
+            self._exporter = BatchExporter(
+                self.manager, **self._exporter_settings)
+        return self._exporter
+
+    def _should_recycle(self):
+        from bodylabs_rigger.instrumentation import current_rss_bytes
+
+        if self._manager is None or self.live_scenes:
+            return False
+        if (self._max_scenes is not None and
+                self.scenes_since_recycle >= self._max_scenes):
+            return True
+        if self._max_rss_bytes is None or self._rss_budget <= 0:
+            return False
+        rss = current_rss_bytes()
+        return (
+            rss > self._max_rss_bytes and
+            rss - self._rss_at_creation > self._rss_budget)
+
+    def _destroy_manager(self):
+        if self.live_scenes:
+            raise RuntimeError(
+                "Can't destroy the FbxManager while scenes are in use.")
+        if self._exporter is not None:
+            self._exporter.close()
+            self._exporter = None
+        if self._manager is not None:
+            self._manager.Destroy()
+            self._manager = None
+
+    def recycle(self):
+        """Destroys the FbxManager, along with every object it owns.
+
+        A new manager is created when next needed.
+        """
+        if self._manager is not None:
+            self._destroy_manager()
+            self.manager_recycles += 1
+
+    def close(self):
+        """Destroys the FbxManager."""
+        self._destroy_manager()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _managed(self, scene):
+        """Yields the scene, then destroys it and recycles the manager if
+        the policy says so.
+        """
+        self.live_scenes += 1
+        self.scenes_created += 1
+        self.scenes_since_recycle += 1
+        try:
+            yield scene
+        finally:
+            get_object_count = getattr(scene, 'GetSrcObjectCount', None)
+            if get_object_count is not None:
+                self.objects_per_scene = get_object_count()
+            scene.Destroy()
+            self.live_scenes -= 1
+            if self._should_recycle():
+                self.recycle()
+
+    def scene(self, name=''):
+        """Returns a context manager for a new, empty FbxScene, which is
+        destroyed when the context exits.
+        """
+        from contextlib import contextmanager
+        from fbx import FbxScene
+
+        return contextmanager(self._managed)(
+            FbxScene.Create(self.manager, name))
+
+    def rigged_scene(self, factory, vertices):
+        """Returns a context manager for the scene rigged by
+        `factory.construct_rig`, which is destroyed when the context exits.
+        """
+        from contextlib import contextmanager
+
+        return contextmanager(self._managed)(
+            factory.construct_rig(vertices, self.manager))
+
+    def gauge(self):
+        """Returns a dict describing the memory held by the process and the
+        SDK.
+        """
+        from bodylabs_rigger.instrumentation import (
+            current_rss_bytes,
+            peak_rss_bytes,
+        )
+
+        return {
+            'rss_bytes': current_rss_bytes(),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'live_scenes': self.live_scenes,
+            'scenes_created': self.scenes_created,
+            'scenes_since_recycle': self.scenes_since_recycle,
+            'manager_recycles': self.manager_recycles,
+            'objects_per_scene': self.objects_per_scene,
+        }
@@ -0,0 +1,216 @@
+# Linear blend skinning without the FBX SDK.
+#
+# The rig's control point clusters form a sparse JxV matrix of skinning
+# weights, where J is the number of joints and V the number of vertices.
+# Together with the rest (bind) positions of the joints, this is enough to
+# pose bodies directly in numpy, e.g. to render QA previews or to check that
+# a rig deforms sensibly, for thousands of bodies per second.
+#
+# Every joint's bind transform is a pure translation to its world position
+# (see `RiggedModelFactory._add_skin_and_bind_pose`), so a posed body is
+#
+#     v' = sum_j w_jv * G_j * T(-p_j) * v
+#
+# where G_j is the posed global transform of joint j and p_j its rest
+# position. Transforms are 4x4 matrices acting on column vectors.
+#
+# Example usage:
+#
+#     weights = skinning_weight_matrix(
+#         factory.rig_assets.clusters, factory.skeleton_joint_names,
+#         num_vertices)
+#     rest_positions, _ = factory.skeleton_positions(vertices)
+#     rotations = np.tile(np.eye(3), (num_joints, 1, 1))
+#     rotations[left_arm_index] = rotation_about_z(np.pi / 4)
+#     posed = pose(
+#         vertices, rest_positions, factory.skeleton_parent_indices, weights,
+#         rotations)
+#
+# Requires scipy, which can be installed with the `skinning` extra.
+
+
+def _import_sparse():
+    try:
+        import scipy.sparse
+    except ImportError:
+        raise ImportError(
+            'Skinning requires scipy. Install it with '
+            '`pip install bodylabs-rigger[skinning]`.')
+    return scipy.sparse
+
+
+def skinning_weight_matrix(clusters, joint_names, num_vertices,
+                           normalize=True, dtype=None):
+    """Builds the sparse matrix of skinning weights.
+
+    clusters: dict mapping joint name to ControlPointCluster
+    joint_names: the joint for each row of the matrix. Joints without a
+        cluster get an empty row, and clusters of joints not listed are
+        ignored.
+    num_vertices: the number of columns, i.e. vertices in the mesh
+    normalize: if True, scale the weights of each vertex to sum to one, as
+        the SDK does for clusters in normalize link mode. Vertices without
+        weights are left unchanged.
+    dtype: the dtype of the weights. Defaults to float32.
+
+    Returns a JxV scipy.sparse.csr_matrix.
+    """
+    import numpy as np
+    sparse = _import_sparse()
+
+    dtype = dtype or np.float32
+    rows = []
+    columns = []
+    values = []
+    for ji, name in enumerate(joint_names):
+        cluster = clusters.get(name)
+        if cluster is None:
+            continue
+        rows.append(np.full(len(cluster.indices), ji, dtype=np.int32))
+        columns.append(cluster.indices)
+        values.append(cluster.weights)
+
+    weights = sparse.csr_matrix(
+        (np.concatenate(values).astype(np.float64),
+         (np.concatenate(rows), np.concatenate(columns))),
+        shape=(len(joint_names), num_vertices))
+    if normalize:
+        # Normalize in float64 and round once, so each vertex's weights
+        # sum to one within the precision of `dtype`.
+        totals = np.asarray(weights.sum(axis=0)).ravel()
+        totals[totals == 0] = 1.
+        weights = weights.multiply((1. / totals)[np.newaxis, :]).tocsr()
+    return weights.astype(dtype)
+
+
+def translation_matrices(translations):
+    """Returns ...x4x4 homogeneous transforms for ...x3 translations."""
+    import numpy as np
+
+    translations = np.asarray(translations, dtype=np.float64)
+    transforms = np.zeros(translations.shape[:-1] + (4, 4))
+    transforms[...] = np.eye(4)
+    transforms[..., :3, 3] = translations
+    return transforms
+
+
+def forward_kinematics(rest_positions, parent_indices, local_rotations):
+    """Poses a skeleton by rotating each joint about its rest position.
+
+    rest_positions: a Kx3 or NxKx3 array of world joint positions in the
+        rest pose, as given by `RiggedModelFactory.skeleton_positions`
+    parent_indices: for each joint, the index of its parent, or -1 for the
+        root. Parents must precede their children, as in
+        `JointTree.flatten`.
+    local_rotations: a Kx3x3 or NxKx3x3 array giving the rotation of each
+        joint relative to its parent.
+
+    Returns a Kx4x4 or NxKx4x4 array of posed global joint transforms.
+    """
+    import numpy as np
+
+    rest_positions = np.asarray(rest_positions, dtype=np.float64)
+    local_rotations = np.asarray(local_rotations, dtype=np.float64)
+    batch_shape = np.broadcast(
+        rest_positions[..., 0], local_rotations[..., 0, 0]).shape
+
+    global_transforms = np.zeros(batch_shape + (4, 4))
+    for ji, parent_index in enumerate(parent_indices):
+        local = np.zeros(batch_shape[:-1] + (4, 4))
+        local[..., :3, :3] = local_rotations[..., ji, :, :]
+        local[..., 3, 3] = 1.
+        if parent_index < 0:
+            local[..., :3, 3] = rest_positions[..., ji, :]
+            global_transforms[..., ji, :, :] = local
+        else:
+            local[..., :3, 3] = (
+                rest_positions[..., ji, :] -
+                rest_positions[..., parent_index, :])
+            global_transforms[..., ji, :, :] = np.einsum(
+                '...ij,...jk->...ik',
+                global_transforms[..., parent_index, :, :], local)
+    return global_transforms
+
+
+def skinning_transforms(rest_positions, global_transforms):
+    """Combines posed joint transforms with the inverse bind transforms.
+
+    rest_positions: a Jx3 or NxJx3 array of joint rest positions
+    global_transforms: a Jx4x4 or NxJx4x4 array of posed global transforms
+
+    Returns a Jx4x4 or NxJx4x4 array mapping rest vertices to posed
+    vertices for each joint.
+    """
+    import numpy as np
+
+    return np.einsum(
+        '...ij,...jk->...ik', global_transforms,
+        translation_matrices(-np.asarray(rest_positions)))
+
+
+def linear_blend_skinning(vertices, weights, transforms, chunk_size=256):
+    """Deforms a batch of bodies.
+
+    vertices: a Vx3 or NxVx3 array of rest vertices
+    weights: a JxV sparse matrix of skinning weights, as returned by
+        `skinning_weight_matrix`
+    transforms: a Jx4x4 or NxJx4x4 array of skinning transforms, as returned
+        by `skinning_transforms`. A single set of transforms is applied to
+        every body.
+    chunk_size: the number of bodies deformed at once, which bounds the
+        size of the intermediate arrays.
+
+    Returns the posed vertices, with the shape of `vertices`.
+    """
+    import numpy as np
+
+    vertices = np.asarray(vertices, dtype=np.float64)
+    transforms = np.asarray(transforms, dtype=np.float64)
+    num_joints, num_vertices = weights.shape
+    batch_shape = np.broadcast(
+        vertices[..., 0, 0], transforms[..., 0, 0, 0]).shape
+    vertices = (vertices * np.ones(batch_shape + (1, 1))).reshape(
+        (-1, num_vertices, 3))
+    transforms = (transforms * np.ones(batch_shape + (1, 1, 1))).reshape(
+        (-1, num_joints, 4, 4))
+    vertex_weights = weights.T.tocsr()
+
+    posed = np.empty_like(vertices)
+    for start in range(0, len(vertices), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        num_bodies = len(vertices[chunk])
+        # Blend the top 3x4 of the joint transforms for every vertex of
+        # every body with one sparse product, of the VxJ weights and a
+        # Jx(12*N) matrix of joint transforms.
+        joint_affines = transforms[chunk, :, :3, :].transpose(
+            1, 2, 3, 0).reshape(num_joints, -1)
+        vertex_affines = vertex_weights.dot(joint_affines).reshape(
+            num_vertices, 3, 4, num_bodies)
+        # Apply each vertex's blended transform, as VxN arrays.
+        x, y, z = vertices[chunk].transpose(2, 1, 0)[:, :, np.newaxis]
+        posed[chunk] = (
+            vertex_affines[:, :, 0] * x +
+            vertex_affines[:, :, 1] * y +
+            vertex_affines[:, :, 2] * z +
+            vertex_affines[:, :, 3]).transpose(2, 0, 1)
+    return posed.reshape(batch_shape + (num_vertices, 3))
+
+
+def pose(vertices, rest_positions, parent_indices, weights, local_rotations):
+    """Poses bodies with linear blend skinning.
+
+    This matches the deformation of the exported rig, e.g. for previews
+    and for checking rigs at scale.
+
+    vertices: a Vx3 or NxVx3 array of rest vertices
+    rest_positions, parent_indices, local_rotations: as for
+        `forward_kinematics`
+    weights: a JxV sparse matrix of skinning weights, as returned by
+        `skinning_weight_matrix`
+
+    Returns the posed vertices, with the shape of `vertices`.
+    """
+    return linear_blend_skinning(
+        vertices, weights, skinning_transforms(
+            rest_positions, forward_kinematics(
+                rest_positions, parent_indices, local_rotations)))
@@ -0,0 +1,66 @@
+import unittest
+
+
+class TestBodyArchive(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        import tempfile
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.bodies')
+
+    def tearDown(self):
+        import shutil
+
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        import numpy as np
+        from bodylabs_rigger.body_archive import BodyArchive, BodyArchiveWriter
+
+        vertices = np.random.RandomState(0).rand(5, 10, 3).astype(np.float32)
+        body_ids = ['e', 'b', u'caf\xe9', 'a', 'd']
+        with BodyArchiveWriter(self.path) as writer:
+            writer.add(body_ids[0], vertices[0])
+            writer.add_many(body_ids[1:], vertices[1:])
+
+        archive = BodyArchive(self.path)
+        self.assertEqual(len(archive), 5)
+        for i, body_id in enumerate(body_ids):
+            self.assertEqual(archive.body_id(i), body_id)
+            self.assertEqual(archive.index_of(body_id), i)
+            np.testing.assert_array_equal(archive.get(body_id), vertices[i])
+        with self.assertRaises(KeyError):
+            archive.index_of('c')
+
+    def test_rejected_batches_add_nothing(self):
+        import numpy as np
+        from bodylabs_rigger.body_archive import BodyArchive, BodyArchiveWriter
+
+        vertices = np.zeros((2, 10, 3))
+        with BodyArchiveWriter(self.path) as writer:
+            writer.add('a', vertices[0])
+            for body_ids in (['b', 'b'], ['b', 'a'], ['b', ''], ['b', 'c\0']):
+                with self.assertRaises(ValueError):
+                    writer.add_many(body_ids, vertices)
+            self.assertEqual(len(writer), 1)
+            # None of the rejected ids were taken.
+            writer.add_many(['b', 'c'], vertices)
+
+        archive = BodyArchive(self.path)
+        self.assertEqual([body_id for body_id, _ in archive], ['a', 'b', 'c'])
+
+    def test_rejected_first_batch_leaves_the_shape_open(self):
+        import numpy as np
+        from bodylabs_rigger.body_archive import BodyArchive, BodyArchiveWriter
+
+        with BodyArchiveWriter(self.path) as writer:
+            with self.assertRaises(ValueError):
+                writer.add_many(['a', 'a'], np.zeros((2, 10, 3)))
+            writer.add('a', np.zeros((20, 3)))
+        self.assertEqual(BodyArchive(self.path).num_vertices, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+
+def setUpModule():
+    # Use the pure Python stand-in when the FBX SDK isn't installed.
+    try:
+        import fbx  # noqa
+    except ImportError:
+        import os
+        import sys
+        sys.path.insert(0, os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            'benchmarks'))
+        import fbx_stub
+        fbx_stub.install()
+
+
+class TestSkeletonTranslations(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from bodylabs_rigger.factory import RiggedModelFactory
+
+        cls.factory = RiggedModelFactory.create_default()
+
+    def random_vertices(self, seed, num_bodies=None):
+        import numpy as np
+
+        shape = (self.factory.vertex_normals.num_vertices, 3)
+        if num_bodies is not None:
+            shape = (num_bodies,) + shape
+        return 100. * np.random.RandomState(seed).rand(*shape)
+
+    def test_global_transforms_match_joint_positions(self):
+        import numpy as np
+        from bodylabs_rigger.fbx_util import create_fbx_manager
+        from bodylabs_rigger.joint_positions import calculate_joint_positions
+
+        vertices = self.random_vertices(0)
+        expected = calculate_joint_positions(
+            vertices, self.factory._joint_position_spec)
+
+        fbx_manager = create_fbx_manager()
+        fbx_scene = self.factory.construct_rig(vertices, fbx_manager)
+        try:
+            global_positions = {}
+            nodes = [fbx_scene.GetRootNode()]
+            while nodes:
+                node = nodes.pop()
+                for ci in range(node.GetChildCount()):
+                    child = node.GetChild(ci)
+                    nodes.append(child)
+                    t = child.EvaluateGlobalTransform().GetT()
+                    global_positions[child.GetName()] = np.array(
+                        [t[0], t[1], t[2]])
+        finally:
+            fbx_scene.Destroy()
+            fbx_manager.Destroy()
+
+        skeleton_joint_names = self.factory.skeleton_joint_names
+        self.assertEqual(
+            sorted(set(global_positions) - set(skeleton_joint_names)),
+            [self.factory._textured_mesh.name])
+        for name in skeleton_joint_names:
+            np.testing.assert_allclose(
+                global_positions[name], expected[name], rtol=0, atol=1e-9,
+                err_msg=name)
+
+    def test_batch_matches_single_bodies(self):
+        import numpy as np
+
+        vertices = self.random_vertices(1, num_bodies=3)
+        solver = self.factory._joint_position_solver
+        world_positions, local_translations = (
+            self.factory._calculate_skeleton_translations(
+                solver.solve(vertices)))
+        self.assertEqual(
+            world_positions.shape,
+            (3, len(self.factory.skeleton_joint_names), 3))
+        for body_vertices, body_world, body_local in zip(
+                vertices, world_positions, local_translations):
+            expected_world, expected_local = (
+                self.factory._calculate_skeleton_translations(
+                    solver.solve(body_vertices)))
+            np.testing.assert_allclose(body_world, expected_world)
+            np.testing.assert_allclose(body_local, expected_local)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+
+def _document(version):
+    """Returns an FbxDocument with every property type."""
+    import numpy as np
+    from bodylabs_rigger.fbx_binary import FbxDocument, FbxRecord
+
+    arrays = FbxRecord(b'Arrays', [
+        (b'b', np.array([True, False, True])),
+        (b'i', np.arange(-5, 5, dtype=np.int32)),
+        (b'l', np.array([2 ** 40, -1], dtype=np.int64)),
+        (b'f', np.linspace(0., 1., 7).astype(np.float32)),
+        (b'd', np.random.RandomState(0).rand(100)),
+        (b'd', np.zeros(0)),
+    ])
+    scalars = FbxRecord(b'Scalars', [
+        (b'Y', -2), (b'C', True), (b'I', 7), (b'F', 0.5), (b'D', 0.1),
+        (b'L', 2 ** 50),
+    ])
+    strings = FbxRecord(b'Strings', [
+        (b'S', b'Model::Body'), (b'S', b'Body\x00\x01Model'),
+        (b'R', b'\x00\xff'),
+    ])
+    return FbxDocument(version, children=[
+        FbxRecord(b'Objects', children=[arrays, scalars, strings]),
+        FbxRecord(b'Empty', has_sentinel=True),
+        FbxRecord(b'Bare'),
+    ], footer_id=b'0123456789abcdef')
+
+
+class TestFbxBinary(unittest.TestCase):
+
+    def assert_records_equal(self, record, expected):
+        import numpy as np
+
+        self.assertEqual(record.name, expected.name)
+        self.assertEqual(record.has_sentinel, expected.has_sentinel)
+        self.assertEqual(len(record.properties), len(expected.properties))
+        for (type_code, value), (expected_type_code, expected_value) in zip(
+                record.properties, expected.properties):
+            self.assertEqual(type_code, expected_type_code)
+            if isinstance(expected_value, np.ndarray):
+                np.testing.assert_array_equal(value, expected_value)
+            else:
+                self.assertEqual(value, expected_value)
+        self.assertEqual(len(record.children), len(expected.children))
+        for child, expected_child in zip(record.children, expected.children):
+            self.assert_records_equal(child, expected_child)
+
+    def test_round_trip(self):
+        from bodylabs_rigger.fbx_binary import parse_fbx, serialize_fbx
+
+        for version in (7400, 7500):
+            for compress_arrays in (False, True):
+                document = _document(version)
+                data = serialize_fbx(
+                    document, compress_arrays=compress_arrays)
+                parsed = parse_fbx(data)
+                self.assertEqual(parsed.version, version)
+                self.assertEqual(parsed.footer_id, document.footer_id)
+                self.assert_records_equal(parsed, document)
+                self.assertEqual(
+                    serialize_fbx(parsed, compress_arrays=compress_arrays),
+                    data)
+                # The footer's version is 16-byte aligned, and followed by
+                # 120 null bytes and the footer magic.
+                self.assertEqual((len(data) - 140) % 16, 0)
+
+    def test_offsets_locate_uncompressed_values(self):
+        import numpy as np
+        from bodylabs_rigger.fbx_binary import parse_fbx, serialize_fbx
+
+        for version in (7400, 7500):
+            data = serialize_fbx(_document(version))
+            arrays = parse_fbx(data).find(b'Objects').find(b'Arrays')
+            offset = arrays.offsets[4]
+            np.testing.assert_array_equal(
+                np.frombuffer(data, dtype='<f8', count=100, offset=offset),
+                arrays.properties[4][1])
+
+            data = serialize_fbx(_document(version), compress_arrays=True)
+            arrays = parse_fbx(data).find(b'Objects').find(b'Arrays')
+            self.assertIsNone(arrays.offsets[4])
+
+    def test_rejects_bad_files(self):
+        from bodylabs_rigger.fbx_binary import parse_fbx, serialize_fbx
+
+        with self.assertRaises(ValueError):
+            parse_fbx(b'; FBX 7.4.0 project file')
+        data = serialize_fbx(_document(7400))
+        with self.assertRaises(ValueError):
+            parse_fbx(data[:100])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+
+
+def _export(uids, creation_time, footer_id, translation=1.,
+            pose_mesh=False):
+    """Returns a binary FBX file laid out as the SDK writes one, with the
+    given object UIDs, creation time and footer id.
+
+    pose_mesh: if True, the bind pose refers to the mesh rather than the
+        joint.
+    """
+    from bodylabs_rigger.fbx_binary import (
+        FbxDocument,
+        FbxRecord,
+        serialize_fbx,
+    )
+
+    document_uid, mesh_uid, joint_uid, pose_uid = uids
+
+    def connection(child_uid, parent_uid):
+        return FbxRecord(
+            b'C', [(b'S', b'OO'), (b'L', child_uid), (b'L', parent_uid)])
+
+    return serialize_fbx(FbxDocument(7400, children=[
+        FbxRecord(b'FBXHeaderExtension', children=[
+            FbxRecord(b'CreationTimeStamp', children=[
+                FbxRecord(b'Second', [(b'I', int(creation_time))]),
+            ]),
+        ]),
+        FbxRecord(b'FileId', [(b'R', footer_id[::-1])]),
+        FbxRecord(b'CreationTime', [(b'S', str(creation_time))]),
+        FbxRecord(b'Documents', children=[
+            FbxRecord(b'Document', [
+                (b'L', document_uid), (b'S', b''), (b'S', b'Scene')]),
+        ]),
+        FbxRecord(b'Objects', children=[
+            FbxRecord(b'Model', [
+                (b'L', mesh_uid), (b'S', b'Body\x00\x01Model'),
+                (b'S', b'Mesh')]),
+            FbxRecord(b'Model', [
+                (b'L', joint_uid), (b'S', b'Hips\x00\x01Model'),
+                (b'S', b'LimbNode')], children=[
+                    FbxRecord(b'Lcl Translation', [(b'D', translation)]),
+                ]),
+            FbxRecord(b'Pose', [
+                (b'L', pose_uid), (b'S', b'Pose\x00\x01Pose'),
+                (b'S', b'BindPose')], children=[
+                    FbxRecord(b'PoseNode', children=[
+                        FbxRecord(b'Node', [
+                            (b'L', mesh_uid if pose_mesh else joint_uid)]),
+                    ]),
+                ]),
+        ]),
+        FbxRecord(b'Connections', children=[
+            connection(mesh_uid, 0),
+            connection(joint_uid, 0),
+        ]),
+    ], footer_id=footer_id))
+
+
+class TestNormalized(unittest.TestCase):
+
+    def test_ignores_the_values_picked_for_each_export(self):
+        from bodylabs_rigger.fbx_template import _normalized
+
+        first = _export((11, 12, 13, 14), 1000, b'a' * 16)
+        second = _export(
+            (2 ** 40 + 7, 5, 2 ** 33, 99), 2000, b'b' * 16)
+        self.assertNotEqual(first, second)
+        self.assertEqual(_normalized(first), _normalized(second))
+
+    def test_keeps_scene_differences(self):
+        from bodylabs_rigger.fbx_template import _normalized
+
+        reference = _normalized(_export((11, 12, 13, 14), 1000, b'a' * 16))
+        # A different value.
+        self.assertNotEqual(_normalized(_export(
+            (11, 12, 13, 14), 1000, b'a' * 16, translation=2.)), reference)
+        # A reference to a different object.
+        self.assertNotEqual(_normalized(_export(
+            (11, 12, 13, 14), 1000, b'a' * 16, pose_mesh=True)), reference)
+
+
+def _real_sdk_available():
+    try:
+        import fbx
+    except ImportError:
+        return False
+    # Other tests install the pure Python stand-in as `fbx`.
+    return fbx.__name__ != 'fbx_stub'
+
+
+@unittest.skipUnless(_real_sdk_available(), 'Requires the FBX SDK.')
+class TestFbxTemplateWithSdk(unittest.TestCase):
+
+    def test_sdk_imports_patched_files(self):
+        import os
+        import shutil
+        import tempfile
+        import numpy as np
+        from bodylabs_rigger.factory import RiggedModelFactory
+        from bodylabs_rigger.fbx_template import (
+            _scene_values,
+            build_fbx_template,
+        )
+        from bodylabs_rigger.fbx_util import (
+            create_fbx_manager,
+            import_fbx_scene,
+        )
+
+        factory = RiggedModelFactory.create_default()
+        random_state = np.random.RandomState(0)
+        num_vertices = factory.vertex_normals.num_vertices
+        reference_vertices, vertices = 100. * random_state.rand(
+            2, num_vertices, 3)
+        fbx_manager = create_fbx_manager()
+        directory = tempfile.mkdtemp()
+        try:
+            # Checks the template against a second body.
+            template = build_fbx_template(
+                factory, reference_vertices, fbx_manager, check=True)
+
+            world_positions, local_translations = (
+                factory.skeleton_positions(vertices))
+            path = os.path.join(directory, 'body.fbx')
+            template.export(
+                path, vertices, world_positions, local_translations,
+                factory.vertex_normals.compute(vertices))
+            fbx_scene = import_fbx_scene(fbx_manager, path)
+            try:
+                imported = _scene_values(fbx_scene)
+            finally:
+                fbx_scene.Destroy()
+        finally:
+            shutil.rmtree(directory)
+            fbx_manager.Destroy()
+
+        _, control_points = imported[factory.rig_assets.textured_mesh.name]
+        np.testing.assert_allclose(control_points, vertices)
+        for name, translation in zip(
+                factory.skeleton_joint_names, local_translations):
+            np.testing.assert_allclose(imported[name][0], translation)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+
+# The dtype and size in bytes of each glTF component type, and the number
+# of components of each accessor type.
+_COMPONENT_DTYPES = {
+    5121: '<u1',
+    5123: '<u2',
+    5125: '<u4',
+    5126: '<f4',
+}
+_NUM_COMPONENTS = {
+    'SCALAR': 1,
+    'VEC2': 2,
+    'VEC3': 3,
+    'VEC4': 4,
+    'MAT4': 16,
+}
+
+
+class TestGlbExporter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import io
+        import numpy as np
+        from bodylabs_rigger.factory import RiggedModelFactory
+        from bodylabs_rigger.gltf import GlbExporter
+
+        factory = RiggedModelFactory.create_default()
+        assets = factory.rig_assets
+        vertices = 100. * np.random.RandomState(0).rand(
+            factory.vertex_normals.num_vertices, 3)
+        cls.world_positions, _ = factory.skeleton_positions(vertices)
+        cls.num_joints = len(factory.skeleton_joint_names)
+
+        output = io.BytesIO()
+        cls.num_bytes = GlbExporter(
+            assets.textured_mesh, assets.joint_tree, assets.clusters).export(
+                output, vertices, cls.world_positions)
+        cls.data = output.getvalue()
+
+    def parse(self):
+        """Checks the GLB header and chunk lengths, and returns the glTF
+        document and the binary chunk.
+        """
+        import json
+        import struct
+        from bodylabs_rigger.gltf import _GLB_CHUNK_BIN, _GLB_CHUNK_JSON
+
+        magic, version, length = struct.unpack_from('<4sII', self.data)
+        self.assertEqual(magic, b'glTF')
+        self.assertEqual(version, 2)
+        self.assertEqual(length, len(self.data))
+        self.assertEqual(self.num_bytes, len(self.data))
+
+        json_length, chunk_type = struct.unpack_from('<II', self.data, 12)
+        self.assertEqual(chunk_type, _GLB_CHUNK_JSON)
+        self.assertEqual(json_length % 4, 0)
+        gltf = json.loads(self.data[20:20 + json_length].decode('utf-8'))
+
+        bin_start = 20 + json_length
+        bin_length, chunk_type = struct.unpack_from(
+            '<II', self.data, bin_start)
+        self.assertEqual(chunk_type, _GLB_CHUNK_BIN)
+        self.assertEqual(bin_start + 8 + bin_length, len(self.data))
+        self.assertEqual(gltf['buffers'], [{'byteLength': bin_length}])
+        return gltf, self.data[bin_start + 8:]
+
+    def read_accessor(self, gltf, binary, index):
+        import numpy as np
+
+        accessor = gltf['accessors'][index]
+        view = gltf['bufferViews'][accessor['bufferView']]
+        dtype = np.dtype(_COMPONENT_DTYPES[accessor['componentType']])
+        num_components = _NUM_COMPONENTS[accessor['type']]
+        start = view['byteOffset'] + accessor.get('byteOffset', 0)
+        values = np.frombuffer(
+            binary, dtype=dtype, count=accessor['count'] * num_components,
+            offset=start)
+        return values.reshape(accessor['count'], num_components)
+
+    def test_accessors_lie_inside_the_binary_chunk(self):
+        import numpy as np
+
+        gltf, binary = self.parse()
+        for view in gltf['bufferViews']:
+            self.assertEqual(view['buffer'], 0)
+            self.assertEqual(view['byteOffset'] % 4, 0)
+            self.assertLessEqual(
+                view['byteOffset'] + view['byteLength'], len(binary))
+        for accessor in gltf['accessors']:
+            view = gltf['bufferViews'][accessor['bufferView']]
+            item_size = np.dtype(
+                _COMPONENT_DTYPES[accessor['componentType']]).itemsize
+            self.assertLessEqual(
+                accessor['count'] * _NUM_COMPONENTS[accessor['type']] *
+                item_size, view['byteLength'])
+
+        attributes = gltf['meshes'][0]['primitives'][0]['attributes']
+        num_vertices = gltf['accessors'][attributes['POSITION']]['count']
+        for index in attributes.values():
+            self.assertEqual(gltf['accessors'][index]['count'], num_vertices)
+        indices = self.read_accessor(
+            gltf, binary, gltf['meshes'][0]['primitives'][0]['indices'])
+        self.assertEqual(len(indices) % 3, 0)
+        self.assertLess(indices.max(), num_vertices)
+
+    def test_joints_and_weights(self):
+        import numpy as np
+
+        gltf, binary = self.parse()
+        attributes = gltf['meshes'][0]['primitives'][0]['attributes']
+        joints = self.read_accessor(gltf, binary, attributes['JOINTS_0'])
+        weights = self.read_accessor(gltf, binary, attributes['WEIGHTS_0'])
+
+        self.assertEqual(len(gltf['skins'][0]['joints']), self.num_joints)
+        self.assertLess(joints.max(), self.num_joints)
+        self.assertTrue((weights >= 0).all())
+        np.testing.assert_allclose(
+            weights.sum(axis=1, dtype=np.float64), 1., rtol=0, atol=1e-6)
+
+    def test_inverse_bind_matrices_invert_the_joint_transforms(self):
+        import numpy as np
+
+        gltf, binary = self.parse()
+        skin = gltf['skins'][0]
+        # glTF matrices are column-major.
+        inverse_bind_matrices = self.read_accessor(
+            gltf, binary, skin['inverseBindMatrices']).reshape(
+                -1, 4, 4).transpose(0, 2, 1)
+
+        # Accumulate the joint node translations down the hierarchy.
+        nodes = gltf['nodes']
+        world_transforms = {}
+        pending = [(ni, np.eye(4)) for ni in gltf['scenes'][0]['nodes']]
+        while pending:
+            ni, parent_transform = pending.pop()
+            local = np.eye(4)
+            local[:3, 3] = nodes[ni].get('translation', [0., 0., 0.])
+            world_transforms[ni] = parent_transform.dot(local)
+            pending.extend(
+                (child, world_transforms[ni])
+                for child in nodes[ni].get('children', []))
+
+        for ji, node_index in enumerate(skin['joints']):
+            np.testing.assert_allclose(
+                inverse_bind_matrices[ji].dot(world_transforms[node_index]),
+                np.eye(4), rtol=0, atol=1e-6)
+            # The joint is where the rig put it, in meters.
+            np.testing.assert_allclose(
+                world_transforms[node_index][:3, 3],
+                0.01 * self.world_positions[ji], rtol=0, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
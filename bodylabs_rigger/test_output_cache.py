@@ -0,0 +1,52 @@
+import unittest
+
+
+class TestRigOutputCache(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from bodylabs_rigger.output_cache import RigOutputCache
+
+        self.directory = tempfile.mkdtemp()
+        self.cache = RigOutputCache(self.directory)
+
+    def tearDown(self):
+        import shutil
+
+        shutil.rmtree(self.directory)
+
+    def test_default_exporter_settings_share_a_key(self):
+        import numpy as np
+
+        vertices = np.random.RandomState(0).rand(10, 3)
+        key = self.cache.key(vertices, 'fingerprint')
+        self.assertEqual(key, self.cache.key(
+            vertices, 'fingerprint',
+            {'file_format': None, 'embed_media': None}))
+        self.assertEqual(key, self.cache.key(
+            vertices, 'fingerprint', {'file_format': None}))
+        self.assertNotEqual(key, self.cache.key(
+            vertices, 'fingerprint', {'file_format': 'binary'}))
+
+    def test_copies_honor_the_umask(self):
+        import os
+        import stat
+
+        source = os.path.join(self.directory, 'source.fbx')
+        with open(source, 'wb') as f:
+            f.write(b'fbx')
+        self.cache.put('key', source)
+
+        output_path = os.path.join(self.directory, 'output.fbx')
+        umask = os.umask(0o022)
+        try:
+            self.assertEqual(self.cache.get('key', output_path), output_path)
+        finally:
+            os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(output_path).st_mode), 0o644)
+        with open(output_path, 'rb') as f:
+            self.assertEqual(f.read(), b'fbx')
+
+
+if __name__ == '__main__':
+    unittest.main()
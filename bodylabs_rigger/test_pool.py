@@ -0,0 +1,44 @@
+import unittest
+
+
+class _FakeExporter(object):
+
+    def export(self, scene, output_path):
+        with open(output_path, 'wb') as f:
+            f.write(scene)
+
+
+class TestExportAtomically(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+
+        shutil.rmtree(self.directory)
+
+    def test_output_honors_the_umask(self):
+        import os
+        import stat
+        from bodylabs_rigger.pool import _export_atomically
+
+        output_path = os.path.join(self.directory, 'bodies', 'body.fbx')
+        umask = os.umask(0o022)
+        try:
+            self.assertEqual(
+                _export_atomically(_FakeExporter(), b'fbx', output_path),
+                output_path)
+        finally:
+            os.umask(umask)
+
+        self.assertEqual(stat.S_IMODE(os.stat(output_path).st_mode), 0o644)
+        # No temporary files are left behind.
+        self.assertEqual(os.listdir(os.path.dirname(output_path)),
+                         ['body.fbx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+
+class TestRigAssetsJson(unittest.TestCase):
+
+    def test_float32_values_use_the_shortest_digits(self):
+        import json
+        from bodylabs_rigger.rig_assets import ControlPointCluster
+
+        cluster = ControlPointCluster([0, 1, 2], [0.1, 1. / 3, 0.7])
+        self.assertEqual(
+            json.dumps(cluster.to_json()['weights']),
+            '[0.1, 0.33333334, 0.7]')
+
+    def test_json_round_trip(self):
+        import json
+        import os
+        import shutil
+        import tempfile
+        import numpy as np
+        from bodylabs_rigger.rig_assets import RigAssets
+
+        assets = RigAssets.load_default()
+        directory = tempfile.mkdtemp()
+        try:
+            json_path = os.path.join(directory, 'rig_assets.json')
+            assets.dump(json_path)
+            loaded = RigAssets.load(json_path)
+            with open(json_path) as f:
+                self.assertEqual(json.load(f), loaded.to_json())
+        finally:
+            shutil.rmtree(directory)
+
+        np.testing.assert_array_equal(
+            loaded.textured_mesh.uv_values, assets.textured_mesh.uv_values)
+        for name, cluster in assets.clusters.items():
+            np.testing.assert_array_equal(
+                loaded.clusters[name].weights, cluster.weights)
+        self.assertEqual(loaded.fingerprint(), assets.fingerprint())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+
+def setUpModule():
+    # Use the pure Python stand-in when the FBX SDK isn't installed.
+    try:
+        import fbx  # noqa
+    except ImportError:
+        import os
+        import sys
+        sys.path.insert(0, os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            'benchmarks'))
+        import fbx_stub
+        fbx_stub.install()
+
+
+class TestSceneLifecycle(unittest.TestCase):
+
+    def setUp(self):
+        from bodylabs_rigger import instrumentation
+
+        # Each scene grows the process by 10 bytes, and a recycle releases
+        # all but 1 byte of the growth since the manager was created.
+        self.rss = 1000
+        self._current_rss_bytes = instrumentation.current_rss_bytes
+        instrumentation.current_rss_bytes = lambda: self.rss
+
+    def tearDown(self):
+        from bodylabs_rigger import instrumentation
+
+        instrumentation.current_rss_bytes = self._current_rss_bytes
+
+    def run_scenes(self, lifecycle, num_scenes):
+        recycled_after = []
+        for i in range(num_scenes):
+            with lifecycle.scene():
+                self.rss += 10
+            if lifecycle._manager is None:
+                recycled_after.append(i + 1)
+                self.rss = self.rss_at_creation + 1
+            else:
+                self.rss_at_creation = lifecycle._rss_at_creation
+        return recycled_after
+
+    def test_recycles_when_the_manager_grows_past_the_limit(self):
+        from bodylabs_rigger.scene_lifecycle import SceneLifecycle
+
+        lifecycle = SceneLifecycle(max_rss_bytes=1035)
+        self.assertEqual(self.run_scenes(lifecycle, 10), [4, 8])
+        self.assertEqual(lifecycle.manager_recycles, 2)
+
+    def test_doesnt_recycle_every_scene_above_the_limit(self):
+        from bodylabs_rigger.scene_lifecycle import SceneLifecycle
+
+        lifecycle = SceneLifecycle(max_rss_bytes=1035)
+        self.run_scenes(lifecycle, 4)
+        # The rest of the process grows past the limit.
+        self.rss += 100
+        self.assertEqual(self.run_scenes(lifecycle, 10), [4, 8])
+
+    def test_ignores_a_limit_reached_before_the_first_manager(self):
+        from bodylabs_rigger.scene_lifecycle import SceneLifecycle
+
+        lifecycle = SceneLifecycle(max_scenes=5, max_rss_bytes=500)
+        self.assertEqual(self.run_scenes(lifecycle, 10), [5, 10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+
+def _has_scipy():
+    try:
+        import scipy.sparse  # noqa
+    except ImportError:
+        return False
+    return True
+
+
+@unittest.skipUnless(_has_scipy(), 'Skinning requires scipy.')
+class TestSkinning(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import numpy as np
+        from bodylabs_rigger.factory import RiggedModelFactory
+        from bodylabs_rigger.skinning import skinning_weight_matrix
+
+        cls.factory = RiggedModelFactory.create_default()
+        num_vertices = cls.factory.vertex_normals.num_vertices
+        cls.weights = skinning_weight_matrix(
+            cls.factory.rig_assets.clusters,
+            cls.factory.skeleton_joint_names, num_vertices)
+        random_state = np.random.RandomState(0)
+        cls.vertices = 100. * random_state.rand(num_vertices, 3) - 50.
+
+    def test_vertex_weights_sum_to_one(self):
+        import numpy as np
+
+        self.assertEqual(self.weights.dtype, np.float32)
+        totals = np.asarray(
+            self.weights.sum(axis=0, dtype=np.float64)).ravel()
+        np.testing.assert_allclose(totals, 1., rtol=0, atol=2e-7)
+
+    def test_identity_rotations_return_the_input(self):
+        import numpy as np
+        from bodylabs_rigger.skinning import pose
+
+        num_joints = len(self.factory.skeleton_joint_names)
+        rest_positions, _ = self.factory.skeleton_positions(self.vertices)
+        posed = pose(
+            self.vertices, rest_positions,
+            self.factory.skeleton_parent_indices, self.weights,
+            np.tile(np.eye(3), (num_joints, 1, 1)))
+        np.testing.assert_allclose(posed, self.vertices, rtol=0, atol=8e-6)
+
+    def test_single_joint_rotation(self):
+        import numpy as np
+        from bodylabs_rigger.rig_assets import ControlPointCluster
+        from bodylabs_rigger.skinning import pose, skinning_weight_matrix
+
+        # A root at the origin and a child at (1, 0, 0). The first vertex
+        # follows the root, the second the child, and the third both.
+        rest_positions = np.array([[0., 0., 0.], [1., 0., 0.]])
+        vertices = np.array([[0., 1., 0.], [2., 0., 0.], [2., 0., 0.]])
+        weights = skinning_weight_matrix({
+            'root': ControlPointCluster([0, 2], [1., 0.5]),
+            'child': ControlPointCluster([1, 2], [2., 0.5]),
+        }, ['root', 'child'], 3)
+        # Rotate the child by 90 degrees about z.
+        rotations = np.array([
+            np.eye(3),
+            [[0., -1., 0.], [1., 0., 0.], [0., 0., 1.]],
+        ])
+        posed = pose(vertices, rest_positions, [-1, 0], weights, rotations)
+        # The child's vertex swings about the child joint, and the shared
+        # vertex goes halfway.
+        np.testing.assert_allclose(
+            posed, [[0., 1., 0.], [1., 1., 0.], [1.5, 0.5, 0.]], atol=1e-7)
+
+
+if __name__ == '__main__':
+    unittest.main()
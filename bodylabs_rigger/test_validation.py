@@ -0,0 +1,68 @@
+import unittest
+
+
+class TestBodyValidator(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from bodylabs_rigger.rig_assets import RigAssets
+        from bodylabs_rigger.validation import BodyValidator
+
+        assets = RigAssets.load_default()
+        cls.validator = BodyValidator(
+            assets.textured_mesh, assets.joint_position_spec)
+
+    def body(self, height=170.):
+        import numpy as np
+
+        vertices = np.random.RandomState(0).rand(
+            self.validator.num_vertices, 3)
+        return vertices * [height / 4., height, height / 8.]
+
+    def test_single_bodies_get_a_list_of_reasons(self):
+        import numpy as np
+
+        num_vertices = self.validator.num_vertices
+        for vertices, shape in [
+                (np.zeros(5), (5,)),
+                (np.float64(1.), ()),
+                (np.zeros((num_vertices, 2)), (num_vertices, 2)),
+        ]:
+            self.assertEqual(self.validator.validate(vertices), [
+                'expected {}x3 vertices, got shape {}'.format(
+                    num_vertices, shape)])
+
+    def test_stacks_get_a_list_per_body(self):
+        import numpy as np
+
+        reasons = self.validator.validate(np.zeros((3, 10, 3)))
+        self.assertEqual(len(reasons), 3)
+        for body_reasons in reasons:
+            self.assertEqual(len(body_reasons), 1)
+            self.assertTrue(body_reasons[0].startswith('expected'))
+
+    def test_non_finite_and_scale(self):
+        import numpy as np
+
+        bodies = np.array([self.body() for _ in range(5)])
+        bodies[0, 10, 1] = np.nan
+        bodies[1, 20, 0] = np.inf
+        bodies[2, :, :] = np.inf
+        bodies[3] /= 100.
+        reasons = self.validator.validate(bodies)
+
+        for body_reasons in reasons[:3]:
+            self.assertEqual(
+                body_reasons, ['vertices contain NaN or infinite values'])
+        self.assertEqual(reasons[3], [
+            'height of 1.7 is outside 100 to 250 centimeters'])
+        # The random body fails the joint checks, but not these.
+        self.assertFalse([
+            reason for reason in reasons[4]
+            if 'infinite' in reason or 'height of' in reason])
+        self.assertEqual(
+            self.validator.validate(bodies[3]), reasons[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
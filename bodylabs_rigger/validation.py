@@ -0,0 +1,264 @@
+# Checks bodies before rigging them.
+#
+# Rigging and exporting a body takes seconds of SDK work, and bad inputs
+# (NaNs, meters instead of centimeters, a different topology, a garbled or
+# posed mesh) otherwise only show up in the output. A BodyValidator checks a
+# whole stack of bodies in a few numpy operations:
+#
+#     validator = BodyValidator(
+#         assets.textured_mesh, assets.joint_position_spec)
+#     for body_reasons in validator.validate(vertices):  # vertices is NxVx3
+#         if body_reasons:
+#             print 'Invalid body: {}'.format('; '.join(body_reasons))
+#
+# where `assets` is the RigAssets of the rig, e.g. `factory.rig_assets`. The
+# checks, in order:
+#
+#     vertex count   every body has the rig's number of vertices
+#     finite         no coordinate is NaN or infinite
+#     scale          the height (the largest bounding box extent) is that of
+#                    a person in centimeters
+#     joint order    the joints solved from the `joint_position_spec`
+#                    reference vertices are in order along the body: the
+#                    head above the neck above the hips, the feet below the
+#                    knees below the hips, and left and right on consistent
+#                    sides
+#     limbs          each limb is a plausible fraction of the height, and
+#                    about as long as its opposite
+#     T-pose         the arms are roughly perpendicular to the spine
+#
+# Only the first failing check of vertex count, finite and scale is reported,
+# since the later checks assume the earlier ones pass. The joint checks use
+# the spine (hips to neck) as the up direction, so they don't depend on how
+# the body is oriented.
+#
+# Validation costs about 0.1 ms per body, e.g. 0.23 s for a stack of 2000
+# bodies of 4916 vertices. That is far less than rigging a body, but not
+# free: most of it is reading the vertices once for the bounding boxes and
+# once to solve the joints. Invalid bodies add a little Python work each to
+# describe their problems.
+
+# Joints which should be successively further up the body.
+_UP_CHAIN = ['Hips', 'Neck', 'Head', 'HeadTop_End']
+# Joints which should be successively further down the body, for each side.
+_DOWN_CHAIN = ['UpLeg', 'Leg', 'Foot']
+# Joints which should be on the same side as the corresponding arm.
+_SIDED_JOINTS = ['Hand', 'UpLeg', 'Foot']
+# The limbs checked for length and symmetry, as (start, end) joints.
+_LIMBS = [
+    ('Arm', 'ForeArm'),
+    ('ForeArm', 'Hand'),
+    ('UpLeg', 'Leg'),
+    ('Leg', 'Foot'),
+]
+_SIDES = ['Left', 'Right']
+
+
+class BodyValidator(object):
+    """Validates stacks of bodies for a rig."""
+
+    def __init__(self, textured_mesh, joint_position_spec,
+                 min_height=100., max_height=250., min_limb_fraction=0.05,
+                 max_limb_fraction=0.5, max_limb_asymmetry=1.25,
+                 max_arm_angle=30.):
+        """Initializes the BodyValidator.
+
+        textured_mesh: the TexturedMesh of the rig
+        joint_position_spec: the rig's joint position spec (see
+            `joint_positions.py`)
+        min_height, max_height: the range of valid heights, in centimeters
+        min_limb_fraction, max_limb_fraction: the range of valid limb
+            lengths, as fractions of the height
+        max_limb_asymmetry: the largest valid ratio between the lengths of a
+            left and right limb
+        max_arm_angle: the largest valid angle, in degrees, between an arm
+            (shoulder to hand) and the plane perpendicular to the spine
+        """
+        import math
+        import numpy as np
+        from bodylabs_rigger.joint_positions import JointPositionSolver
+
+        self.num_vertices = int(np.max(textured_mesh.faces)) + 1
+        self._solver = JointPositionSolver(joint_position_spec)
+        self._min_height = min_height
+        self._max_height = max_height
+        self._min_limb_fraction = min_limb_fraction
+        self._max_limb_fraction = max_limb_fraction
+        self._max_limb_asymmetry = max_limb_asymmetry
+        self._max_arm_sine = math.sin(math.radians(max_arm_angle))
+        self._max_arm_angle = max_arm_angle
+
+        # Resolve the joints used by the checks, skipping any which the spec
+        # doesn't position.
+        joint_indices = {
+            name: ji for ji, name in enumerate(self._solver.joint_names)}
+
+        def indices(names):
+            if all(name in joint_indices for name in names):
+                return [joint_indices[name] for name in names]
+            return None
+
+        self._spine = indices(['Hips', 'Neck'])
+        self._arms = indices([side + 'Arm' for side in _SIDES])
+        self._chains = []
+        for names, direction in (
+                [(_UP_CHAIN, 1.)] +
+                [([side + name for name in _DOWN_CHAIN], -1.)
+                 for side in _SIDES]):
+            chain = indices(names)
+            if chain is not None:
+                self._chains.append((names, chain, direction))
+        self._sided_joints = [
+            (name, pair) for name, pair in (
+                (name, indices([side + name for side in _SIDES]))
+                for name in _SIDED_JOINTS)
+            if pair is not None]
+        self._limbs = []
+        for start, end in _LIMBS:
+            limb = indices([
+                side + joint for side in _SIDES for joint in (start, end)])
+            if limb is not None:
+                self._limbs.append((start, end, limb))
+        self._hands = indices([
+            side + joint for side in _SIDES for joint in ('Arm', 'Hand')])
+
+    def validate(self, vertices):
+        """Checks a Vx3 or NxVx3 array of vertices.
+
+        Returns a list of reasons the body is invalid, or for a stack of
+        bodies a list of such lists. Valid bodies have no reasons.
+        """
+        import numpy as np
+
+        vertices = np.asarray(vertices)
+        # Anything with fewer dimensions than a stack is a single, perhaps
+        # malformed, body.
+        single_body = vertices.ndim <= 2
+        body_shape = vertices.shape if single_body else vertices.shape[1:]
+        if body_shape != (self.num_vertices, 3):
+            reason = 'expected {}x3 vertices, got shape {}'.format(
+                self.num_vertices, body_shape)
+            num_bodies = len(vertices) if vertices.ndim == 3 else 1
+            reasons = [[reason] for _ in range(num_bodies)]
+        else:
+            reasons = self._validate_stack(
+                vertices[np.newaxis] if single_body else vertices)
+        if single_body:
+            return reasons[0]
+        return reasons
+
+    def is_valid(self, vertices):
+        """Returns whether each body of an NxVx3 array is valid, as a boolean
+        array.
+        """
+        import numpy as np
+
+        return np.array(
+            [not body_reasons for body_reasons in self.validate(vertices)],
+            dtype=bool)
+
+    def _validate_stack(self, vertices):
+        import numpy as np
+
+        reasons = [[] for _ in range(len(vertices))]
+
+        def flag(indices, mask, reason):
+            """Adds a reason for each masked body. `reason` is called right
+            away with the position in `indices` to describe the problem.
+            """
+            for i in np.flatnonzero(mask):
+                reasons[indices[i]].append(reason(i))
+
+        # The bounding box extents. Reading the vertices dominates the cost
+        # of validation, so this is the only pass over them before solving
+        # the joints: reducing each coordinate separately is several times
+        # faster than reducing the Vx3 arrays, and a NaN or infinite value
+        # makes its extent NaN or infinite.
+        extents = np.empty((len(vertices), 3))
+        with np.errstate(invalid='ignore'):
+            for k in range(3):
+                coordinates = vertices[:, :, k]
+                extents[:, k] = (
+                    coordinates.max(axis=1) - coordinates.min(axis=1))
+        all_indices = np.arange(len(vertices))
+        finite = np.isfinite(extents).all(axis=1)
+        flag(all_indices, ~finite,
+             lambda i: 'vertices contain NaN or infinite values')
+
+        indices = all_indices[finite]
+        heights = extents[finite].max(axis=1)
+        if not finite.all():
+            vertices = vertices[finite]
+        scaled = (
+            (heights >= self._min_height) & (heights <= self._max_height))
+        flag(indices, ~scaled,
+             lambda i: ('height of {:.4g} is outside {:g} to {:g} '
+                        'centimeters'.format(
+                            heights[i], self._min_height, self._max_height)))
+
+        indices = indices[scaled]
+        heights = heights[scaled]
+        if not len(indices) or self._spine is None:
+            return reasons
+        joints = self._solver.solve(
+            vertices if scaled.all() else vertices[scaled])
+
+        # Directions are measured relative to the spine.
+        up = joints[:, self._spine[1]] - joints[:, self._spine[0]]
+        up /= np.maximum(
+            np.sqrt((up ** 2).sum(axis=1)), 1e-9)[:, np.newaxis]
+        heights_along_up = (joints * up[:, np.newaxis, :]).sum(axis=2)
+
+        for names, chain, direction in self._chains:
+            steps = direction * np.diff(heights_along_up[:, chain], axis=1)
+            for si in range(len(chain) - 1):
+                flag(indices, steps[:, si] <= 0,
+                     lambda i: '{} is not {} {}'.format(
+                         names[si + 1], 'above' if direction > 0 else 'below',
+                         names[si]))
+
+        if self._arms is not None:
+            lateral = joints[:, self._arms[0]] - joints[:, self._arms[1]]
+            for name, (left, right) in self._sided_joints:
+                sides = (
+                    (joints[:, left] - joints[:, right]) * lateral).sum(
+                        axis=1)
+                flag(indices, sides <= 0,
+                     lambda i: (
+                         'Left{0} and Right{0} are on the wrong sides'.format(
+                             name)))
+
+        for start, end, (left_start, left_end, right_start,
+                         right_end) in self._limbs:
+            lengths = np.sqrt((np.array([
+                joints[:, left_end] - joints[:, left_start],
+                joints[:, right_end] - joints[:, right_start],
+            ]) ** 2).sum(axis=2)) / heights
+            for side, side_lengths in zip(_SIDES, lengths):
+                flag(indices, (
+                    (side_lengths < self._min_limb_fraction) |
+                    (side_lengths > self._max_limb_fraction)),
+                    lambda i: (
+                        '{0}{1} to {0}{2} is {3:.0%} of the height'.format(
+                            side, start, end, side_lengths[i])))
+            asymmetry = np.maximum(lengths[0], lengths[1]) / np.maximum(
+                np.minimum(lengths[0], lengths[1]), 1e-9)
+            flag(indices, asymmetry > self._max_limb_asymmetry,
+                 lambda i: (
+                     'the left and right {} to {} differ in length by a '
+                     'factor of {:.2f}'.format(start, end, asymmetry[i])))
+
+        if self._hands is not None:
+            left_arm, left_hand, right_arm, right_hand = self._hands
+            for side, (arm, hand) in zip(
+                    _SIDES, [(left_arm, left_hand), (right_arm, right_hand)]):
+                direction = joints[:, hand] - joints[:, arm]
+                sine = np.abs((direction * up).sum(axis=1)) / np.maximum(
+                    np.sqrt((direction ** 2).sum(axis=1)), 1e-9)
+                flag(indices, sine > self._max_arm_sine,
+                     lambda i: (
+                         'not in a T-pose: the {} arm is {:.0f} degrees from '
+                         'horizontal, more than {:g}'.format(
+                             side.lower(), np.degrees(np.arcsin(sine[i])),
+                             self._max_arm_angle)))
+        return reasons
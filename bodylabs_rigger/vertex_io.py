@@ -0,0 +1,119 @@
+# Utilities for reading mesh vertices from files and streams.
+#
+# Supported inputs:
+#
+#     .npy    a Vx3 numpy array, memory-mapped
+#     .obj    a Wavefront OBJ mesh, of which only the vertices are read
+#     stream  a concatenation of .npy arrays, e.g. piped through stdin
+#
+# Example usage:
+#
+#     for name, vertices in iter_vertex_files(['meshes/', 'more/*.obj']):
+#         ...
+
+VERTEX_FILE_EXTENSIONS = ('.npy', '.obj')
+
+
+def read_vertices(path):
+    """Reads the vertices of a .npy or .obj file.
+
+    Returns a Vx3 numpy array.
+    """
+    import os
+    import numpy as np
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        vertices = np.load(path, mmap_mode='r')
+    elif extension == '.obj':
+        from bodylabs_rigger.bodykit.mesh_generator import MeshGenerator
+        with open(path, 'r') as f:
+            vertices = MeshGenerator._parse_vertices(f.read())
+    else:
+        raise ValueError('Unsupported vertex file: {}'.format(path))
+
+    if vertices.ndim != 2 or vertices.shape[1] != 3:
+        raise ValueError('Expected Vx3 vertices in {}, got shape {}'.format(
+            path, vertices.shape))
+    return vertices
+
+
+def iter_npy_stream(stream):
+    """Reads consecutive .npy arrays from a binary stream until EOF.
+
+    Yields each array in turn, so only one is held in memory at a time.
+    """
+    import io
+    import numpy as np
+    from numpy.lib import format as npy_format
+
+    while True:
+        magic = stream.read(npy_format.MAGIC_LEN)
+        if not magic:
+            return
+        version = npy_format.read_magic(io.BytesIO(magic))
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(
+                stream)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(
+                stream)
+
+        num_bytes = dtype.itemsize
+        for dim in shape:
+            num_bytes *= dim
+        data = stream.read(num_bytes)
+        if len(data) != num_bytes:
+            raise ValueError('Truncated array in .npy stream.')
+
+        array = np.frombuffer(data, dtype=dtype)
+        if fortran_order:
+            yield array.reshape(shape[::-1]).transpose()
+        else:
+            yield array.reshape(shape)
+
+
+def find_vertex_files(inputs):
+    """Expands directories and glob patterns into vertex file paths.
+
+    inputs: a list of file paths, directories and glob patterns.
+        Directories are searched (non-recursively) for files with one of the
+        `VERTEX_FILE_EXTENSIONS`.
+
+    Returns a list of paths. Each directory's and pattern's matches are
+    sorted, and duplicates are removed.
+    """
+    import glob
+    import os
+
+    paths = []
+    seen = set()
+    for input_path in inputs:
+        input_path = os.path.expanduser(input_path)
+        if os.path.isdir(input_path):
+            matches = sorted(
+                os.path.join(input_path, filename)
+                for filename in os.listdir(input_path)
+                if filename.lower().endswith(VERTEX_FILE_EXTENSIONS))
+        elif glob.has_magic(input_path):
+            matches = sorted(glob.glob(input_path))
+        else:
+            matches = [input_path]
+        for path in matches:
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def iter_vertex_files(inputs):
+    """Lazily reads the vertex files found by `find_vertex_files`.
+
+    Yields (name, vertices) pairs, where name is the file name without its
+    extension.
+    """
+    import os
+
+    for path in find_vertex_files(inputs):
+        name = os.path.splitext(os.path.basename(path))[0]
+        yield name, read_vertices(path)
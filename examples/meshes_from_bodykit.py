@@ -12,6 +12,8 @@ def main():
         create_fbx_manager,
         export_fbx_scene,
     )
+    from bodylabs_rigger.pipeline import RigPipeline
+    from bodylabs_rigger.pool import RigPool
 
     access_key = os.environ.get('BODYKIT_ACCESS_KEY', None)
     secret = os.environ.get('BODYKIT_SECRET', None)
@@ -24,6 +26,9 @@ def main():
     parser.add_argument(
         '--num_meshes', default=5, type=int, required=False,
         help='The number of meshes to generate and rig.')
+    parser.add_argument(
+        '--num_workers', default=1, type=int, required=False,
+        help='The number of processes with which to rig the meshes.')
     parser.add_argument(
         '--bodykit_access_key', default=None, required=(access_key is None),
         help=('Access key for the BodyKit API. Required if BODYKIT_ACCESS_KEY '
@@ -39,21 +44,46 @@ def main():
 
     mesh_generator = MeshGenerator(access_key, secret)
 
-    factory = RiggedModelFactory.create_default()
-
     if not os.path.exists(args.output_directory):
         os.makedirs(args.output_directory)
 
-    manager = create_fbx_manager()
-    for mesh_index in range(args.num_meshes):
-        print 'Generating rigged mesh {}'.format(mesh_index)
-        mesh = mesh_generator.get_random_mesh()
-        if mesh is None:
-            continue
+    def generate_meshes():
+        for mesh_index in range(args.num_meshes):
+            print 'Generating rigged mesh {}'.format(mesh_index)
+            mesh = mesh_generator.get_random_mesh()
+            if mesh is None:
+                continue
+            output_path = os.path.join(
+                args.output_directory,
+                'rigged_mesh_{:02}.fbx'.format(mesh_index))
+            yield mesh, output_path
 
+    if args.num_workers > 1:
+        # Overlap the BodyKit requests with rigging and writing.
+        jobs = (
+            (mesh_generator._random_mesh_request(),
+             os.path.join(
+                 args.output_directory,
+                 'rigged_mesh_{:02}.fbx'.format(mesh_index)))
+            for mesh_index in range(args.num_meshes))
+        with RigPool(num_workers=args.num_workers) as pool:
+            pipeline = RigPipeline(
+                pool, lambda request: mesh_generator.get_mesh_for_measurements(
+                    *request))
+            for result in pipeline.run(jobs):
+                if result.error is not None:
+                    print 'Failed to rig {}:\n{}'.format(
+                        result.output_path, result.error)
+                else:
+                    print 'Generated rigged mesh {}'.format(result.index)
+            print pipeline.metrics()
+        return
+
+    factory = RiggedModelFactory.create_default()
+
+    manager = create_fbx_manager()
+    for mesh, output_path in generate_meshes():
         rigged_mesh = factory.construct_rig(mesh, manager)
-        output_path = os.path.join(
-            args.output_directory, 'rigged_mesh_{:02}.fbx'.format(mesh_index))
         export_fbx_scene(manager, rigged_mesh, output_path)
         rigged_mesh.Destroy()
     manager.Destroy()
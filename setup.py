@@ -15,9 +15,17 @@ setup(
     license='BSD',
     packages=find_packages(),
     package_data={
-        'bodylabs_rigger.static': ['rig_assets.json']
+        'bodylabs_rigger.static': ['rig_assets.json', 'rig_assets.bin']
     },
     install_requires=install_requires,
+    extras_require={
+        'skinning': ['scipy>=0.14.0'],
+    },
+    entry_points={
+        'console_scripts': [
+            'bodylabs-rig = bodylabs_rigger.cli:main',
+        ],
+    },
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Developers',